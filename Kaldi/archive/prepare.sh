@@ -1,13 +1,21 @@
 #!/bin/bash
 . ./path.sh || exit 1
 . ./cmd.sh || exit 1
-nj=1      # number of parallel jobs - 1 is perfect for such a small dataset
+nj=${NUM_JOBS:-1}      # number of parallel jobs (exported by path.sh)
 lm_order=1 # language model order (n-gram quantity) - 1 is enough for our grammar
+incremental=false # only remove the stale artefacts reported by data_preparation.py
 # Safety mechanism (possible running this script with modified arguments)
 . utils/parse_options.sh || exit 1
 [[ $# -ge 1 ]] && { echo "Wrong arguments!"; exit 1; }
 # Removing previously created data (from last run.sh execution)
-rm -rf exp mfcc data/train/spk2utt data/train/cmvn.scp data/train/feats.scp data/train/split1 data/test/spk2utt data/test/cmvn.scp data/test/feats.scp data/test/split1 data/local/lang data/lang data/local/tmp data/local/dict/lexiconp.txt
+if $incremental; then
+  # stale_artefacts.txt lists the features, models & decodings made out-dated by data_preparation.py
+  [ -f stale_artefacts.txt ] && xargs rm -rf < stale_artefacts.txt
+  rm -f stale_artefacts.txt
+  rm -rf data/local/lang data/lang data/local/tmp data/local/dict/lexiconp.txt
+else
+  rm -rf exp mfcc data/train/cmvn.scp data/train/feats.scp data/test/cmvn.scp data/test/feats.scp data/local/lang data/lang data/local/tmp data/local/dict/lexiconp.txt stale_artefacts.txt
+fi
 echo
 echo "===== PREPARING ACOUSTIC DATA ====="
 echo
@@ -17,26 +25,27 @@ echo
 # wav.scp     [<uterranceID> <full_path_to_audio_file>]
 # text        [<uterranceID> <text_transcription>]
 # utt2spk     [<uterranceID> <speakerID>]
+# spk2utt     [<speakerID> <uterranceID> ...]
+# utt2dur     [<uterranceID> <duration>]
 # corpus.txt  [<text_transcription>]
-# Making spk2utt files
-echo "create spk2utt for training"
-utils/utt2spk_to_spk2utt.pl data/train/utt2spk > data/train/spk2utt
-echo "create spk2utt for testing"
-utils/utt2spk_to_spk2utt.pl data/test/utt2spk > data/test/spk2utt
+# (all of them are created by data_preparation.py)
 echo
 echo "===== FEATURES EXTRACTION ====="
 echo
 # Making feats.scp files
 mfccdir=mfcc
-# Uncomment and modify arguments in scripts below if you have any problems with data sorting
-utils/validate_data_dir.sh data/train     # script for checking prepared data - here: for data/train directory
-utils/fix_data_dir.sh data/train          # tool for data proper sorting if needed - here: for data/train directory
+# data_preparation.py writes the data directories already sorted, so no fix_data_dir.sh is needed
+utils/validate_data_dir.sh --no-feats data/train     # script for checking prepared data - here: for data/train directory
+utils/validate_data_dir.sh --no-feats data/test
 
-steps/make_mfcc.sh --nj $nj --cmd "$train_cmd" data/train exp/make_mfcc/train $mfccdir
-steps/make_mfcc.sh --nj $nj --cmd "$train_cmd" data/test exp/make_mfcc/test $mfccdir
-# Making cmvn.scp files
-steps/compute_cmvn_stats.sh data/train exp/make_mfcc/train $mfccdir
-steps/compute_cmvn_stats.sh data/test exp/make_mfcc/test $mfccdir
+for x in train test; do
+  # the features that are still up-to-date are kept in the incremental mode
+  if [ ! -f data/$x/feats.scp ]; then
+    steps/make_mfcc.sh --nj $nj --cmd "$train_cmd" data/$x exp/make_mfcc/$x $mfccdir
+    # Making cmvn.scp files
+    steps/compute_cmvn_stats.sh data/$x exp/make_mfcc/$x $mfccdir
+  fi
+done
 echo
 echo "===== PREPARING LANGUAGE DATA ====="
 echo
@@ -69,7 +78,7 @@ if [ -z $loc ]; then
         fi
 fi
 local=data/local
-mkdir $local/tmp
+mkdir -p $local/tmp
 ngram-count -order $lm_order -write-vocab $local/tmp/vocab-full.txt -wbdiscount -text $local/corpus.txt -lm $local/tmp/lm.arpa
 echo
 echo "===== MAKING G.fst ====="
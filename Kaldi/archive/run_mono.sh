@@ -1,7 +1,7 @@
 #!/bin/bash
 . ./path.sh || exit 1
 . ./cmd.sh || exit 1
-nj=1      # number of parallel jobs - 1 is perfect for such a small dataset
+nj=${NUM_JOBS:-1}      # number of parallel jobs (exported by path.sh)
 lm_order=1 # language model order (n-gram quantity) - 1 is enough for our grammar
 # Safety mechanism (possible running this script with modified arguments)
 . utils/parse_options.sh || exit 1
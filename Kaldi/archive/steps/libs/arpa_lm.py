@@ -0,0 +1,272 @@
+
+
+# Apache 2.0
+
+""" This module contains an ARPA language model stored as an integer trie
+that scores batches of sentences with numpy, and that can be saved in a
+binary format which is memory-mapped when loaded.
+
+Example usage:
+lm = ArpaLm.read_arpa("data/local/lm/lm.arpa")
+lm.save("data/local/lm/lm.trie")
+...
+lm = ArpaLm.load("data/local/lm/lm.trie")
+logprobs = lm.sentence_logprobs([["hello", "world"], ["hi"]])
+"""
+
+from __future__ import print_function
+from __future__ import division
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from libs.arpa_reader import ArpaReader
+
+# The first bytes of the binary format.
+BINARY_MAGIC = b'KALDIARPALM\x00\x01\x00\x00\x00'
+
+
+class ArpaLm(object):
+    """ This class stores a back-off n-gram language model as a trie of sorted
+    arrays.  Words are represented by their index in the unigram section.  For
+    each order n (1-based), the n-grams are stored in parallel arrays:
+        logprobs[n-1]: the log10 probability of each n-gram,
+        backoffs[n-1]: the log10 back-off weight of each n-gram (0.0 if none),
+        keys[n-1]: for n > 1, the key of each n-gram, which is
+            (index of its history among the (n-1)-grams) * num_words + (its last word),
+            sorted, so that an n-gram is found with a binary search.
+    The unigrams are indexed by their word-id, so keys[0] is None.
+    """
+
+    def __init__(self, words, keys, logprobs, backoffs, unk_symbol='<unk>'):
+        self.words = words
+        self.word_to_id = dict((w, i) for i, w in enumerate(words))
+        self.keys = keys
+        self.logprobs = logprobs
+        self.backoffs = backoffs
+        self.order = len(logprobs)
+        self.unk_id = self.word_to_id.get(unk_symbol, -1)
+
+    def num_ngrams(self, n):
+        return len(self.logprobs[n - 1])
+
+    def lookup(self, n, history, word_ids):
+        """ Returns the index among the n-grams of (history, word) for arrays
+        of histories (indexes among the (n-1)-grams) and word-ids, with -1 for
+        the n-grams that are not in the model or whose history is -1.
+        """
+        word_ids = np.asarray(word_ids, dtype=np.int64)
+        if n == 1:
+            return np.where((word_ids >= 0) & (word_ids < len(self.words)), word_ids, -1)
+        keys = self.keys[n - 1]
+        if len(keys) == 0:
+            return np.full(len(word_ids), -1, dtype=np.int64)
+        history = np.asarray(history, dtype=np.int64)
+        query = history * len(self.words) + word_ids
+        pos = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+        return np.where((history >= 0) & (keys[pos] == query), pos, -1)
+
+    def ngram_index(self, word_ids):
+        """ Returns the index of n-grams given as a 2-d array of word-ids (one
+        n-gram per row) among the n-grams of their order, or -1 if not found.
+        """
+        word_ids = np.asarray(word_ids, dtype=np.int64)
+        index = self.lookup(1, None, word_ids[:, 0])
+        for k in range(1, word_ids.shape[1]):
+            index = self.lookup(k + 1, index, word_ids[:, k])
+        return index
+
+    def word_ids(self, words):
+        """ Returns the word-ids of 'words', where the words that are not in
+        the model are replaced by <unk>.
+        """
+        ids = np.array([self.word_to_id.get(w, self.unk_id) for w in words], dtype=np.int64)
+        if len(ids) > 0 and ids.min() < 0:
+            oov = [w for w in words if w not in self.word_to_id][0]
+            raise ValueError("Word '{0}' is not in the language model, which "
+                             "has no <unk> either".format(oov))
+        return ids
+
+    def token_logprobs(self, ids, lengths, ngram_order=None):
+        """ Returns the log10 probability of every token given its history
+        (of at most ngram_order - 1 words), for sentences given as the
+        concatenation 'ids' of their word-ids and their 'lengths'.  The first
+        token of each sentence (normally <s>) is not predicted and gets 0.
+
+        p(w | h) is the probability of the n-gram (h, w) if it is in the model,
+        otherwise p(w | h without its first word) times the back-off weight of
+        h (1 if h is not in the model), see https://cmusphinx.github.io/wiki/arpaformat/
+        """
+        order = self.order if ngram_order is None else ngram_order
+        if not 0 < order <= self.order:
+            raise ValueError("Invalid ngram_order {0} (the order of the "
+                             "model is {1})".format(ngram_order, self.order))
+        ids = np.asarray(ids, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        starts = np.cumsum(lengths) - lengths
+        pos_in_sentence = np.arange(len(ids), dtype=np.int64) - np.repeat(starts, lengths)
+
+        # index[k][t] is the index of the (k+1)-gram ending at token t, or -1,
+        # and history[k][t] is the index of the k-gram ending at token t-1
+        # (the history of length k of token t), or -1.
+        index = [self.lookup(1, None, ids)]
+        history = [None]
+        for k in range(1, order):
+            history.append(np.full(len(ids), -1, dtype=np.int64))
+            history[k][1:] = index[k - 1][:-1]
+            history[k][pos_in_sentence < k] = -1
+            index.append(self.lookup(k + 1, history[k], ids))
+
+        # the probability of the longest n-gram found...
+        logprob = np.zeros(len(ids))
+        longest = np.zeros(len(ids), dtype=np.int64)
+        for k in range(order - 1, -1, -1):
+            found = (longest == 0) & (index[k] >= 0)
+            logprob[found] = self.logprobs[k][index[k][found]]
+            longest[found] = k + 1
+
+        # ... plus the back-off weights of the histories longer than that
+        # n-gram's history, from the shortest to the longest.
+        max_history = np.minimum(pos_in_sentence, order - 1)
+        for k in range(1, order):
+            use = (k >= longest) & (k <= max_history) & (history[k] >= 0)
+            logprob[use] += self.backoffs[k - 1][history[k][use]]
+        predicted = pos_in_sentence > 0
+        logprob[~predicted] = 0.0
+        return logprob
+
+    def sentence_logprobs(self, sentences, ngram_order=None,
+                          bos_symbol='<s>', eos_symbol='</s>'):
+        """ Returns the log10 probability of each sentence (a list of words,
+        without <s> and </s>) as a numpy array.
+        """
+        words = []
+        lengths = []
+        for sentence in sentences:
+            words.append(bos_symbol)
+            words.extend(sentence)
+            words.append(eos_symbol)
+            lengths.append(len(sentence) + 2)
+        token_logprobs = self.token_logprobs(self.word_ids(words), lengths, ngram_order)
+        sentence_index = np.repeat(np.arange(len(lengths)), lengths)
+        # np.bincount() adds the tokens of each sentence in order.
+        return np.bincount(sentence_index, weights=token_logprobs, minlength=len(lengths))
+
+    @classmethod
+    def read_arpa(cls, arpa_path, encoding='utf-8', unk_symbol='<unk>'):
+        """ Reads a language model in ARPA format.  Every history of an n-gram
+        must be an (n-1)-gram of the model (as ARPA requires).
+        """
+        with ArpaReader(arpa_path, encoding) as reader:
+            orders = reader.read_orders()
+            words = reader.words
+
+        unigrams = orders[0]
+        if len(words) != len(unigrams.logprobs):
+            raise ValueError("Duplicated unigram in {0}".format(arpa_path))
+        lm = cls(words[:len(unigrams.logprobs)], [None], [unigrams.logprobs],
+                 [np.where(unigrams.has_backoff(), unigrams.backoffs, 0.0)], unk_symbol)
+
+        for block in orders[1:]:
+            n = block.order
+            word_ids = block.word_ids.astype(np.int64)
+            if word_ids.size > 0 and word_ids.max() >= len(lm.words):
+                i = int(np.flatnonzero(word_ids.max(axis=1) >= len(lm.words))[0])
+                raise ValueError("The {0}-gram '{1}' of {2} has a word which is not in "
+                                 "the unigrams".format(n, ' '.join(words[w] for w in word_ids[i]),
+                                                       arpa_path))
+            history = lm.ngram_index(word_ids[:, :-1])
+            if np.any(history < 0):
+                i = int(np.flatnonzero(history < 0)[0])
+                raise ValueError("The history of the {0}-gram '{1}' is not in "
+                                 "{2}".format(n, ' '.join(words[w] for w in word_ids[i]), arpa_path))
+            keys = history * len(lm.words) + word_ids[:, -1]
+            sorted_order = np.argsort(keys, kind='stable')
+            keys = keys[sorted_order]
+            duplicates = np.flatnonzero(keys[1:] == keys[:-1])
+            if len(duplicates) > 0:
+                i = int(sorted_order[duplicates[0]])
+                raise ValueError("Duplicated {0}-gram in {1}: {2}".format(
+                    n, arpa_path, ' '.join(words[w] for w in word_ids[i])))
+            lm.keys.append(keys)
+            lm.logprobs.append(block.logprobs[sorted_order])
+            lm.backoffs.append(np.where(block.has_backoff(), block.backoffs, 0.0)[sorted_order])
+        lm.order = len(lm.logprobs)
+        return lm
+
+    def save(self, path):
+        """ Saves the model in a binary format that load() memory-maps:
+        BINARY_MAGIC, the size of a json header (uint64), the json header
+        (order, number of words, name/dtype/offset/size of the arrays) and
+        the arrays, every one starting at a multiple of 8 bytes.
+        """
+        vocab = np.frombuffer('\n'.join(self.words).encode('utf-8'), dtype=np.uint8)
+        arrays = [('vocab', vocab)]
+        for n in range(1, self.order + 1):
+            if n > 1:
+                arrays.append(('keys{0}'.format(n), self.keys[n - 1]))
+            arrays.append(('logprobs{0}'.format(n), self.logprobs[n - 1]))
+            arrays.append(('backoffs{0}'.format(n), self.backoffs[n - 1]))
+
+        header = {'order': self.order, 'num_words': len(self.words), 'arrays': []}
+        offset = 0
+        for name, array in arrays:
+            array = np.ascontiguousarray(array)
+            header['arrays'].append([name, array.dtype.str, offset, len(array)])
+            offset += (array.nbytes + 7) // 8 * 8
+        header = json.dumps(header).encode('utf-8')
+        header += b' ' * (-(len(BINARY_MAGIC) + 8 + len(header)) % 8)
+
+        with open(path, 'wb') as f:
+            f.write(BINARY_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for name, array in arrays:
+                data = np.ascontiguousarray(array).tobytes()
+                f.write(data)
+                f.write(b'\0' * (-len(data) % 8))
+
+    @classmethod
+    def load(cls, path, unk_symbol='<unk>'):
+        """ Loads a model saved by save().  The arrays are numpy views of a
+        read-only memory mapping of the file, so loading is almost instant and
+        the pages are shared by the processes using the same model.
+        """
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            raise ValueError("{0} is not a binary language model".format(path))
+        pos = len(BINARY_MAGIC)
+        header_size = struct.unpack('<Q', buf[pos:pos + 8])[0]
+        header = json.loads(buf[pos + 8:pos + 8 + header_size].decode('utf-8'))
+        data_start = pos + 8 + header_size
+
+        arrays = {}
+        for name, dtype, offset, size in header['arrays']:
+            arrays[name] = np.frombuffer(buf, dtype=np.dtype(dtype), count=size,
+                                         offset=data_start + offset)
+        words = arrays['vocab'].tobytes().decode('utf-8').split('\n')
+        if header['num_words'] == 0:
+            words = []
+        assert len(words) == header['num_words']
+        order = header['order']
+        return cls(words,
+                   [None] + [arrays['keys{0}'.format(n)] for n in range(2, order + 1)],
+                   [arrays['logprobs{0}'.format(n)] for n in range(1, order + 1)],
+                   [arrays['backoffs{0}'.format(n)] for n in range(1, order + 1)],
+                   unk_symbol)
+
+    @classmethod
+    def read(cls, path, encoding='utf-8', unk_symbol='<unk>'):
+        """ Loads a model in binary format (see save()) or reads it in ARPA format. """
+        if is_binary_lm(path):
+            return cls.load(path, unk_symbol)
+        return cls.read_arpa(path, encoding, unk_symbol)
+
+
+def is_binary_lm(path):
+    with open(path, 'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
@@ -0,0 +1,194 @@
+
+
+# Apache 2.0
+
+""" This module contains a streaming reader of language models in ARPA
+format, shared by the scripts that read ARPA files.  The n-grams are read
+line by line and returned in blocks of columnar numpy arrays, so the memory
+used while reading is bounded by the block size whatever the size of the
+ARPA file.
+
+Example usage:
+with ArpaReader("lm.arpa") as reader:
+    print(reader.counts)  # the number of n-grams of each order from \\data\\
+    for block in reader:
+        # block.order, block.word_ids, block.logprobs, block.backoffs
+        words = [reader.words[i] for i in block.word_ids[0]]
+"""
+
+from __future__ import print_function
+from __future__ import division
+import collections
+import gzip
+import io
+import sys
+
+import numpy as np
+
+
+class ArpaBlock(collections.namedtuple(
+        'ArpaBlock', ['order', 'word_ids', 'logprobs', 'backoffs'])):
+    """ A block of consecutive n-grams of the same order:
+        order: the order n of the n-grams,
+        word_ids: an int32 array of shape (number of n-grams, n) of word-ids
+            (the index of each word in ArpaReader.words),
+        logprobs: the log10 probability of each n-gram,
+        backoffs: the log10 back-off weight of each n-gram, NaN if the n-gram
+            has no back-off weight in the file.
+    """
+    __slots__ = ()
+
+    def has_backoff(self):
+        return ~np.isnan(self.backoffs)
+
+
+class ArpaReader(object):
+    """ This class reads an ARPA file (or a file object) in blocks of at most
+    'block_size' n-grams.  The \\data\\ section is read by the constructor,
+    which sets self.counts (self.counts[n-1] is the number of n-grams of order
+    n).  Words are numbered in the order they are first seen, so the unigrams
+    have the word-ids 0, 1, ... if there are no duplicates.  Iterating over
+    the reader yields ArpaBlock's; ValueError is raised if the file is not
+    valid ARPA or if the number of n-grams of an order does not match the
+    \\data\\ section.
+    """
+
+    def __init__(self, arpa_in, encoding='utf-8', block_size=100000):
+        if hasattr(arpa_in, 'read'):
+            self.name = getattr(arpa_in, 'name', '<stream>')
+            self.f = arpa_in
+            self.own_file = False
+        else:
+            self.name = arpa_in
+            if arpa_in == '-' or arpa_in == '':
+                self.f = io.open(sys.stdin.fileno(), encoding=encoding, closefd=False)
+            elif arpa_in.endswith('.gz'):
+                self.f = io.TextIOWrapper(gzip.open(arpa_in, 'rb'), encoding=encoding)
+            else:
+                self.f = io.open(arpa_in, encoding=encoding)
+            self.own_file = True
+        self.block_size = block_size
+        self.words = []
+        self.word_to_id = dict()
+        self.counts = []
+        self._read_header()
+
+    def _error(self, message, line=None):
+        if line is not None:
+            message += ': ' + line.strip()
+        raise ValueError("Reading ARPA file {0}: {1}".format(self.name, message))
+
+    def _read_header(self):
+        for line in self.f:
+            line = line.strip()
+            if line == '\\data\\':
+                break
+            if line != '':
+                self._error("expected \\data\\", line)
+        else:
+            self._error("got EOF looking for \\data\\")
+        self.next_line = None
+        for line in self.f:
+            stripped = line.strip()
+            if stripped.startswith('ngram'):
+                a = stripped[len('ngram'):].split('=')  # e.g. a = [' 1', '1264']
+                try:
+                    n, count = int(a[0]), int(a[1])
+                except (ValueError, IndexError):
+                    self._error("read something unexpected in header", line)
+                if n != len(self.counts) + 1 or count < 0:
+                    self._error("read something unexpected in header", line)
+                self.counts.append(count)
+            elif stripped != '':
+                self.next_line = stripped
+                break
+        if len(self.counts) == 0:
+            self._error("read no n-gram counts in the \\data\\ section")
+
+    def word_id(self, word):
+        i = self.word_to_id.get(word)
+        if i is None:
+            i = len(self.words)
+            self.word_to_id[word] = i
+            self.words.append(word)
+        return i
+
+    def _make_block(self, order, word_ids, logprobs, backoffs):
+        return ArpaBlock(order,
+                         np.array(word_ids, dtype=np.int32).reshape(-1, order),
+                         np.array(logprobs, dtype=np.float64),
+                         np.array(backoffs, dtype=np.float64))
+
+    def __iter__(self):
+        line = self.next_line
+        nan = float('nan')
+        for order in range(1, len(self.counts) + 1):
+            while line == '':
+                line = next(self.f, None)
+                if line is None:
+                    self._error("got EOF looking for the {0}-grams".format(order))
+                line = line.strip()
+            if line != '\\{0}-grams:'.format(order):
+                self._error("expected \\{0}-grams:".format(order), line)
+
+            num_read = 0
+            word_ids, logprobs, backoffs = [], [], []
+            for line in self.f:
+                a = line.split()
+                if len(a) == 0:
+                    continue
+                if len(a) == 1 and a[0][0] == '\\':
+                    break
+                if len(a) != order + 1 and len(a) != order + 2:
+                    self._error("in {0}-grams section, got bad line".format(order), line)
+                try:
+                    logprobs.append(float(a[0]))
+                    backoffs.append(float(a[order + 1]) if len(a) == order + 2 else nan)
+                except ValueError:
+                    self._error("in {0}-grams section, got bad line".format(order), line)
+                for w in a[1:order + 1]:
+                    word_ids.append(self.word_id(w))
+                num_read += 1
+                if len(logprobs) == self.block_size:
+                    yield self._make_block(order, word_ids, logprobs, backoffs)
+                    word_ids, logprobs, backoffs = [], [], []
+            else:
+                line = ''
+            line = line.strip()
+            if logprobs:
+                yield self._make_block(order, word_ids, logprobs, backoffs)
+            if num_read != self.counts[order - 1]:
+                self._error("read {0} {1}-grams but the \\data\\ section says "
+                            "{2}".format(num_read, order, self.counts[order - 1]))
+
+        while line == '':
+            line = next(self.f, None)
+            if line is None:
+                self._error("got EOF looking for \\end\\")
+            line = line.strip()
+        if line != '\\end\\':
+            self._error("expected \\end\\", line)
+
+    def read_orders(self):
+        """ Reads all the n-grams and returns a list of ArpaBlock's, one for
+        each order (the blocks of each order concatenated).
+        """
+        blocks = [[] for n in self.counts]
+        for block in self:
+            blocks[block.order - 1].append(block)
+        return [ArpaBlock(n + 1,
+                          np.concatenate([b.word_ids for b in blocks[n]]
+                                         or [np.zeros((0, n + 1), dtype=np.int32)]),
+                          np.concatenate([b.logprobs for b in blocks[n]] or [np.zeros(0)]),
+                          np.concatenate([b.backoffs for b in blocks[n]] or [np.zeros(0)]))
+                for n in range(len(self.counts))]
+
+    def close(self):
+        if self.own_file:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -454,7 +454,15 @@ def read_mat_ark(file_or_fd):
 
     Example usage:
     mat_dict = { key: mat for key, mat in read_mat_ark(file) }
+    Binary archives (given by path) are read by read_mat_ark_binary()
+    and their matrices are numpy arrays.
     """
+    if isinstance(file_or_fd, str) and os.path.isfile(file_or_fd) \
+            and is_binary_ark(file_or_fd):
+        for key, mat in read_mat_ark_binary(file_or_fd):
+            yield key, mat
+        return
+
     try:
         fd = open(file_or_fd, 'r')
         fname = file_or_fd
@@ -474,6 +482,306 @@ def read_mat_ark(file_or_fd):
             fd.close()
 
 
+# Binary Kaldi objects: "\0B" followed by a type token, which is written with
+# a trailing space like any token (e.g. "FM " but "CM2 ").  The matrices &
+# vectors are read as numpy arrays (numpy is only imported by the functions
+# below).
+_BINARY_FLOAT_TOKENS = {b'FM': ('<f4', 2), b'DM': ('<f8', 2),
+                        b'FV': ('<f4', 1), b'DV': ('<f8', 1)}
+# the CompressedMatrix formats: kOneByteWithColHeaders, kTwoByte & kOneByte.
+_BINARY_COMPRESSED_TOKENS = (b'CM', b'CM2', b'CM3')
+
+
+def _read_binary_int32(buf, pos):
+    """ Reads a size-prefixed int32 (b'\x04' + 4 bytes) at 'pos' of 'buf'. """
+    import struct
+    if buf[pos:pos + 1] != b'\x04':
+        raise ValueError("Expected an int32 at offset {0}".format(pos))
+    return struct.unpack('<i', buf[pos + 1:pos + 5])[0], pos + 5
+
+
+def _uncompress_matrix(buf, pos, token):
+    """ Uncompresses a CompressedMatrix (written by copy-feats --compress=true)
+    whose header starts at 'pos' of 'buf'.  Returns the float32 matrix and
+    the offset just after it.
+    """
+    import numpy as np
+    import struct
+    min_value, value_range, num_rows, num_cols = struct.unpack(
+        '<ffii', buf[pos:pos + 16])
+    pos += 16
+    if token == b'CM2':
+        # kTwoByte: uint16 data stored row by row.
+        count = num_rows * num_cols
+        data = np.frombuffer(buf, dtype='<u2', count=count, offset=pos)
+        mat = min_value + value_range * (1.0 / 65535.0) * data.astype(np.float32)
+        return mat.reshape(num_rows, num_cols).astype(np.float32), pos + 2 * count
+    if token == b'CM3':
+        # kOneByte: uint8 data stored row by row.
+        count = num_rows * num_cols
+        data = np.frombuffer(buf, dtype='u1', count=count, offset=pos)
+        mat = min_value + value_range * (1.0 / 255.0) * data.astype(np.float32)
+        return mat.reshape(num_rows, num_cols).astype(np.float32), pos + count
+    # kOneByteWithColHeaders: per-column percentiles (4 x uint16) followed by
+    # uint8 data stored column by column.
+    headers = np.frombuffer(buf, dtype='<u2', count=4 * num_cols, offset=pos)
+    pos += 8 * num_cols
+    percentiles = min_value + value_range * (1.0 / 65535.0) * \
+        headers.reshape(num_cols, 4).astype(np.float32)
+    p0, p25, p75, p100 = [percentiles[:, i:i + 1] for i in range(4)]
+    data = np.frombuffer(buf, dtype='u1', count=num_rows * num_cols, offset=pos)
+    data = data.reshape(num_cols, num_rows).astype(np.float32)
+    mat = np.where(data <= 64, p0 + (p25 - p0) * data * (1.0 / 64.0),
+                   np.where(data <= 192, p25 + (p75 - p25) * (data - 64) * (1.0 / 128.0),
+                            p75 + (p100 - p75) * (data - 192) * (1.0 / 63.0)))
+    return mat.T.astype(np.float32), pos + num_rows * num_cols
+
+
+def _compress_matrix(mat, token):
+    """ Compresses the matrix 'mat' like Kaldi's CompressedMatrix in the
+    format of 'token' (b'CM', b'CM2' or b'CM3').  Returns the bytes that follow
+    the token: the global header (min value, range, rows, cols) and the data.
+    """
+    import numpy as np
+    import struct
+    mat = np.asarray(mat, dtype=np.float32)
+    num_rows, num_cols = mat.shape
+    if mat.size == 0:
+        # like Kaldi, an empty matrix is written as 0 x 0.
+        return struct.pack('<ffii', 0.0, 0.0, 0, 0)
+    min_value, max_value = mat.min(), mat.max()
+    if max_value == min_value:
+        max_value = min_value + np.float32(1.0 + abs(min_value))
+    value_range = max_value - min_value
+    header = struct.pack('<ffii', min_value, value_range, num_rows, num_cols)
+
+    def to_fraction(values):
+        return np.clip((values - min_value) / value_range, 0.0, 1.0)
+
+    if token == b'CM2':
+        data = (to_fraction(mat) * 65535 + 0.499).astype('<u2')
+        return header + data.tobytes()
+    if token == b'CM3':
+        data = (to_fraction(mat) * 255 + 0.499).astype('u1')
+        return header + data.tobytes()
+
+    # kOneByteWithColHeaders: the 0th, 25th, 75th and 100th percentiles of
+    # every column (as uint16 in the global range, strictly increasing), then
+    # every value coded in one byte by linear interpolation between them.
+    sorted_mat = np.sort(mat, axis=0)
+    if num_rows >= 5:
+        quarter = num_rows // 4
+        rows = [0, quarter, 3 * quarter, num_rows - 1]
+    else:
+        rows = list(range(num_rows)) + [None] * (4 - num_rows)
+    headers = np.zeros((4, num_cols), dtype=np.int64)
+    for i, row in enumerate(rows):
+        if row is not None:
+            headers[i] = (to_fraction(sorted_mat[row]) * 65535 + 0.499).astype(np.int64)
+        if i > 0:
+            headers[i] = np.maximum(headers[i], headers[i - 1] + 1)
+        if i < 3:
+            headers[i] = np.minimum(headers[i], 65532 + i)
+    p0, p25, p75, p100 = min_value + value_range * (1.0 / 65535.0) * \
+        headers.astype(np.float32)
+    low = np.clip(np.trunc((mat - p0) / (p25 - p0) * 64 + 0.5), 0, 64)
+    middle = np.clip(64 + np.trunc((mat - p25) / (p75 - p25) * 128 + 0.5), 64, 192)
+    high = np.clip(192 + np.trunc((mat - p75) / (p100 - p75) * 63 + 0.5), 192, 255)
+    data = np.where(mat < p25, low, np.where(mat < p75, middle, high)).astype('u1')
+    return header + headers.T.astype('<u2').tobytes() + data.T.tobytes()
+
+
+def read_binary_object(buf, pos=0):
+    """ Reads a binary Kaldi matrix or vector ("\0B" + FM/DM/FV/DV/CM/CM2/CM3)
+    starting at offset 'pos' of 'buf', which can be any bytes-like object
+    (e.g. an mmap).  FM/DM/FV/DV are returned as read-only numpy views of 'buf'
+    without copying; compressed matrices are uncompressed into float32.
+    Returns the numpy array and the offset just after the object.
+    """
+    import numpy as np
+    if buf[pos:pos + 2] != b'\0B':
+        raise ValueError("Expected a binary Kaldi object at offset {0}; "
+                         "only binary archives can be read".format(pos))
+    # the token is read up to its trailing space, like Kaldi's ReadToken().
+    head = bytes(buf[pos + 2:pos + 8])
+    space = head.find(b' ')
+    if space < 0:
+        raise ValueError("Expected a token at offset {0}".format(pos + 2))
+    token = head[:space]
+    pos += 2 + space + 1
+    if token in _BINARY_COMPRESSED_TOKENS:
+        return _uncompress_matrix(buf, pos, token)
+    if token not in _BINARY_FLOAT_TOKENS:
+        raise ValueError("Unsupported binary Kaldi object {0!r}".format(token))
+    dtype, ndim = _BINARY_FLOAT_TOKENS[token]
+    dtype = np.dtype(dtype)
+    if ndim == 2:
+        num_rows, pos = _read_binary_int32(buf, pos)
+        num_cols, pos = _read_binary_int32(buf, pos)
+        shape = (num_rows, num_cols)
+    else:
+        dim, pos = _read_binary_int32(buf, pos)
+        shape = (dim,)
+    count = int(np.prod(shape))
+    obj = np.frombuffer(buf, dtype=dtype, count=count, offset=pos).reshape(shape)
+    return obj, pos + count * dtype.itemsize
+
+
+def write_binary_object(fd, obj, key=None, compression=None):
+    """ Writes the numpy matrix or vector 'obj' in binary Kaldi format into
+    the opened binary file descriptor 'fd'.  float64 objects are written as
+    DM/DV and all the others as FM/FV.  If key is provided, the object is
+    written as an archive entry.  If compression is 'CM' (the format of
+    copy-feats --compress=true), 'CM2' (two bytes per value) or 'CM3' (one
+    byte per value), the matrix is written as a CompressedMatrix.
+    Returns the offset of the object in 'fd', as used in .scp files.
+    """
+    import numpy as np
+    import struct
+    obj = np.asarray(obj)
+    if compression is not None:
+        token = compression.encode('ascii')
+        if token not in _BINARY_COMPRESSED_TOKENS or obj.ndim != 2:
+            raise ValueError("Only matrices can be compressed, as one of "
+                             "CM, CM2 or CM3 (got {0})".format(compression))
+        body = _compress_matrix(obj, token)
+        if key is not None:
+            fd.write(key.encode('utf-8') + b' ')
+        offset = fd.tell()
+        fd.write(b'\0B' + token + b' ' + body)
+        return offset
+    double = obj.dtype == np.float64
+    obj = np.ascontiguousarray(obj, dtype='<f8' if double else '<f4')
+    if key is not None:
+        fd.write(key.encode('utf-8') + b' ')
+    offset = fd.tell()
+    if obj.ndim == 2:
+        fd.write(b'\0B' + (b'DM ' if double else b'FM ') +
+                 struct.pack('<bibi', 4, obj.shape[0], 4, obj.shape[1]))
+    elif obj.ndim == 1:
+        fd.write(b'\0B' + (b'DV ' if double else b'FV ') +
+                 struct.pack('<bi', 4, obj.shape[0]))
+    else:
+        raise ValueError("Only matrices and vectors can be written, "
+                         "got {0} dimensions".format(obj.ndim))
+    fd.write(obj.tobytes())
+    return offset
+
+
+class MappedArk(object):
+    """ This class maps a binary Kaldi archive into memory.  The entries can be
+    iterated in order or read at a given offset (from a .scp file), and the
+    uncompressed matrices & vectors are numpy views of the mapping.
+    Note: the mapping stays open as long as any of these views is alive.
+    """
+
+    def __init__(self, ark_path):
+        import mmap
+        self.ark_path = ark_path
+        with open(ark_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self.buf = b''
+            else:
+                self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_at(self, offset):
+        """ Returns the object at 'offset' (the part after ':' in a .scp). """
+        return read_binary_object(self.buf, offset)[0]
+
+    def __iter__(self):
+        pos = 0
+        size = len(self.buf)
+        while pos < size:
+            end = self.buf.find(b' ', pos)
+            if end < 0:
+                raise ValueError("Truncated archive {0}".format(self.ark_path))
+            key = bytes(self.buf[pos:end]).decode('utf-8').strip()
+            obj, pos = read_binary_object(self.buf, end + 1)
+            yield key, obj
+            # skip the new lines between the entries (if any)
+            while pos < size and self.buf[pos:pos + 1] in (b'\n', b'\r'):
+                pos += 1
+
+
+class ScpReader(object):
+    """ This class gives random access by key to the binary objects listed in
+    a .scp file like feats.scp, where every line is "<key> <ark>:<offset>".
+    The index of the offsets is built once from the .scp and every archive is
+    mapped once, so reading an entry is a seek-free numpy view.
+
+    Example usage:
+    feats = ScpReader("data/train/feats.scp")
+    mat = feats["utt1"]
+    for key, mat in feats: ...
+    """
+
+    def __init__(self, scp_path):
+        self.index = {}
+        self.keys = []
+        self.arks = {}
+        with open(scp_path) as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                key, rxfilename = parts[0], " ".join(parts[1:])
+                ark_path, sep, offset = rxfilename.rpartition(':')
+                if not sep or not offset.isdigit():
+                    raise ValueError("Only <ark>:<offset> entries are supported "
+                                     "in {0}, got: {1}".format(scp_path, rxfilename))
+                self.index[key] = (ark_path, int(offset))
+                self.keys.append(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        ark_path, offset = self.index[key]
+        if ark_path not in self.arks:
+            self.arks[ark_path] = MappedArk(ark_path)
+        return self.arks[ark_path].read_at(offset)
+
+    def __iter__(self):
+        for key in self.keys:
+            yield key, self[key]
+
+
+def is_binary_ark(ark_path):
+    """ Returns True if the archive 'ark_path' is in binary format. """
+    with open(ark_path, 'rb') as f:
+        head = f.read(4096)
+    space = head.find(b' ')
+    return space >= 0 and head[space + 1:space + 3] == b'\0B'
+
+
+def read_mat_ark_binary(ark_path):
+    """This function reads a binary kaldi archive of matrices/vectors
+    and yields (key, numpy array) without going through the text format.
+    """
+    for key, mat in MappedArk(ark_path):
+        yield key, mat
+
+
+def write_mat_ark_binary(ark_path, items, scp_path=None, compression=None):
+    """This function writes (key, matrix) items into a binary kaldi archive,
+    and into its .scp file if scp_path is provided (like ark,scp:a.ark,a.scp).
+    See write_binary_object() for compression.
+    """
+    scp = open(scp_path, 'w') if scp_path is not None else None
+    try:
+        with open(ark_path, 'wb') as f:
+            for key, mat in items:
+                offset = write_binary_object(f, mat, key=key, compression=compression)
+                if scp is not None:
+                    scp.write("{0} {1}:{2}\n".format(key, ark_path, offset))
+    finally:
+        if scp is not None:
+            scp.close()
+
+
 def force_symlink(file1, file2):
     import errno
     try:
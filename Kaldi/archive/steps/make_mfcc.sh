@@ -118,7 +118,14 @@ else
     split_scps="$split_scps $logdir/wav_${name}.$n.scp"
   done
 
-  utils/split_scp.pl $scp $split_scps || exit 1;
+  if [ -f $data/split$nj/1/wav.scp ] && [ ! $data/split$nj/1/wav.scp -ot $scp ]; then
+    # use the split directories balanced by duration (written by data_preparation.py)
+    for n in $(seq $nj); do
+      cp $data/split$nj/$n/wav.scp $logdir/wav_${name}.$n.scp || exit 1;
+    done
+  else
+    utils/split_scp.pl $scp $split_scps || exit 1;
+  fi
 
 
   # add ,p to the input rspecifier so that we can just skip over
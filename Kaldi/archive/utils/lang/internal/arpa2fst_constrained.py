@@ -10,6 +10,9 @@ import argparse
 import math
 from collections import defaultdict
 
+sys.path.insert(0, 'steps')
+from libs.arpa_reader import ArpaReader
+
 # note, this was originally based
 
 parser = argparse.ArgumentParser(description="""
@@ -74,88 +77,51 @@ class ArpaModel(object):
         if arpa_in == "" or arpa_in == "-":
             arpa_in = "/dev/stdin"
         try:
-            f = open(arpa_in, "r")
-        except:
+            reader = ArpaReader(arpa_in, encoding=None)
+        except IOError:
             sys.exit("{0}: error opening ARPA file {1}".format(
                      sys.argv[0], arpa_in))
-        # first read till the \data\ marker.
-        while True:
-            line = f.readline()
-            if line == '':
-                sys.exit("{0}: reading {1}, got EOF looking for \\data\\ marker.".format(
-                    sys.argv[0], arpa_in))
-            if line[0:6] == '\\data\\':
-                break
-        while True:
-            # read, and ignore, the lines like 'ngram 1=1264'...
-            line = f.readline()
-            if line == '\n' or line == '\r\n':
-                break
-            if line[0:5] != 'ngram':
-                sys.exit("{0}: reading {1}, read something unexpected in header: {2}".format(
-                    sys.argv[0], arpa_in, line[:-1]))
-            rest=line[5:]
-            a = rest.split('=')  # e.g. a = [ '1', '1264] ]
-            if len(a) != 2:
-                sys.exit("{0}: reading {1}, read something unexpected in header: {2}".format(
-                    sys.argv[0], arpa_in, line[:-1]))
-            max_order = int(a[0])
-
+        except ValueError as e:
+            sys.exit("{0}: {1}".format(sys.argv[0], e))
 
+        max_order = len(reader.counts)
         for n in range(max_order):
             # self.orders[n], indexed by history-length (length of the
             # history-vector, == order-1), is a map from history as a tuple
             # of strings, to class HistoryState.
             self.orders.append(defaultdict(lambda: HistoryState()))
 
+        # the n-grams are read in blocks of columnar arrays (see
+        # steps/libs/arpa_reader.py).
         cur_order = 0
-        while True:
-            line = f.readline()
-            if line == '':
-                sys.exit("{0}: reading {1}, found EOF while looking for \\end\\ marker.".format(
-                    sys.argv[0], arpa_in))
-            elif line[0:5] == '\\end\\':
-                if len(self.orders) == 0:
-                    sys.exit("{0}: reading {1}, read no n-grams.".format(sys.argv[0], arpa_in))
-                break
-            else:
-                cur_order += 1
-                expected_line = '\\{0}-grams:'.format(cur_order)
-                if not expected_line in line:  # e.g. allow trailing whitespace and newline
-                    sys.exit("{0}: reading {1}, expected line {1}, got {2}".format(arpa_in, expected_line, line[:-1]))
-                if args.verbose >= 2:
-                    print("{0}: reading {1}-grams".format(
-                        sys.argv[0], cur_order), file = sys.stderr)
-
-                # now read all the n-grams from this order.
-                while True:
-                    line = f.readline()
-                    # the section of n-grams is terminated by a blank line.
-                    if line == '\n' or line == '\r\n':
-                        break
-                    a = line.split()
-                    l = len(a)
-                    if l != cur_order + 1 and l != cur_order + 2:
-                        sys.exit("{0}: reading {1}: in {2}-grams section, got bad line: {3}".format(
-                            sys.argv[0], arpa_in, cur_order, line[:-1]))
-                    try:
-                        prob = math.exp(float(a[0]) * log10)
-                        hist = tuple(a[1:cur_order])  # tuple of strings
-                        word = a[cur_order]  # a string
-                        backoff_prob = math.exp(float(a[cur_order+1]) * log10) if l == cur_order + 2 else None
-                    except Exception as e:
-                        sys.exit("{0}: reading {1}: in {2}-grams section, got bad "
-                                 "line (exception is: {3}): {4}".format(
-                                     sys.argv[0], arpa_in, cur_order,
-                                     str(type(e)) + ',' + str(e), line[:-1]))
+        try:
+            for block in reader:
+                if block.order != cur_order:
+                    cur_order = block.order
+                    if args.verbose >= 2:
+                        print("{0}: reading {1}-grams".format(
+                            sys.argv[0], cur_order), file = sys.stderr)
+                words = reader.words
+                for word_ids, logprob, backoff in zip(block.word_ids.tolist(),
+                                                      block.logprobs.tolist(),
+                                                      block.backoffs.tolist()):
+                    prob = math.exp(logprob * log10)
+                    hist = tuple(words[i] for i in word_ids[:-1])  # tuple of strings
+                    word = words[word_ids[-1]]  # a string
                     self.orders[cur_order-1][hist].word_to_prob[word] = prob
-                    if backoff_prob != None:
-                        self.orders[cur_order][hist + (word,)].backoff_prob = backoff_prob
+                    if backoff == backoff:  # not NaN
+                        if cur_order == max_order:
+                            sys.exit("{0}: reading {1}: got a backoff weight in the "
+                                     "highest order {2}-grams".format(sys.argv[0], arpa_in, cur_order))
+                        self.orders[cur_order][hist + (word,)].backoff_prob = math.exp(backoff * log10)
+        except ValueError as e:
+            sys.exit("{0}: {1}".format(sys.argv[0], e))
+        reader.close()
 
         if args.verbose >= 2:
             print("{0}: read {1}-gram model from {2}".format(
-                sys.argv[0], cur_order, arpa_in), file = sys.stderr)
-        if cur_order < 2:
+                sys.argv[0], max_order, arpa_in), file = sys.stderr)
+        if max_order < 2:
             # we'd have to have some if-statements in the code to make this work,
             # and I don't want to have to test it.
             sys.exit("{0}: this script does not work when the ARPA language model "
@@ -14,16 +14,21 @@ This keeps the graph compact after adding the unk model.
 
 import argparse
 import io
-import re
+import shutil
 import sys
+import tempfile
 from collections import defaultdict
 
+import numpy as np
+
+sys.path.insert(0, 'steps')
+from libs.arpa_reader import ArpaReader
+
 
 parser = argparse.ArgumentParser(
     description='''This script takes an existing ARPA lanugage model
     and limits the <unk> history to make it suitable
-    for downstream <unk> modeling.
-    It supports up to 5-grams.''',
+    for downstream <unk> modeling.''',
     usage='''utils/lang/limit_arpa_unk_history.py
     <oov-dict-entry> <input-arpa >output-arpa''',
     epilog='''E.g.: gunzip -c src.arpa.gz |
@@ -35,126 +40,104 @@ parser.add_argument(
 args = parser.parse_args()
 
 
-def get_ngram_stats(old_lm_lines):
-    ngram_counts = defaultdict(int)
-
-    for i in range(10):
-        g = re.search(r"ngram (\d)=(\d+)", old_lm_lines[i])
-        if g:
-            ngram_counts[int(g.group(1))] = int(g.group(2))
-
-    if len(ngram_counts) == 0:
-        sys.exit("""Couldn't get counts per ngram section.
-            The input doesn't seem to be a valid ARPA language model.""")
+def write_section_header(output_stream, order):
+    if order > 1:
+        output_stream.write("\n")
+    output_stream.write("\\{}-grams:\n".format(order))
 
-    max_ngrams = list(ngram_counts.keys())[-1]
-    skip_rows = ngram_counts[1]
 
-    if max_ngrams > 5:
-        sys.exit("This script supports up to 5-gram language models.")
-
-    return max_ngrams, skip_rows, ngram_counts
-
-
-def find_and_replace_unks(old_lm_lines, max_ngrams, skip_rows):
+def find_and_replace_unks(reader, body_stream):
+    ''' Writes the n-gram sections of the new language model to body_stream
+    and returns the number of n-grams removed from each order. '''
     ngram_diffs = defaultdict(int)
-    whitespace_pattern = re.compile("[ \t]+")
-    unk_pattern = re.compile(
-        "[0-9.-]+(?:[\s\\t]\S+){1,3}[\s\\t]" + args.oov_dict_entry +
-        "[\s\\t](?!-[0-9]+\.[0-9]+).*")
-    backoff_pattern = re.compile(
-        "[0-9.-]+(?:[\s\\t]\S+){1,3}[\s\\t]<unk>[\s\\t]-[0-9]+\.[0-9]+")
-    passed_2grams, last_ngram = False, False
+    unk = reader.word_id(args.oov_dict_entry)
+    max_ngrams = len(reader.counts)
+    words = np.array(reader.words, dtype=object)
     unk_row_count, backoff_row_count = 0, 0
 
     print("Upadting the language model .. ", file=sys.stderr)
-    new_lm_lines = old_lm_lines[:skip_rows]
-
-    for i in range(skip_rows, len(old_lm_lines)):
-            line = old_lm_lines[i].strip(" \t\r\n")
-
-            if "\{}-grams:".format(3) in line:
-                passed_2grams = True
-            if "\{}-grams:".format(max_ngrams) in line:
-                last_ngram = True
-
-            for i in range(max_ngrams):
-                if "\{}-grams:".format(i+1) in line:
-                    ngram = i+1
-
-            # remove any n-gram states of the form: foo <unk> -> X
-            # that is, any n-grams of order > 2 where <unk>
-            # is the second-to-last word
-            # here we skip 1-gram and 2-gram sections of arpa
-
-            if passed_2grams:
-                g_unk = unk_pattern.search(line)
-                if g_unk:
-                    ngram_diffs[ngram] = ngram_diffs[ngram] - 1
-                    unk_row_count += 1
-                    continue
-
-            # remove backoff probability from the lines that end with <unk>
-            # for example, the -0.64 in -4.09 every <unk> -0.64
-            # here we skip the last n-gram section because it
-            # doesn't include backoff probabilities
-
-            if not last_ngram:
-                g_backoff = backoff_pattern.search(line)
-                if g_backoff:
-                    updated_row = whitespace_pattern.split(g_backoff.group(0))[:-1]
-                    updated_row = updated_row[0] + \
-                        "\t" + " ".join(updated_row[1:]) + "\n"
-                    new_lm_lines.append(updated_row)
-                    backoff_row_count += 1
-                    continue
-
-            new_lm_lines.append(line+"\n")
+    order = 0
+    for block in reader:
+        while order < block.order:
+            order += 1
+            write_section_header(body_stream, order)
+        if len(words) < len(reader.words):
+            words = np.array(reader.words, dtype=object)
+
+        # remove any n-gram states of the form: foo <unk> -> X
+        # that is, any n-grams of order > 2 where <unk>
+        # is in the history (other than as its first word)
+        # here we skip 1-gram and 2-gram sections of arpa
+        keep = np.ones(len(block.logprobs), dtype=bool)
+        if order > 2:
+            keep = ~np.any(block.word_ids[:, 1:-1] == unk, axis=1)
+            ngram_diffs[order] -= int(np.sum(~keep))
+            unk_row_count += int(np.sum(~keep))
+
+        # remove backoff probability from the lines that end with <unk>
+        # for example, the -0.64 in -4.09 every <unk> -0.64
+        # here we skip the last n-gram section because it
+        # doesn't include backoff probabilities
+        backoffs = block.backoffs.copy()
+        if 1 < order < max_ngrams:
+            remove_backoff = keep & (block.word_ids[:, -1] == unk) & block.has_backoff()
+            backoffs[remove_backoff] = np.nan
+            backoff_row_count += int(np.sum(remove_backoff))
+
+        ngrams = words[block.word_ids[keep, 0]]
+        for k in range(1, order):
+            ngrams = ngrams + " " + words[block.word_ids[keep, k]]
+        lines = []
+        for logprob, ngram, backoff in zip(block.logprobs[keep].tolist(), ngrams.tolist(),
+                                           backoffs[keep].tolist()):
+            if backoff != backoff:  # NaN, no backoff
+                lines.append("{}\t{}\n".format(logprob, ngram))
+            else:
+                lines.append("{}\t{}\t{}\n".format(logprob, ngram, backoff))
+        body_stream.write("".join(lines))
+    while order < max_ngrams:
+        order += 1
+        write_section_header(body_stream, order)
+    body_stream.write("\n\\end\\\n")
 
     print("Removed {} lines including {} as second-to-last term.".format(
         unk_row_count, args.oov_dict_entry), file=sys.stderr)
     print("Removed backoff probabilties from {} lines.".format(
         backoff_row_count), file=sys.stderr)
 
-    return new_lm_lines, ngram_diffs
+    return ngram_diffs
 
 
-def read_old_lm():
-    print("Reading ARPA LM frome input stream .. ", file=sys.stderr)
-
-    with io.TextIOWrapper(
-            sys.stdin.buffer,
-            encoding="latin-1") as input_stream:
-        old_lm_lines = input_stream.readlines()
-
-    return old_lm_lines
-
-
-def write_new_lm(new_lm_lines, ngram_counts, ngram_diffs):
-    ''' Update n-gram counts that go in the header of the arpa lm '''
-
-    for i in range(10):
-        g = re.search(r"ngram (\d)=(\d+)", new_lm_lines[i])
-        if g:
-            n = int(g.group(1))
-            if n in ngram_diffs:
-                # ngram_diffs contains negative values
-                new_num_ngrams = ngram_counts[n] + ngram_diffs[n]
-                new_lm_lines[i] = "ngram {}={}\n".format(
-                    n, new_num_ngrams)
+def write_new_lm(ngram_counts, ngram_diffs, body_stream):
+    ''' Write the header of the arpa lm with the updated n-gram counts,
+    followed by the n-gram sections '''
 
     with io.TextIOWrapper(
             sys.stdout.buffer,
             encoding="latin-1") as output_stream:
-        output_stream.writelines(new_lm_lines)
+        output_stream.write("\\data\\\n")
+        for n in range(1, len(ngram_counts) + 1):
+            # ngram_diffs contains negative values
+            output_stream.write("ngram {}={}\n".format(
+                n, ngram_counts[n - 1] + ngram_diffs[n]))
+        output_stream.write("\n")
+        body_stream.seek(0)
+        shutil.copyfileobj(body_stream, output_stream)
 
 
 def main():
-    old_lm_lines = read_old_lm()
-    max_ngrams, skip_rows,  ngram_counts = get_ngram_stats(old_lm_lines)
-    new_lm_lines, ngram_diffs = find_and_replace_unks(
-        old_lm_lines, max_ngrams, skip_rows)
-    write_new_lm(new_lm_lines, ngram_counts, ngram_diffs)
+    # The ARPA LM is read from the input stream in blocks of n-grams, and the
+    # new n-gram sections are written to a temporary file, because the header
+    # (with the new n-gram counts) can only be written at the end.
+    print("Reading ARPA LM frome input stream .. ", file=sys.stderr)
+    input_stream = io.TextIOWrapper(sys.stdin.buffer, encoding="latin-1")
+    try:
+        with ArpaReader(input_stream) as reader, \
+                tempfile.TemporaryFile(mode="w+", encoding="latin-1") as body_stream:
+            ngram_diffs = find_and_replace_unks(reader, body_stream)
+            write_new_lm(reader.counts, ngram_diffs, body_stream)
+    except ValueError as e:
+        sys.exit("limit_arpa_unk_history.py: {}".format(e))
 
 
 if __name__ == "__main__":
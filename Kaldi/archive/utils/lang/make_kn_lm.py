@@ -20,8 +20,12 @@ import os
 import re
 import io
 import math
+import time
 import argparse
-from collections import Counter, defaultdict
+import multiprocessing
+from collections import Counter, defaultdict, deque
+
+import numpy as np
 
 
 parser = argparse.ArgumentParser(description="""
@@ -32,6 +36,16 @@ parser.add_argument("-ngram-order", type=int, default=4, choices=[2, 3, 4, 5, 6,
 parser.add_argument("-text", type=str, default=None, help="Path to the corpus file")
 parser.add_argument("-lm", type=str, default=None, help="Path to output arpa file for language models")
 parser.add_argument("-verbose", type=int, default=0, choices=[0, 1, 2, 3, 4, 5], help="Verbose level")
+parser.add_argument("-num-jobs", type=int, default=0,
+                    help="Number of processes counting the corpus with the packed (integer array) "
+                         "counter, which needs far less memory on large corpora; 0 uses the "
+                         "original dict-based counter")
+parser.add_argument("-lines-per-job", type=int, default=100000,
+                    help="Number of lines of the corpus counted by each task of the packed counter")
+parser.add_argument("-benchmark", action="store_true",
+                    help="With -num-jobs > 0, build the LM end to end (counting and estimation) with both "
+                         "the dict-based and the packed implementations, print the time taken by "
+                         "both, check that their outputs are identical and write that output")
 args = parser.parse_args()
 
 default_encoding = "latin-1"  # For encoding-agnostic scripts, we assume byte stream as input.
@@ -53,6 +67,8 @@ class CountsForHistory:
         # arguments that returns a new defaultdict(float).
         self.word_to_count = defaultdict(int)
         self.word_to_context = defaultdict(set)  # using a set to count the number of unique contexts
+        self.word_to_num_contexts = dict()  # number of unique contexts, when they are counted
+                                            # without the sets (see PackedNgramCounts)
         self.word_to_f = dict()  # discounted probability
         self.word_to_bow = dict()  # back-off weight
         self.total_count = 0
@@ -67,6 +83,11 @@ class CountsForHistory:
             ', '.join(['{0} -> {1}'.format(word, count)
                       for word, count in self.word_to_count.items()]))
 
+    def num_contexts(self, word):
+        if word in self.word_to_num_contexts:
+            return self.word_to_num_contexts[word]
+        return len(self.word_to_context[word])
+
     def add_count(self, predicted_word, context_word, count):
         assert count >= 0
 
@@ -191,11 +212,11 @@ class NgramCounts:
 
                 n_star_star = 0
                 for w in counts_for_hist.word_to_count.keys():
-                    n_star_star += len(counts_for_hist.word_to_context[w])
+                    n_star_star += counts_for_hist.num_contexts(w)
 
                 if n_star_star != 0:
                     for w in counts_for_hist.word_to_count.keys():
-                        n_star_z = len(counts_for_hist.word_to_context[w])
+                        n_star_z = counts_for_hist.num_contexts(w)
                         counts_for_hist.word_to_f[w] = max((n_star_z - self.d[n]), 0) * 1.0 / n_star_star
                 else:  # patterns begin with <s>, they do not have "modified count", so use raw count instead
                     for w in counts_for_hist.word_to_count.keys():
@@ -270,7 +291,7 @@ class NgramCounts:
                     ngram = " ".join(hist) + " " + w
                     ngram = ngram.strip(strip_chars)
 
-                    modified_count = len(counts_for_hist.word_to_context[w])
+                    modified_count = counts_for_hist.num_contexts(w)
                     raw_count = counts_for_hist.word_to_count[w]
 
                     if modified_count == 0:
@@ -358,15 +379,421 @@ class NgramCounts:
         print('\\end\\', file=fout)
 
 
-if __name__ == "__main__":
+# The following functions implement the counting of PackedNgramCounts.  An
+# n-gram is packed into a fixed-width key made of the word-ids of its words as
+# big-endian uint32, so that sorting the keys (numpy compares them as bytes)
+# sorts the n-grams by their word-ids, and all the n-grams sharing a history
+# are contiguous.
+def pack_ngrams(ids):
+    # 'ids' is a 2-d array of word-ids, one n-gram per row.
+    ids = np.ascontiguousarray(ids, dtype='>u4')
+    return ids.view(np.dtype((np.void, 4 * ids.shape[1]))).reshape(-1)
+
+
+def unpack_ngrams(keys, n):
+    return keys.view('>u4').reshape(-1, n).astype(np.int64)
+
+
+def history_keys(keys, n):
+    # returns the packed histories (the first n-1 words) of the packed n-grams.
+    prefix = np.ascontiguousarray(keys.view(np.uint8).reshape(-1, 4 * n)[:, :4 * (n - 1)])
+    return prefix.view(np.dtype((np.void, 4 * (n - 1)))).reshape(-1)
+
+
+def group_starts(sorted_keys):
+    # returns the index of the first element of each run of equal keys.
+    if len(sorted_keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+
+
+def reduce_ngrams(keys, counts, first):
+    # sorts the packed n-grams and sums the counts (and takes the first
+    # position) of the repeated ones.
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = group_starts(keys)
+    if len(starts) == 0:
+        return keys, counts[order], first[order]
+    return (keys[starts],
+            np.add.reduceat(counts[order], starts),
+            np.minimum.reduceat(first[order], starts))
+
+
+def count_ngrams_in_lines(lines, ngram_order, bos_symbol, eos_symbol):
+    # Counts the n-grams of a chunk of the corpus (called in the worker
+    # processes).  Words are mapped to ids local to the chunk.  The position
+    # of an n-gram is the index of its first word in the chunk, counting the
+    # <s> and </s> of every line.
+    # Returns (words, runs, num_tokens) where 'words' maps the local ids to
+    # the words and runs[n] = (keys, counts, first) for the n-grams with
+    # history length n.
+    word_to_id = dict()
+    ids = []
+    line_ends = []
+    for line in lines:
+        words = [bos_symbol] + whitespace.split(line) + [eos_symbol]
+        ids.extend([word_to_id.setdefault(w, len(word_to_id)) for w in words])
+        line_ends.append(len(ids))
+    ids = np.array(ids, dtype=np.int64)
+    line_ends = np.array(line_ends, dtype=np.int64)
+    line_lengths = np.diff(np.concatenate(([0], line_ends)))
+    end_of_line = np.repeat(line_ends, line_lengths)
+    positions = np.arange(len(ids), dtype=np.int64)
+
+    runs = []
+    for n in range(ngram_order):
+        starts = np.flatnonzero(positions + n + 1 <= end_of_line)
+        ngrams = np.stack([ids[starts + k] for k in range(n + 1)], axis=1)
+        runs.append(reduce_ngrams(pack_ngrams(ngrams),
+                                  np.ones(len(starts), dtype=np.int64),
+                                  starts))
+    words = [None] * len(word_to_id)
+    for w, i in word_to_id.items():
+        words[i] = w
+    return words, runs, len(ids)
+
+
+def count_ngrams_in_lines_star(task):
+    return count_ngrams_in_lines(*task)
+
+
+class PackedNgramCounts:
+    # This class counts the same statistics as NgramCounts, but in a much more
+    # compact way, for large corpora.  All words are represented as integers
+    # (self.words[i] is the word with id i), and the n-grams with history
+    # length n are stored as a sorted array of packed keys (see pack_ngrams())
+    # self.keys[n], with these arrays in parallel:
+    #   self.raw_counts[n]: the count of each n-gram,
+    #   self.first[n]: the position in the corpus of the first occurrence of
+    #     each n-gram, used to print the n-grams in the same order as
+    #     NgramCounts (which stores them in dicts),
+    #   self.num_contexts[n]: the number of unique words preceding each n-gram,
+    #     i.e. the "modified count" n(*_z) (see cal_num_contexts()).
+    # The corpus is read in chunks of lines that are counted in a process pool,
+    # and the sorted counts of the chunks are merged as they come, so the
+    # memory needed is proportional to the number of unique n-grams.
+    def __init__(self, ngram_order, bos_symbol='<s>', eos_symbol='</s>'):
+        assert ngram_order >= 2
+
+        self.ngram_order = ngram_order
+        self.bos_symbol = bos_symbol
+        self.eos_symbol = eos_symbol
+
+        self.words = []
+        self.word_to_id = dict()
+        self.num_tokens = 0  # including the <s> and </s> of every line
+        self.lines_processed = 0
+        self.keys = [None] * ngram_order
+        self.raw_counts = [None] * ngram_order
+        self.first = [None] * ngram_order
+        self.num_contexts = [None] * ngram_order
+
+        # the sorted runs waiting to be merged, for each order.  Runs are
+        # merged when they have similar sizes, so each n-gram is merged
+        # O(log(number of chunks)) times.
+        self.pending_runs = [[] for n in range(ngram_order)]
+
+    def add_chunk_counts(self, words, runs, num_tokens):
+        # maps the ids local to the chunk to the global ids.
+        for w in words:
+            if w not in self.word_to_id:
+                self.word_to_id[w] = len(self.words)
+                self.words.append(w)
+        local_to_global = np.array([self.word_to_id[w] for w in words], dtype=np.int64)
+
+        for n, (keys, counts, first) in enumerate(runs):
+            ngrams = local_to_global[unpack_ngrams(keys, n + 1)]
+            run = reduce_ngrams(pack_ngrams(ngrams), counts, first + self.num_tokens)
+            pending = self.pending_runs[n]
+            pending.append(run)
+            while len(pending) >= 2 and len(pending[-2][0]) <= 2 * len(pending[-1][0]):
+                run = pending.pop()
+                pending[-1] = self.merge_runs([pending[-1], run])
+        self.num_tokens += num_tokens
+
+    @staticmethod
+    def merge_runs(runs):
+        return reduce_ngrams(np.concatenate([run[0] for run in runs]),
+                             np.concatenate([run[1] for run in runs]),
+                             np.concatenate([run[2] for run in runs]))
+
+    def add_raw_counts_from_lines(self, lines, num_jobs=1, lines_per_job=100000):
+        # 'lines' is an iterator over the lines of the corpus.
+        def chunks():
+            chunk = []
+            for line in lines:
+                chunk.append(line)
+                if len(chunk) == lines_per_job:
+                    yield (chunk, self.ngram_order, self.bos_symbol, self.eos_symbol)
+                    chunk = []
+            if chunk:
+                yield (chunk, self.ngram_order, self.bos_symbol, self.eos_symbol)
+
+        if num_jobs <= 1:
+            for task in chunks():
+                self.add_chunk_counts(*count_ngrams_in_lines_star(task))
+        else:
+            # Pool.imap() would read the whole corpus ahead, so we keep only a
+            # few chunks in flight, and merge their counts in order.
+            pool = multiprocessing.Pool(num_jobs)
+            try:
+                in_flight = deque()
+                for task in chunks():
+                    in_flight.append(pool.apply_async(count_ngrams_in_lines_star, (task,)))
+                    if len(in_flight) >= 2 * num_jobs:
+                        self.add_chunk_counts(*in_flight.popleft().get())
+                while in_flight:
+                    self.add_chunk_counts(*in_flight.popleft().get())
+            finally:
+                pool.terminate()
+
+        for n in range(self.ngram_order):
+            if not self.pending_runs[n]:  # empty corpus
+                self.pending_runs[n].append((pack_ngrams(np.zeros((0, n + 1))),
+                                             np.zeros(0, dtype=np.int64),
+                                             np.zeros(0, dtype=np.int64)))
+            (self.keys[n], self.raw_counts[n],
+             self.first[n]) = self.merge_runs(self.pending_runs[n])
+            self.pending_runs[n] = []
+        self.cal_num_contexts()
+
+    def read_lines(self, infile):
+        # same as NgramCounts, we stop at the first empty line.
+        self.lines_processed = 0
+        for line in infile:
+            line = line.strip(strip_chars)
+            if line == '':
+                break
+            self.lines_processed += 1
+            yield line
+
+    def add_raw_counts_from_standard_input(self, num_jobs=1, lines_per_job=100000):
+        infile = io.TextIOWrapper(sys.stdin.buffer, encoding=default_encoding)  # byte stream as input
+        self.add_raw_counts_from_lines(self.read_lines(infile), num_jobs, lines_per_job)
+        if self.lines_processed == 0 or args.verbose > 0:
+            print("make_kn_lm.py: processed {0} lines of input".format(self.lines_processed), file=sys.stderr)
+
+    def add_raw_counts_from_file(self, filename, num_jobs=1, lines_per_job=100000):
+        with open(filename, encoding=default_encoding) as fp:
+            self.add_raw_counts_from_lines(self.read_lines(fp), num_jobs, lines_per_job)
+        if self.lines_processed == 0 or args.verbose > 0:
+            print("make_kn_lm.py: processed {0} lines of input".format(self.lines_processed), file=sys.stderr)
+
+    def cal_num_contexts(self):
+        # Every context word seen before an n-gram is the first word of an
+        # (n+1)-gram ending with that n-gram (and the n-grams at the start of a
+        # line have no context, like in NgramCounts), so n(*_z) is the number
+        # of unique (n+1)-grams whose last n words are z.  This is not needed
+        # for the highest order.
+        for n in range(self.ngram_order - 1):
+            higher = unpack_ngrams(self.keys[n + 1], n + 2)
+            suffixes = np.sort(pack_ngrams(higher[:, 1:]))
+            starts = group_starts(suffixes)
+            num_contexts = np.zeros(len(self.keys[n]), dtype=np.int64)
+            if len(starts) > 0:
+                index = np.searchsorted(self.keys[n], suffixes[starts])
+                num_contexts[index] = np.diff(np.append(starts, len(suffixes)))
+            self.num_contexts[n] = num_contexts
+
+    def insertion_order(self, n):
+        # returns the permutation of the n-grams with history length n
+        # following the order in which NgramCounts inserts them in its dicts:
+        # histories by their first occurrence, then the words of each history
+        # by their first occurrence.
+        first = self.first[n]
+        if n == 0:
+            history_first = np.zeros_like(first)
+        else:
+            starts = group_starts(history_keys(self.keys[n], n + 1))
+            history_first = np.repeat(np.minimum.reduceat(first, starts),
+                                      np.diff(np.append(starts, len(first))))
+        return np.lexsort((first, history_first))
+
+    # The following functions do the same as those of NgramCounts, but with
+    # grouped numpy reductions over the packed arrays.  The sums of floats that
+    # NgramCounts does word by word are done with np.bincount() over the
+    # n-grams in insertion order, which adds them up in the same order, so the
+    # results are exactly the same.
+    def history_starts(self, n):
+        # returns the index of the first n-gram of each history (the n-grams
+        # with history length n are sorted by history).
+        if n == 0:
+            return np.zeros(1 if len(self.keys[n]) else 0, dtype=np.int64)
+        return group_starts(history_keys(self.keys[n], n + 1))
+
+    def sum_per_history(self, n, values):
+        # returns the sum of 'values' over the history of each n-gram.
+        starts = self.history_starts(n)
+        if len(starts) == 0:
+            return values
+        return np.repeat(np.add.reduceat(values, starts), np.diff(np.append(starts, len(values))))
+
+    def cal_discounting_constants(self):
+        # See NgramCounts.cal_discounting_constants(): d[N+1] = n1_N / (n1_N + 2 * n2_N)
+        self.d = [0]
+        for n in range(1, self.ngram_order):
+            n1 = np.count_nonzero(self.raw_counts[n] == 1)
+            n2 = np.count_nonzero(self.raw_counts[n] == 2)
+            assert n1 + 2 * n2 > 0
+            self.d.append(n1 * 1.0 / (n1 + 2 * n2))
+
+    def cal_f(self):
+        # See NgramCounts.cal_f().
+        # f(a_z) = (c(a_z) - D0) / c(a_)    ;; for highest order N-grams
+        # f(_z)  = (n(*_z) - D1) / n(*_*)	;; for lower order N-grams
+        self.f = [None] * self.ngram_order
+        for n in range(self.ngram_order):
+            raw_counts = self.raw_counts[n]
+            raw_f = np.maximum(raw_counts - self.d[n], 0) / self.sum_per_history(n, raw_counts)
+            if n == self.ngram_order - 1:
+                self.f[n] = raw_f
+            else:
+                # patterns beginning with <s> do not have "modified count", so
+                # their raw count is used instead
+                num_contexts = self.num_contexts[n]
+                n_star_star = self.sum_per_history(n, num_contexts)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    modified_f = np.maximum(num_contexts - self.d[n], 0) / n_star_star
+                self.f[n] = np.where(n_star_star != 0, modified_f, raw_f)
 
+    def cal_bow(self):
+        # See NgramCounts.cal_bow().
+        # bow(a_) = (1 - Sum_Z1 f(a_z)) / (1 - Sum_Z1 f(_z))
+        # self.bow[n] is NaN for the n-grams without back-off weight (highest
+        # order and ending in </s>).
+        self.bow = [None] * self.ngram_order
+        self.bow[-1] = np.full(len(self.keys[-1]), np.nan)
+        eos = self.word_to_id.get(self.eos_symbol, -1)
+        for n in range(self.ngram_order - 1):
+            # a_z is an n-gram with history length n+1, a_ is its history and
+            # _z is its suffix, both with history length n.
+            order = self.insertion_order(n + 1)
+            ngrams = unpack_ngrams(self.keys[n + 1][order], n + 2)
+            a_ = np.searchsorted(self.keys[n], pack_ngrams(ngrams[:, :-1]))
+            _z = np.searchsorted(self.keys[n], pack_ngrams(ngrams[:, 1:]))
+            num_ngrams = len(self.keys[n])
+            sum_z1_f_a_z = np.bincount(a_, weights=self.f[n + 1][order], minlength=num_ngrams)
+            sum_z1_f_z = np.bincount(a_, weights=self.f[n][_z], minlength=num_ngrams)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bow = (1.0 - sum_z1_f_a_z) / (1.0 - sum_z1_f_z)
+            bow[unpack_ngrams(self.keys[n], n + 1)[:, -1] == eos] = np.nan
+            self.bow[n] = bow
+
+    def print_as_arpa(self, fout=None, block_size=100000):
+        # print as ARPA format, in the same order as NgramCounts.print_as_arpa().
+        # The lines are formatted and written in blocks of 'block_size' n-grams.
+        if fout is None:
+            fout = io.TextIOWrapper(sys.stdout.buffer, encoding='latin-1')
+
+        fout.write('\\data\\\n')
+        for hist_len in range(self.ngram_order):
+            fout.write('ngram {0}={1}\n'.format(hist_len + 1, len(self.keys[hist_len])))
+        fout.write('\n')
+
+        words = np.array(self.words, dtype=object)
+        for hist_len in range(self.ngram_order):
+            fout.write('\\{0}-grams:\n'.format(hist_len + 1))
+            order = self.insertion_order(hist_len)
+            for start in range(0, len(order), block_size):
+                block = order[start:start + block_size]
+                ngrams = unpack_ngrams(self.keys[hist_len][block], hist_len + 1)
+                text = words[ngrams[:, 0]]
+                for k in range(1, hist_len + 1):
+                    text = text + ' ' + words[ngrams[:, k]]
+                prob = self.f[hist_len][block]
+                prob[prob == 0] = 1e-99  # f(<s>) is always 0
+                lines = []
+                for ngram, p, b in zip(text.tolist(), prob.tolist(), self.bow[hist_len][block].tolist()):
+                    if b != b:  # NaN, no back-off weight
+                        lines.append('%.7f\t%s\n' % (math.log10(p), ngram))
+                    else:
+                        lines.append('%.7f\t%s\t%.7f\n' % (math.log10(p), ngram, math.log10(b)))
+                fout.write(''.join(lines))
+            fout.write('\n')
+        fout.write('\\end\\\n')
+        fout.flush()
+
+
+def estimate_arpa(ngram_counts):
+    # smooths the counts of NgramCounts or PackedNgramCounts and returns the
+    # ARPA output as a string.
+    ngram_counts.cal_discounting_constants()
+    ngram_counts.cal_f()
+    ngram_counts.cal_bow()
+    arpa = io.StringIO()
+    ngram_counts.print_as_arpa(fout=arpa)
+    return arpa.getvalue()
+
+
+def benchmark(corpus, num_jobs, lines_per_job):
+    # Builds the LM from 'corpus' (the text of the corpus, kept in memory so
+    # that both implementations read it the same way) end to end, i.e.
+    # counting, smoothing and printing, once with the original dict-based
+    # NgramCounts and once with PackedNgramCounts, prints the time taken by
+    # both, checks that the ARPA outputs are identical and returns it.
+    start = time.time()
     ngram_counts = NgramCounts(args.ngram_order)
+    for line in io.StringIO(corpus):
+        line = line.strip(strip_chars)
+        if line == '':
+            break
+        ngram_counts.add_raw_counts_from_line(line)
+    dict_arpa = estimate_arpa(ngram_counts)
+    dict_time = time.time() - start
+    del ngram_counts
+
+    start = time.time()
+    ngram_counts = PackedNgramCounts(args.ngram_order)
+    ngram_counts.add_raw_counts_from_lines(ngram_counts.read_lines(io.StringIO(corpus)),
+                                           num_jobs, lines_per_job)
+    packed_arpa = estimate_arpa(ngram_counts)
+    packed_time = time.time() - start
+
+    print("make_kn_lm.py: counting and estimation took {0:.2f}s with NgramCounts and {1:.2f}s "
+          "with the packed counts ({2} jobs)".format(dict_time, packed_time, num_jobs), file=sys.stderr)
+    if packed_arpa != dict_arpa:
+        sys.exit("make_kn_lm.py: the ARPA outputs of the packed counts and NgramCounts differ")
+    print("make_kn_lm.py: the ARPA outputs are identical", file=sys.stderr)
+    return packed_arpa
+
 
-    if args.text is None:
-        ngram_counts.add_raw_counts_from_standard_input()
+if __name__ == "__main__":
+
+    if args.num_jobs > 0 and args.benchmark:
+        # the benchmark reads the corpus twice, so it is kept in memory, and
+        # its (identical) output is the LM written below.
+        if args.text is None:
+            corpus = io.TextIOWrapper(sys.stdin.buffer, encoding=default_encoding).read()
+        else:
+            assert os.path.isfile(args.text)
+            with open(args.text, encoding=default_encoding) as fp:
+                corpus = fp.read()
+        arpa = benchmark(corpus, args.num_jobs, args.lines_per_job)
+        if args.lm is None:
+            fout = io.TextIOWrapper(sys.stdout.buffer, encoding=default_encoding)
+            fout.write(arpa)
+            fout.flush()
+        else:
+            with open(args.lm, 'w', encoding=default_encoding) as f:
+                f.write(arpa)
+        sys.exit(0)
+
+    if args.num_jobs > 0:
+        ngram_counts = PackedNgramCounts(args.ngram_order)
+        if args.text is None:
+            ngram_counts.add_raw_counts_from_standard_input(args.num_jobs, args.lines_per_job)
+        else:
+            assert os.path.isfile(args.text)
+            ngram_counts.add_raw_counts_from_file(args.text, args.num_jobs, args.lines_per_job)
     else:
-        assert os.path.isfile(args.text)
-        ngram_counts.add_raw_counts_from_file(args.text)
+        ngram_counts = NgramCounts(args.ngram_order)
+
+        if args.text is None:
+            ngram_counts.add_raw_counts_from_standard_input()
+        else:
+            assert os.path.isfile(args.text)
+            ngram_counts.add_raw_counts_from_file(args.text)
 
     ngram_counts.cal_discounting_constants()
     ngram_counts.cal_f()
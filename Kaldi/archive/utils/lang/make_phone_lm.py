@@ -280,7 +280,7 @@ class NgramCounts(object):
         for n in reversed(list(range(args.no_backoff_ngram_order,
                                 args.ngram_order))):
             num_states_removed = 0
-            for hist, counts_for_hist in self.counts[n].items():
+            for hist, counts_for_hist in list(self.counts[n].items()):
                 l = len(counts_for_hist.word_to_count)
                 assert l > 0 and self.backoff_symbol in counts_for_hist.word_to_count
                 if l == 1 and not hist in protected_histories:  # only the backoff symbol has a count.
@@ -544,18 +544,18 @@ class NgramCounts(object):
         return ans
 
 
-    def GetLikeChangeFromPruningNgram(self, hist, word):
-        counts_for_hist = self.counts[len(hist)][hist]
-        counts_for_backoff_hist = self.counts[len(hist) - 1][hist[1:]]
-        assert word != self.backoff_symbol and word in counts_for_hist.word_to_count
-        count = counts_for_hist.word_to_count[word]
-        discount = counts_for_hist.word_to_count[self.backoff_symbol]
-        backoff_total = counts_for_backoff_hist.total_count
+    # Returns the likelihood change from pruning the n-gram hist -> word,
+    # given 'count', its count, 'discount', the discount-count of history-state
+    # 'hist', 'backoff_prob', the probability of 'word' in the backoff state
+    # hist[1:] (as returned by GetProb()), and 'backoff_total', the total count
+    # of the backoff state.
+    def GetLikeChangeFromPruningNgram(self, hist, word, count, discount,
+                                      backoff_prob, backoff_total):
         # backoff_count is a pseudo-count: it's like the count of 'word' in the
         # backoff history-state, but adding something to account for further
         # levels of backoff.
         try:
-            backoff_count = self.GetProb(hist[1:], word) * backoff_total
+            backoff_count = backoff_prob * backoff_total
         except:
             print("problem getting backoff count: hist = {0}, word = {1}".format(hist, word),
                   file = sys.stderr)
@@ -583,13 +583,25 @@ class NgramCounts(object):
         # a likelihood change of -0.164.  We'll later sort this list
         # so we can prune the n-grams that made the least-negative
         # likelihood change.
+        # The counts don't change while we compute the likelihood changes, so
+        # the probability of a word in a backoff state, which is needed by
+        # all the history-states that back off to it, is only computed once:
+        # backoff_probs[backoff_hist][word] is GetProb(backoff_hist, word).
         like_change_and_ngrams = []
+        backoff_probs = defaultdict(dict)
         for n in range(args.no_backoff_ngram_order, args.ngram_order):
             for hist, counts_for_hist in self.counts[n].items():
+                discount = counts_for_hist.word_to_count[self.backoff_symbol]
+                backoff_hist = hist[1:]
+                backoff_total = self.counts[n - 1][backoff_hist].total_count
+                probs = backoff_probs[backoff_hist]
                 for word, count in counts_for_hist.word_to_count.items():
                     if word != self.backoff_symbol:
                         if not hist + (word,) in protected_ngrams:
-                            like_change = self.GetLikeChangeFromPruningNgram(hist, word)
+                            if not word in probs:
+                                probs[word] = self.GetProb(backoff_hist, word)
+                            like_change = self.GetLikeChangeFromPruningNgram(
+                                hist, word, count, discount, probs[word], backoff_total)
                             like_change_and_ngrams.append((like_change,) + hist + (word,))
                             num_candidates_per_order[len(hist)] += 1
 
@@ -108,12 +108,18 @@ fi
 which lockfile >&/dev/null && lockfile -l 60 $data/.split_lock
 trap 'rm -f $data/.split_lock' EXIT HUP INT PIPE TERM
 
-utils/split_scp.pl $utt2spk_opt $data/utt2spk $utt2spks || exit 1
+# Re-use the speakers of the existing split directories (e.g. the ones balanced by
+# duration that are written by data_preparation.py) if they still cover $data/utt2spk.
+if $split_per_spk && [ -f $s1/spk2utt ] && cat $utt2spks 2>/dev/null | cmp -s - $data/utt2spk; then
+  echo "$0: re-using the speakers of the existing $data/split${numsplit}"
+else
+  utils/split_scp.pl $utt2spk_opt $data/utt2spk $utt2spks || exit 1
 
-for n in `seq $numsplit`; do
-  dsn=$data/split${numsplit}${utt}/$n
-  utils/utt2spk_to_spk2utt.pl $dsn/utt2spk > $dsn/spk2utt || exit 1;
-done
+  for n in `seq $numsplit`; do
+    dsn=$data/split${numsplit}${utt}/$n
+    utils/utt2spk_to_spk2utt.pl $dsn/utt2spk > $dsn/spk2utt || exit 1;
+  done
+fi
 
 maybe_wav_scp=
 if [ ! -f $data/segments ]; then
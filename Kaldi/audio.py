@@ -0,0 +1,133 @@
+import io
+import os
+import wave
+import math
+import numpy as np
+
+
+
+def read_wav_bytes(data):
+    """
+    This function is used to read the content of a 16-bit PCM wav file
+    that is already loaded in memory.
+    Parameters:
+        - data (bytes): the content of the wav file.
+    Returns:
+        - the samples of the first channel as a float32 numpy array in the
+          range of 16-bit integers (same as Kaldi's wav reader).
+        - the sampling frequency of the audio.
+    """
+    with wave.open(io.BytesIO(data), "rb") as fin:
+        assert fin.getsampwidth() == 2, "Only 16-bit PCM wav files are supported"
+        num_channels = fin.getnchannels()
+        samp_freq = fin.getframerate()
+        frames = fin.readframes(fin.getnframes())
+    samples = np.frombuffer(frames, dtype="<i2")[::num_channels]
+    return samples.astype(np.float32), samp_freq
+
+
+def read_wav_file(wav_path):
+    """
+    This function is used to read a 16-bit PCM wav file.
+    Returns:
+        - the samples of the first channel as a float32 numpy array in the
+          range of 16-bit integers.
+        - the sampling frequency of the audio.
+    """
+    with open(wav_path, "rb") as fin:
+        return read_wav_bytes(fin.read())
+
+
+def write_wav_file(wav_path, samples, samp_freq):
+    """
+    This function is used to write samples (in the range of 16-bit integers)
+    as a 16-bit PCM mono wav file. The file is written atomically.
+    """
+    samples = np.clip(np.round(samples), -32768, 32767).astype("<i2")
+    tmp_path = wav_path + ".tmp"
+    with wave.open(tmp_path, "wb") as fout:
+        fout.setnchannels(1)
+        fout.setsampwidth(2)
+        fout.setframerate(int(samp_freq))
+        fout.writeframes(samples.tobytes())
+    os.replace(tmp_path, wav_path)
+
+
+def resample(samples, orig_freq, new_freq, num_zeros=6, block_size=16384):
+    """
+    This function is used to resample the audio the same way as Kaldi's
+    LinearResample (feat/resample.cc), which is what compute-mfcc-feats
+    --allow-downsample=true and the Recognizer use: every output sample is
+    the sum of the input samples weighted by a windowed-sinc filter whose
+    cutoff is 99% of the lower Nyquist frequency, and the samples out of the
+    audio are zeros.
+    Parameters:
+        - samples (numpy array): the samples of one channel.
+        - orig_freq, new_freq (int): the sampling frequencies.
+        - num_zeros (int): the number of zeros of the sinc on each side of
+          the filter (lowpass-filter-width, 6 in Kaldi).
+        - block_size (int): the number of output samples computed at once,
+          which bounds the memory used for long files.
+    Returns:
+        - the resampled samples as a float32 numpy array.
+    """
+    orig_freq, new_freq = int(orig_freq), int(new_freq)
+    samples = np.asarray(samples, dtype=np.float32)
+    if orig_freq == new_freq:
+        return samples.copy()
+    cutoff = 0.99 * 0.5 * min(orig_freq, new_freq)
+    window_width = num_zeros / (2.0 * cutoff)
+    #the filter repeats itself every input_unit input samples and every
+    #output_unit output samples (441 and 160 from 44.1kHz to 16kHz)
+    base_freq = math.gcd(orig_freq, new_freq)
+    input_unit, output_unit = orig_freq // base_freq, new_freq // base_freq
+    first_index = np.zeros(output_unit, dtype=np.int64)
+    weights = []
+    for i in range(output_unit):
+        output_t = i / float(new_freq)
+        first_index[i] = math.ceil((output_t - window_width) * orig_freq)
+        last_index = math.floor((output_t + window_width) * orig_freq)
+        #Kaldi's FilterFunc() takes the time in float32
+        t = (np.arange(first_index[i], last_index + 1) / float(orig_freq) - output_t)
+        t = t.astype(np.float32).astype(np.float64)
+        window = np.where(np.abs(t) < window_width,
+                          0.5 * (1 + np.cos(2 * np.pi * cutoff / num_zeros * t)), 0.)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sinc = np.where(t != 0, np.sin(2 * np.pi * cutoff * t) / (np.pi * t), 2 * cutoff)
+        weights.append(sinc.astype(np.float32) * window.astype(np.float32) / np.float32(orig_freq))
+    width = max(len(w) for w in weights)
+    weights = np.array([np.pad(w, (0, width - len(w))) for w in weights])
+
+    #the number of output samples of LinearResample::GetNumOutputSamples()
+    #when the input is flushed, which is ceil(num_samples * new_freq / orig_freq)
+    num_outputs = -(-len(samples) * new_freq // orig_freq)
+    pad = int(max(0, -first_index.min()))
+    padded = np.concatenate([np.zeros(pad, dtype=np.float32), samples,
+                             np.zeros(width + input_unit, dtype=np.float32)])
+    output = np.zeros(num_outputs, dtype=np.float32)
+    for start in range(0, num_outputs, block_size):
+        n = np.arange(start, min(start + block_size, num_outputs))
+        phase = n % output_unit
+        first = first_index[phase] + (n // output_unit) * input_unit + pad
+        frames = padded[first[:, None] + np.arange(width)[None, :]]
+        output[n] = np.einsum("ij,ij->i", frames, weights[phase])
+    return output
+
+
+def resample_wav_file(src, dst, samp_freq):
+    """
+    This function is used to convert a wav file into a 16-bit PCM mono wav file
+    sampled at samp_freq. dst gets the modification time of src, so it's
+    skipped next time as long as src doesn't change.
+    Returns:
+        - True if dst was written, False if it was already up-to-date.
+    """
+    src_stat = os.stat(src)
+    if os.path.exists(dst) and os.stat(dst).st_mtime_ns == src_stat.st_mtime_ns:
+        return False
+    samples, orig_freq = read_wav_file(src)
+    if orig_freq != samp_freq:
+        samples = resample(samples, orig_freq, samp_freq)
+    write_wav_file(dst, samples, samp_freq)
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return True
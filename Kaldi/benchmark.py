@@ -0,0 +1,189 @@
+import sys
+import json
+import time
+import resource
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+
+from audio import read_wav_file
+from recognizer import AVAILABLE_MODEL_NAMES, Recognizer, get_true_word, list_wav_files
+
+
+
+def parse_grid(values, cast):
+    """
+    This function is used to parse a comma-separated list of values like
+    "13,15" where "none" means no value (e.g. no max_active limit).
+    """
+    return [None if v.lower() == "none" else cast(v) for v in values.split(",")]
+
+
+def peak_rss_mb():
+    """
+    This function returns the peak resident memory of the current process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024.**2 if sys.platform == "darwin" else peak / 1024.
+
+
+def find_pareto_front(runs):
+    """
+    This function is used to mark the runs that aren't dominated by any other
+    run, i.e. no other run is both faster (lower rtf) and more accurate.
+    """
+    for run in runs:
+        run["pareto"] = not any(
+            other["rtf"] <= run["rtf"] and other["accuracy"] >= run["accuracy"] and
+            (other["rtf"] < run["rtf"] or other["accuracy"] > run["accuracy"])
+            for other in runs)
+
+
+def _measure_run(args):
+    """
+    This function is used to measure one run inside the process of the pool,
+    which loads the test set & the model by itself.
+    """
+    base_dir, kaldi_dir, data_path, options = args
+    return DecodingBenchmark(base_dir, kaldi_dir, data_path).measure(*options)
+
+
+
+class DecodingBenchmark():
+
+    def __init__(self, base_dir, kaldi_dir, data_path):
+        """
+        This method is used to load the test set once into memory, so the
+        disk isn't part of the measurements.
+        Parameters:
+            - base_dir (string): full path where the trained models are located
+            - kaldi_dir (string): full path of the kaldi directory.
+            - data_path (string): full path of the data directory containing
+              wav files to be decoded, or just a wav-file.
+        """
+        self.BASE_DIR = base_dir
+        self.KALDI_DIR = kaldi_dir
+        self.DATA_PATH = data_path
+        self.utterances = []
+        for key, wav_path in list_wav_files(data_path):
+            samples, samp_freq = read_wav_file(wav_path)
+            self.utterances.append((key, samples, samp_freq))
+        assert len(self.utterances) > 0, "No wav files were found in: {}".format(data_path)
+        self.audio_seconds = sum(len(samples) / float(samp_freq)
+                                 for _, samples, samp_freq in self.utterances)
+
+
+    def run(self, model_name, beam, lattice_beam, max_active):
+        """
+        This method is used to decode the whole test set using one model and
+        one decoding configuration. Every run is measured in a new process, so
+        the model is really loaded (not taken from MODEL_REGISTRY) and the peak
+        memory belongs to this run only.
+        Returns:
+            - a dictionary of the measurements (see measure()).
+        """
+        #spawn starts a fresh interpreter instead of a copy of this process
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            return pool.apply(_measure_run, ((self.BASE_DIR, self.KALDI_DIR, self.DATA_PATH,
+                                              (model_name, beam, lattice_beam, max_active)),))
+
+
+    def measure(self, model_name, beam, lattice_beam, max_active):
+        """
+        This method is used to decode the whole test set in the current process.
+        Returns:
+            - a dictionary of the measurements, where all times are in seconds
+              except the latencies which are in milliseconds. The accuracy is
+              computed over the utterances whose true word is known.
+        """
+        rec = Recognizer(self.BASE_DIR, model_name, self.KALDI_DIR, beam=beam,
+                         lattice_beam=lattice_beam, max_active=max_active)
+        #load the model before measuring the decoding
+        start = time.time()
+        rec.ASR
+        load_time = time.time() - start
+        latencies, feature_time, search_time, correct, known = [], 0., 0., 0., 0
+        for key, samples, samp_freq in self.utterances:
+            start = time.time()
+            feats = rec.FEATS.compute(samples, samp_freq)
+            middle = time.time()
+            out = rec.ASR.decode(feats)
+            end = time.time()
+            feature_time += middle - start
+            search_time += end - middle
+            latencies.append((end - start) * 1000.)
+            true_word = get_true_word(key)
+            if true_word is not None:
+                known += 1
+                if true_word == out["text"]:
+                    correct += 1.
+        return {
+            "model": model_name,
+            "beam": beam,
+            "lattice_beam": lattice_beam,
+            "max_active": max_active,
+            "rtf": (feature_time + search_time) / self.audio_seconds,
+            "latency_ms": {"p50": float(np.percentile(latencies, 50)),
+                           "p95": float(np.percentile(latencies, 95)),
+                           "p99": float(np.percentile(latencies, 99)),
+                           "mean": float(np.mean(latencies))},
+            "feature_seconds": feature_time,
+            "search_seconds": search_time,
+            "load_seconds": load_time,
+            "peak_rss_mb": peak_rss_mb(),
+            "num_known": known,
+            "accuracy": correct / known if known else 0.,
+        }
+
+
+    def run_grid(self, model_names, beams, lattice_beams, max_actives):
+        """
+        This method is used to run every combination of models & decoding
+        options. The runs are sorted by model, then by beam, lattice_beam
+        and max_active.
+        Returns:
+            - a dictionary that can be written as JSON.
+        """
+        runs = []
+        for model_name, beam, lattice_beam, max_active in \
+          itertools.product(model_names, beams, lattice_beams, max_actives):
+            run = self.run(model_name, beam, lattice_beam, max_active)
+            print("{model:<6} beam={beam} lattice_beam={lattice_beam} max_active={max_active}"
+                  " rtf={rtf:.4f} accuracy={accuracy:.4f}".format(**run))
+            runs.append(run)
+        find_pareto_front(runs)
+        return {
+            "data_path": self.DATA_PATH,
+            "num_utterances": len(self.utterances),
+            "audio_seconds": self.audio_seconds,
+            "runs": runs,
+        }
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the decoding speed & accuracy "
+                                     "of the models over a grid of decoding options.")
+    parser.add_argument("base_dir", help="full path where the trained models are located")
+    parser.add_argument("kaldi_dir", help="full path of the kaldi directory")
+    parser.add_argument("data_path", help="directory of the test wav files")
+    parser.add_argument("--models", default=",".join(AVAILABLE_MODEL_NAMES),
+                        help="comma-separated model names")
+    parser.add_argument("--beams", default="13.0", help="comma-separated beams")
+    parser.add_argument("--lattice-beams", default="6.0",
+                        help="comma-separated lattice beams")
+    parser.add_argument("--max-actives", default="none",
+                        help="comma-separated max_active values, none means no limit")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="path of the output JSON file")
+    args = parser.parse_args()
+
+    bench = DecodingBenchmark(args.base_dir, args.kaldi_dir, args.data_path)
+    report = bench.run_grid(args.models.split(","),
+                            parse_grid(args.beams, float),
+                            parse_grid(args.lattice_beams, float),
+                            parse_grid(args.max_actives, int))
+    with open(args.output, "w") as fout:
+        json.dump(report, fout, indent=2)
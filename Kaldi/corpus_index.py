@@ -0,0 +1,132 @@
+import os
+import re
+import json
+from collections import namedtuple
+
+
+#the audio files of the corpus are named like: S<speaker>.<repetition>.<word id>.wav
+AUDIO_FILENAME = re.compile(r"^(S\d+)\.(\d+)\.(\d+)\.wav$")
+
+#one audio file of the corpus
+AudioEntry = namedtuple("AudioEntry", ["speaker", "rep", "word", "path", "size", "mtime"])
+
+
+
+class CorpusIndex():
+
+    def __init__(self, indir, index_path=None):
+        """
+        This method is used to index all the audio files of the corpus by
+        walking the corpus tree just once. The index is saved at index_path
+        (if given) and re-used by later runs as long as no directory of the
+        corpus has been modified (adding/removing a file changes the mtime of
+        its directory). The files of a re-used index are stat-ed again, as
+        overwriting a file in place doesn't change the mtime of its directory.
+        Parameters:
+            - indir (string): absolute path of the corpus.
+            - index_path (string): path of the persisted index.
+        This method sets these member variables:
+            - INDIR: same as indir
+            - INDEX_PATH: same as index_path
+            - entries: a list of AudioEntry sorted by (speaker, rep, word)
+            - dir_mtimes: the mtime of every directory of the corpus
+        """
+        self.INDIR = os.path.abspath(indir)
+        self.INDEX_PATH = index_path
+        self.entries = []
+        self.dir_mtimes = {}
+        if self.INDEX_PATH and self.__load():
+            return
+        self.__scan()
+        if self.INDEX_PATH:
+            self.save()
+
+
+    def __scan(self):
+        """
+        This private method is used to walk the corpus tree and parse the
+        name of every audio file into an AudioEntry.
+        """
+        entries = []
+        stack = [self.INDIR]
+        while stack:
+            dirpath = stack.pop()
+            self.dir_mtimes[dirpath] = os.stat(dirpath).st_mtime
+            for entry in os.scandir(dirpath):
+                if entry.is_dir():
+                    stack.append(entry.path)
+                    continue
+                match = AUDIO_FILENAME.match(entry.name)
+                if match:
+                    stat = entry.stat()
+                    speaker, rep, word = match.groups()
+                    entries.append(AudioEntry(speaker, int(rep), int(word),
+                                              entry.path, stat.st_size, stat.st_mtime))
+        self.entries = sorted(entries)
+
+
+    def __load(self):
+        """
+        This private method is used to load the persisted index.
+        Returns:
+            - True if the index was loaded and is still valid, False otherwise.
+        """
+        if not os.path.exists(self.INDEX_PATH):
+            return False
+        with open(self.INDEX_PATH) as fin:
+            index = json.load(fin)
+        if index["indir"] != self.INDIR:
+            return False
+        for dirpath, mtime in index["dir_mtimes"].items():
+            if not os.path.isdir(dirpath) or os.stat(dirpath).st_mtime != mtime:
+                return False
+        entries, changed = [], False
+        for row in index["entries"]:
+            entry = AudioEntry(*row)
+            try:
+                stat = os.stat(entry.path)
+            except OSError:
+                return False
+            if (stat.st_size, stat.st_mtime) != (entry.size, entry.mtime):
+                entry = entry._replace(size=stat.st_size, mtime=stat.st_mtime)
+                changed = True
+            entries.append(entry)
+        self.dir_mtimes = index["dir_mtimes"]
+        self.entries = entries
+        if changed:
+            self.save()
+        return True
+
+
+    def save(self):
+        """
+        This method is used to persist the index at INDEX_PATH.
+        """
+        tmp_path = self.INDEX_PATH + ".tmp"
+        with open(tmp_path, "w") as fout:
+            json.dump({"indir": self.INDIR,
+                       "dir_mtimes": self.dir_mtimes,
+                       "entries": [list(entry) for entry in self.entries]}, fout)
+        os.replace(tmp_path, self.INDEX_PATH)
+
+
+    def speakers(self):
+        """
+        This method returns the sorted list of speakers found in the corpus.
+        """
+        return sorted(set(entry.speaker for entry in self.entries))
+
+
+    def select(self, speakers, word_ids):
+        """
+        This method returns the audio files of the given speakers and words.
+        Parameters:
+            - speakers (list): speaker names like "S01".
+            - word_ids (list): ids of the words [1-20].
+        Returns:
+            - a list of AudioEntry sorted by (speaker, rep, word).
+        """
+        speakers = set(speakers)
+        word_ids = set(word_ids)
+        return [entry for entry in self.entries
+                if entry.speaker in speakers and entry.word in word_ids]
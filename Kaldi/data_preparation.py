@@ -1,11 +1,20 @@
 import os
 import re
+import json
+import argparse
 import shutil
-import subprocess
+import hashlib
 from glob import glob
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 from distutils.dir_util import copy_tree
 from utils import *
+from audio import resample_wav_file
+from corpus_index import CorpusIndex
+from lexicon_cache import LexiconCache
+from manifest import PrepManifest, Utterance, find_stale_artefacts, split_data_dir, \
+                     write_data_dir
 
 
 
@@ -23,6 +32,29 @@ class DataOrganizer():
         self.OUTDIR = os.path.join(self.basedir, self.dataset)
         self.TRAIN_DIR = os.path.join(self.OUTDIR, "data", "train")
         self.TEST_DIR = os.path.join(self.OUTDIR, "data", "test")
+        #the index of the audio files, it's re-used by later runs
+        self.INDEX_PATH = os.path.join(self.OUTDIR, "corpus_index.json")
+        #what the last data preparation produced, used by the incremental mode
+        self.MANIFEST_PATH = os.path.join(self.OUTDIR, "prep_manifest.json")
+        #the artefacts that need to be re-created (read by prepare.sh --incremental true)
+        self.STALE_REPORT_PATH = os.path.join(self.OUTDIR, "stale_artefacts.txt")
+        #how the audio files are staged: "auto", "hardlink", "reflink", "symlink" or "copy"
+        #("auto" uses hardlinks or reflinks when possible and falls back to copying)
+        self.STAGING_MODE = "auto"
+        #number of threads used for staging the audio files
+        self.STAGING_WORKERS = 8
+        #the sampling frequency of the models (sample-frequency in conf/mfcc.conf).
+        #When set, the audio files are resampled once into RESAMPLED_DIR (16-bit
+        #mono PCM, like Kaldi's resampler) and wav.scp points to them, so the feature
+        #extraction doesn't resample them every time. None keeps the original files.
+        self.SAMP_FREQ = None
+        #number of parallel jobs of prepare.sh & run_*.sh (it's limited by the number
+        #of speakers of the smallest group as every job takes whole speakers)
+        self.NUM_JOBS = os.cpu_count()
+        #the phonemizer that converts the words into phonemes (TODO: You MUST Change this)
+        self.PHONEMIZER = "/media/anwar/E/PRESENTATION/Phonemizer-1.0.jar"
+        #the cached pronunciations, they are shared by all the datasets in basedir
+        self.LEXICON_CACHE_DIR = os.path.join(self.basedir, "lexicon_cache")
         safe_makedir(self.OUTDIR)
         
         #words of the data
@@ -39,6 +71,12 @@ class DataOrganizer():
         self.TRAIN_SPEAKERS, self.TEST_SPEAKERS = self.__splitSpeakers(ratio=0.8)
 
 
+    @property
+    def RESAMPLED_DIR(self):
+        #follows SAMP_FREQ, so it's right even when SAMP_FREQ is set after __init__
+        return os.path.join(self.OUTDIR, "wav_{}".format(self.SAMP_FREQ))
+
+
     def __splitSpeakers(self, ratio=0.8):
         """
         This private method is used to split the speakers into two sets
@@ -71,23 +109,17 @@ class DataOrganizer():
         TEST_SPEAKERS that maps to WORDS after excluding EXCLUDE_WORDS_IDS
         NOTE: The number of words in the Arabic Corpus of Isolated Words
         is 20 whose IDs vary from [1-20]
+        Returns:
+            - two lists of AudioEntry (train & test) answered from the corpus
+              index which is built by walking the corpus tree just once.
         """
         #IDs from 1 to 20
         total_ids = set(range(1, 21))
         #exclude the EXCLUDED_IDS
         remaining_word_ids = list(total_ids - self.EXCLUDE_WORDS_IDS)
-        train_wavFiles = []
-        test_wavFiles = []
-        for sp in self.TRAIN_SPEAKERS:
-            for word_id in remaining_word_ids:
-                file_regex = sp+".*."+str(word_id).zfill(2)+".wav" #get files from 
-                train_wavFiles.extend(glob(os.path.join(self.indir, file_regex)))
-        train_wavFiles = [os.path.split(wav)[-1] for wav in train_wavFiles]
-        for sp in self.TEST_SPEAKERS:
-            for word_id in remaining_word_ids:
-                file_regex = sp+".*."+str(word_id).zfill(2)+".wav" #get files from 
-                test_wavFiles.extend(glob(os.path.join(self.indir, file_regex)))
-        test_wavFiles = [os.path.split(wav)[-1] for wav in test_wavFiles]
+        index = CorpusIndex(self.indir, self.INDEX_PATH)
+        train_wavFiles = index.select(self.TRAIN_SPEAKERS, remaining_word_ids)
+        test_wavFiles = index.select(self.TEST_SPEAKERS, remaining_word_ids)
         return train_wavFiles, test_wavFiles
 
 
@@ -97,83 +129,188 @@ class DataOrganizer():
         data for Kaldi. It should locate the preprocessed data inside
         "kaldi/egs/DATASET" where DATASET is the name of your dataset that can 
         be found in the self.dataset member variable
+        NOTE: The files are staged using STAGING_MODE by STAGING_WORKERS threads,
+        and the files whose size & modification time didn't change are skipped.
         """
-        for filename in tqdm(wav_files, desc="Copying Train dataset"):
-            speaker, rep, wordId, ext = filename.split(".")
-            #create speaker directory
+        #create speaker directories
+        for speaker in set(entry.speaker for entry in wav_files):
             safe_makedir(os.path.join(group_dir, speaker))
-            filepath = os.path.join(self.indir, speaker, filename)
-            newFilepath = os.path.join(group_dir, speaker, filename)
-            #copy the file
-            shutil.copyfile(filepath, newFilepath)
+        def stage(entry):
+            newFilepath = os.path.join(group_dir, entry.speaker,
+                                       os.path.basename(entry.path))
+            return stage_file(entry.path, newFilepath, self.STAGING_MODE)
+        with ThreadPoolExecutor(self.STAGING_WORKERS) as executor:
+            methods = Counter(tqdm(executor.map(stage, wav_files), total=len(wav_files),
+                                   desc="Staging {}".format(os.path.basename(group_dir))))
+        if methods:
+            print(", ".join("{}: {}".format(method, count)
+                            for method, count in sorted(methods.items())))
+
+
+    def __config_hash(self):
+        """
+        This method returns a hash of the settings that affect the content
+        of the data directories. Changing any of them makes the incremental
+        mode prepare all the utterances again.
+        """
+        config = {"words": self.WORDS,
+                  "female_speakers": sorted(self.FEMALE_SPEAKERS_IDS),
+                  "samp_freq": self.SAMP_FREQ}
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
 
 
-    def __create_spk2gender(self, group_dir):
+    def __utt_id(self, entry):
         """
-        This method is used to create "spk2gender" file that maps the 
-        speakers to their gender following this pattern
-        <speaker_id> <gender>
-        According to the gender, it's either 'm' for male or
-        'f' for female.
-        NOTE: all speakers that we are using are male
+        This method returns the utterance id of an audio file which follows
+        this pattern '<speakerId>_<wavName>'.
         """
-        with open(os.path.join(group_dir, "spk2gender"), "w") as fout:
-            for speaker in sorted(os.listdir(group_dir)):
-                if os.path.isdir(os.path.join(group_dir, speaker)):
-                    fout.write("{} {}\n".format(speaker, "m"))
+        return "{}_{}".format(entry.speaker, os.path.basename(entry.path)[:-4])
 
 
-    def __create_wav_scp(self, group_dir):
+    def __resampled_path(self, speaker, wav_file, group_dir):
+        """
+        This method returns the path of the resampled copy of a staged
+        audio file: RESAMPLED_DIR/<group>/<speaker>/<wav_file>
+        """
+        return os.path.join(self.RESAMPLED_DIR, os.path.basename(group_dir),
+                            speaker, wav_file)
+
+
+    def __remove_audio_by_group(self, utt_ids, group_dir):
+        """
+        This method is used to remove the staged (and resampled) audio files of
+        the given utterances (and their speaker directory when it becomes empty).
+        """
+        for utt_id in utt_ids:
+            speaker, wav_name = utt_id.split("_", 1)
+            wav_paths = [os.path.join(group_dir, speaker, wav_name + ".wav")]
+            if self.SAMP_FREQ:
+                wav_paths.append(self.__resampled_path(speaker, wav_name + ".wav", group_dir))
+            for wav_path in wav_paths:
+                if os.path.lexists(wav_path):
+                    os.remove(wav_path)
+                speaker_dir = os.path.dirname(wav_path)
+                if os.path.isdir(speaker_dir) and not os.listdir(speaker_dir):
+                    os.rmdir(speaker_dir)
+
+
+    def __resample_audio_by_group(self, wav_files, group_dir):
+        """
+        This method is used to resample the staged audio files to SAMP_FREQ
+        using a process per core. The files whose resampled copy is
+        up-to-date are skipped.
         """
-        This method is used to create "wav.scp" file that maps the
-        utterance_id to the audio wav file. It should follow this pattern:
-        <utterance_id> <audio abosulte path>
+        srcs, dsts = [], []
+        for entry in wav_files:
+            wav_file = os.path.basename(entry.path)
+            srcs.append(os.path.join(group_dir, entry.speaker, wav_file))
+            dsts.append(self.__resampled_path(entry.speaker, wav_file, group_dir))
+        for speaker in set(entry.speaker for entry in wav_files):
+            safe_makedir(os.path.dirname(self.__resampled_path(speaker, "", group_dir)))
+        with ProcessPoolExecutor() as executor:
+            written = sum(tqdm(executor.map(resample_wav_file, srcs, dsts,
+                                            [self.SAMP_FREQ]*len(srcs), chunksize=16),
+                               total=len(srcs),
+                               desc="Resampling {}".format(os.path.basename(group_dir))))
+        if srcs:
+            print("resampled: {}, skipped: {}".format(written, len(srcs) - written))
+
+
+    def __create_data_dir(self, wav_files, group_dir, headers=None):
+        """
+        This method is used to create all the mapping files of a group
+        directory in one sorted pass using the staged audio files:
+            - "wav.scp": <utterance_id> <audio abosulte path>
+            - "text": <utterance id> <text>
+            - "utt2spk": <utterance_id> <speaker>
+            - "spk2utt": <speaker> <utterance_id> <utterance_id> ...
+            - "spk2gender": <speaker_id> <gender> where gender is either 'm' for
+              male or 'f' for female.
+            - "utt2dur" & "utt2num_samples": the duration (in seconds) & the number
+              of samples of every utterance, read from the wav headers.
+            - "orig_wav.scp": <utterance_id> <original audio path> when the
+              audio files are resampled (wav.scp points to the resampled ones).
         utterance_id is a name that is unique for each single audio file in the data.
         So, I decided it to be following this pattern '<speakerId>_<wavName>'.
         You can use any other pattern that you find comfortable!
+        Parameters:
+            - headers (dict): the already known wav headers of some utterances.
+        Returns:
+            - a dictionary mapping every utterance id to its (num_samples, samp_freq).
         """
-        with open(os.path.join(group_dir, "wav.scp"), "w") as fout:
-            for speaker in sorted(os.listdir(group_dir)):
-                if re.match(r"S\d+", speaker):
-                    if os.path.isdir(os.path.join(group_dir, speaker)):
-                        wav_files = os.listdir(os.path.join(group_dir, speaker))
-                        for wav_file in sorted(wav_files):
-                            absPath = os.path.join(group_dir, speaker, wav_file)
-                            fout.write(
-                                "{}_{} {}\n".format(speaker, wav_file[:-4], absPath)
-                                )
-
-
-    def __create_text(self, group_dir):
+        utterances = []
+        orig_wav_paths = {}
+        for entry in wav_files:
+            wav_file = os.path.basename(entry.path)
+            utt_id = self.__utt_id(entry)
+            wav_path = os.path.join(group_dir, entry.speaker, wav_file)
+            if self.SAMP_FREQ:
+                orig_wav_paths[utt_id] = wav_path
+                wav_path = self.__resampled_path(entry.speaker, wav_file, group_dir)
+            gender = "f" if int(entry.speaker[1:]) in self.FEMALE_SPEAKERS_IDS else "m"
+            utterances.append(Utterance(
+                utt_id=utt_id,
+                speaker=entry.speaker,
+                gender=gender,
+                text=self.WORDS[entry.word-1],
+                wav_path=wav_path))
+        orig_scp = os.path.join(group_dir, "orig_wav.scp")
+        if orig_wav_paths:
+            #maps the utterances to their original audio files
+            with open(orig_scp, "w") as fout:
+                for utt_id in sorted(orig_wav_paths):
+                    fout.write("{} {}\n".format(utt_id, orig_wav_paths[utt_id]))
+        elif os.path.exists(orig_scp):
+            os.remove(orig_scp)
+        return write_data_dir(group_dir, utterances, headers=headers)
+
+
+    def __prepare_group(self, group, wav_files, group_dir, manifest):
         """
-        This method is used to create "text" file that maps the
-        utterance_id to the text. It follows this pattern:
-        <utterance id> <text>
+        This method is used to bring a group directory (train or test) up to
+        date with the given audio files. Only the utterances whose source file
+        was added, removed or changed since the last run (according to the
+        manifest) are staged or removed, then the mapping files are re-written
+        re-using the recorded wav headers of the other utterances.
+        Returns:
+            - True if any utterance of the group was added, removed or changed.
         """
-        with open(os.path.join(group_dir, "text"), "w") as fout:
-            for speaker in sorted(os.listdir(group_dir)):
-                if re.match(r"S\d+", speaker):
-                    wav_files = os.listdir(os.path.join(group_dir, speaker))
-                    for wav_file in sorted(wav_files):
-                        speaker, rep, wordId, ext = wav_file.split(".")
-                        fout.write("{}_{} {}\n"\
-                            .format(speaker, wav_file[:-4],
-                                    self.WORDS[int(wordId)-1]))
-
-
-    def __create_utt2spk(self, group_dir):
+        sources = {self.__utt_id(entry): (entry.path, entry.size, entry.mtime)
+                   for entry in wav_files}
+        added, removed, changed = manifest.diff(group, sources)
+        print("{}: {} added, {} removed, {} changed, {} unchanged".format(
+            group, len(added), len(removed), len(changed),
+            len(sources) - len(added) - len(changed)))
+        updated = set(added) | set(changed)
+        self.__remove_audio_by_group(removed, group_dir)
+        updated_files = [entry for entry in wav_files if self.__utt_id(entry) in updated]
+        self.__prepare_audio_by_group(updated_files, group_dir)
+        if self.SAMP_FREQ:
+            self.__resample_audio_by_group(updated_files, group_dir)
+        known_headers = {utt_id: header for utt_id, header in manifest.headers(group).items()
+                         if utt_id in sources and utt_id not in updated}
+        headers = self.__create_data_dir(wav_files, group_dir, known_headers)
+        manifest.update(group, sources, headers)
+        return bool(added or removed or changed)
+
+
+    def __report_stale_artefacts(self, changed_groups):
         """
-        This method is used to create "utt2spk" file that maps the 
-        utterances ids to their speaker following this pattern:
-        <utterance_id> <speaker>
+        This method is used to report the artefacts of prepare.sh & run_*.sh
+        that are now out-dated. They are added to STALE_REPORT_PATH, so they
+        are still reported when prepare_data() runs again before prepare.sh.
         """
-        with open(os.path.join(group_dir, "utt2spk"), "w") as fout:
-            for speaker in sorted(os.listdir(group_dir)):
-                if os.path.isdir(os.path.join(group_dir, speaker)):
-                    wav_files = os.listdir(os.path.join(group_dir, speaker))
-                    for wav_file in sorted(wav_files):
-                        fout.write("{}_{} {}\n"\
-                            .format(speaker, wav_file[:-4], speaker))
+        stale = set(find_stale_artefacts(self.OUTDIR, changed_groups))
+        if os.path.exists(self.STALE_REPORT_PATH):
+            with open(self.STALE_REPORT_PATH) as fin:
+                stale.update(line.strip() for line in fin if line.strip())
+        with open(self.STALE_REPORT_PATH, "w") as fout:
+            for path in sorted(stale):
+                fout.write("{}\n".format(path))
+        if stale:
+            print("These artefacts are stale and should be re-created:")
+            for path in sorted(stale):
+                print("\t{}".format(path))
 
 
     def __create_corpus(self, local_dir):
@@ -196,28 +333,19 @@ class DataOrganizer():
         NOTE: Here, I'm using my phenomizer. This phenomizer takes a
         text file as input and creates another text file containing
         the phenomes of the input based on my phoneset.
-        Then, I process this file to extract only the text phoneme.
-        """
-        corpus_path = os.path.join(local_dir, "corpus.txt")
-        phenomizer = "/media/anwar/E/PRESENTATION/Phonemizer-1.0.jar"
-        subprocess.check_output(['java', '-jar', phenomizer, corpus_path])
-        with open(os.path.join(local_dir, "corpus.txt")) as fin1,\
-          open(os.path.join(local_dir, "corpus.txt.ph")) as fin2:
-            text_lines = fin1.readlines()
-            phoneme_lines = fin2.readlines()
-            assert len(text_lines) == len(phoneme_lines), \
-                "There is an error in the phenomizer!!"
-        dict_dir = os.path.join(local_dir, "dict")  
-        safe_makedir(dict_dir)
+        The pronunciations are cached in LEXICON_CACHE_DIR, so only the words
+        that weren't seen before are sent to the phenomizer.
+        """
+        with open(os.path.join(local_dir, "corpus.txt")) as fin:
+            text_lines = [line.strip() for line in fin if line.strip()]
+        cache = LexiconCache(self.LEXICON_CACHE_DIR, self.PHONEMIZER)
+        phoneme_lines = cache.lookup(text_lines)
         with open(os.path.join(dict_dir, "lexicon.txt"), "w") as fout:
             #add SIL and <UNK>
             fout.write("!SIL sil\n")
             fout.write("<UNK> spn\n")
             for txt, ph in zip(text_lines, phoneme_lines):
-                txt = txt.strip()
-                ph = " ".join(splitPhone(ph))
-                fout.write("{} {}\n".format(txt, ph))
-        os.remove(os.path.join(local_dir, "corpus.txt.ph"))
+                fout.write("{} {}\n".format(txt, " ".join(ph)))
 
 
     def __create_non_silence_phones(self, dict_dir):
@@ -228,11 +356,8 @@ class DataOrganizer():
         This method should write these non_silence_phones into a text
         file called 'non_silence_phones.txt'
         """
-        phones = ['$', '@', 'A', 'P', 'R', 'S', 'T', 'a', 'a2',
-                  'b', 'd', 'f', 'h', 'i', 'i2', 'l', 'm', 'n',
-                  'r', 's', 't', 'w', 'x', 'y', '¥', '€']
         with open(os.path.join(dict_dir, "nonsilence_phones.txt"), "w") as fout:
-            for ph in phones:
+            for ph in NON_SILENCE_PHONES:
                 fout.write("{}\n".format(ph))
 
 
@@ -266,12 +391,13 @@ class DataOrganizer():
                 fout.write("{}\n".format(ph))
 
 
-    def __copy_files(self):
+    def __copy_files(self, num_jobs):
         """
         This method is used to copy certain files from the 'archive' directory to
         our processed data directory at kaldi/egs.
         NOTE:Instead of copying the whole files, we will create symbolik links
         of these files. symbolic link is like a shortcut.
+        NOTE: num_jobs is exported as NUM_JOBS by path.sh
         """
         archive_path = os.path.abspath("archive")
         #copy archive/utils
@@ -292,40 +418,58 @@ class DataOrganizer():
         #copy cmd.sh
         shutil.copy(src=os.path.join(archive_path, "cmd.sh"),
                     dst=os.path.join(self.OUTDIR, "cmd.sh"))
+        #copy mfcc.py (it finds the rest of the repository through the link)
+        safe_create_symlink(src=os.path.abspath("mfcc.py"),
+                            dst=os.path.join(self.OUTDIR, "mfcc.py"))
         #copy run_*.sh
         copy_regex(src=os.path.join(archive_path, "run_*.sh"),
                    dst=os.path.join(self.OUTDIR, "run_*.sh"))
         #create path.sh
-        create_path_sh(self.OUTDIR)
+        create_path_sh(self.OUTDIR, num_jobs)
 
 
-    def prepare_data(self):
+    def prepare_data(self, incremental=False):
+        """
+        This method is used to prepare the whole recipe. When incremental is
+        True, only the utterances that were added, removed or changed since
+        the last run are processed and the stale artefacts are reported.
+        """
         # ----- Create Necessary Directories -----
         #create data directory
         safe_makedir(os.path.join(self.OUTDIR, "data"))
         #create train directory
         safe_makedir(self.TRAIN_DIR)
-        test_dir = os.path.join(self.OUTDIR, "data", "test")
-        safe_makedir(self.TRAIN_DIR)
+        #create test directory
+        safe_makedir(self.TEST_DIR)
         
-        # ----- Prepare Audio Data -----
+        # ----- Prepare Audio Data & Mapping Files -----
+        #stage the audio files and create 'wav.scp', 'text', 'utt2spk', 'spk2utt',
+        #'spk2gender', 'utt2dur' and 'utt2num_samples'
+        manifest = PrepManifest(self.MANIFEST_PATH, self.__config_hash())
+        if not incremental:
+            manifest.groups = {}
         train_wavfiles, test_wavfiles = self.__getAudioFiles()
-        self.__prepare_audio_by_group(train_wavfiles, self.TRAIN_DIR)
-        self.__prepare_audio_by_group(test_wavfiles, self.TEST_DIR)
-
-        # ----- Prepare Mapping Files -----
-        #create 'spk2gender'
-        self.__create_spk2gender(self.TRAIN_DIR)
-        self.__create_spk2gender(self.TEST_DIR)
-        #create 'wav.scp'
-        self.__create_wav_scp(self.TRAIN_DIR)
-        self.__create_wav_scp(self.TEST_DIR)
-        #create 'text'
-        self.__create_text(self.TRAIN_DIR)
-        self.__create_text(self.TEST_DIR)
-        #create 'utt2spk'
-        self.__create_utt2spk(self.TRAIN_DIR)
-        self.__create_utt2spk(self.TEST_DIR)
+        #every job of prepare.sh & run_*.sh takes whole speakers of both groups
+        for group, wavfiles in [("train", train_wavfiles), ("test", test_wavfiles)]:
+            if not wavfiles:
+                raise ValueError("The {} group has no audio files (check indir, "
+                                 "the speakers split & the excluded speakers/words)"
+                                 .format(group))
+        changed_groups = []
+        if self.__prepare_group("train", train_wavfiles, self.TRAIN_DIR, manifest):
+            changed_groups.append("train")
+        if self.__prepare_group("test", test_wavfiles, self.TEST_DIR, manifest):
+            changed_groups.append("test")
+        manifest.save()
+        self.__report_stale_artefacts(changed_groups)
+
+        # ----- Split Data For Parallel Jobs -----
+        #create 'split<N>' directories balanced by the duration of the speakers
+        num_jobs = min(self.NUM_JOBS,
+                       len(set(entry.speaker for entry in train_wavfiles)),
+                       len(set(entry.speaker for entry in test_wavfiles)))
+        split_data_dir(self.TRAIN_DIR, num_jobs)
+        split_data_dir(self.TEST_DIR, num_jobs)
 
         # ----- Prepare Local corpuss -----
         local_dir = os.path.join(self.OUTDIR, "data", "local")
@@ -345,11 +489,18 @@ class DataOrganizer():
         self.__create_optional_silence(dict_dir, optional_phones=["sil"])
 
         # ----- Copy Data -----
-        self.__copy_files()
+        self.__copy_files(num_jobs)
 
 
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare the data directories, the "
+                                     "lexicon & the scripts of the recipe.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only process the utterances that were added, removed or "
+                        "changed since the last run (see prep_manifest.json)")
+    args = parser.parse_args()
+
     obj = DataOrganizer()
-    obj.prepare_data()
+    obj.prepare_data(incremental=args.incremental)
@@ -0,0 +1,425 @@
+import os
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+from kaldi.feat.mfcc import Mfcc, MfccOptions
+from kaldi.feat.resample import LinearResample
+from kaldi.feat.functions import compute_deltas, splice_frames, DeltaFeaturesOptions
+from kaldi.matrix import Matrix, SubMatrix, Vector
+from kaldi.transform.cmvn import Cmvn
+from kaldi.util.io import xopen
+
+from mfcc import MFCC_CONF
+from utils import safe_makedir
+
+
+#models trained over MFCC + ∆ + ∆∆ (archive/steps/train_deltas.sh)
+DELTA_MODELS = ["mono", "tri1", "tri2a"]
+#models trained over spliced MFCC + LDA + MLLT (archive/steps/train_lda_mllt.sh)
+LDA_MODELS = ["tri2b", "tri3a", "tri3b", "tri3c", "tri3d"]
+
+#Kaldi option names that don't match the attribute names in pykaldi
+OPTION_ALIASES = {
+    "sample-frequency": "samp_freq",
+    "frame-shift": "frame_shift_ms",
+    "frame-length": "frame_length_ms",
+    "preemphasis-coefficient": "preemph_coeff",
+    "num-mel-bins": "num_bins",
+}
+
+
+def read_mfcc_options(conf_path):
+    """
+    This function is used to parse a Kaldi config file (like mfcc.conf)
+    into an MfccOptions object. Every line should follow this pattern
+    --<option-name>=<value>   # optional comment
+    The option is set on the MfccOptions itself or on its frame_opts
+    or mel_opts depending on where it's defined.
+    """
+    opts = MfccOptions()
+    #the recognizer has always downsampled the input audio (--allow-downsample)
+    opts.frame_opts.allow_downsample = True
+    with open(conf_path) as fin:
+        for line in fin:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            name, value = line.lstrip("-").split("=", 1)
+            attr = OPTION_ALIASES.get(name, name.replace("-", "_"))
+            for obj in [opts, opts.frame_opts, opts.mel_opts]:
+                if hasattr(obj, attr):
+                    old_value = getattr(obj, attr)
+                    if isinstance(old_value, bool):
+                        value = value.lower() == "true"
+                    elif not isinstance(old_value, str):
+                        value = type(old_value)(value)
+                    setattr(obj, attr, value)
+                    break
+            else:
+                raise ValueError("Unknown mfcc option: --{}".format(name))
+    return opts
+
+
+def read_transform(transform_path):
+    """
+    This function is used to read a Kaldi transform matrix (like final.mat)
+    and returns it as a numpy array.
+    """
+    with xopen(transform_path) as ki:
+        return Matrix().read_(ki.stream(), ki.binary).numpy()
+
+
+
+class FeatureCache():
+
+    def __init__(self, cache_dir, max_bytes=2*1024**3):
+        """
+        This method is used to define an on-disk cache of features that is
+        shared across models and runs. Every entry is a float32 matrix saved
+        as a .npy file named after the hash of the audio and the feature
+        configuration, so it can be memory-mapped without copying.
+        Parameters:
+            - cache_dir (string): the directory where the features are stored.
+            - max_bytes (int): the maximum size of the cache. When exceeded, the
+              least recently used entries are evicted.
+        """
+        self.CACHE_DIR = cache_dir
+        self.MAX_BYTES = max_bytes
+        safe_makedir(self.CACHE_DIR)
+        #maps the key to the size of its entry ordered by the last access time
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        existing = []
+        for filename in os.listdir(self.CACHE_DIR):
+            if filename.endswith(".npy"):
+                stat = os.stat(os.path.join(self.CACHE_DIR, filename))
+                existing.append((stat.st_mtime, filename[:-4], stat.st_size))
+        for _, key, size in sorted(existing):
+            self.entries[key] = size
+            self.total_bytes += size
+
+
+    @staticmethod
+    def make_key(waveform, samp_freq, config_hash):
+        """
+        This method returns the key of a waveform using the hash of its
+        samples, its sampling frequency and the feature configuration.
+        """
+        if isinstance(waveform, Vector):
+            waveform = waveform.numpy()
+        waveform = np.ascontiguousarray(waveform, dtype=np.float32)
+        sha = hashlib.sha1(config_hash.encode())
+        sha.update(str(float(samp_freq)).encode())
+        sha.update(waveform.tobytes())
+        return sha.hexdigest()
+
+
+    def __path(self, key):
+        return os.path.join(self.CACHE_DIR, key + ".npy")
+
+
+    def get(self, key):
+        """
+        This method returns the cached features of the given key as a
+        SubMatrix that shares the memory-mapped file, or None if missing.
+        """
+        path = self.__path(key)
+        try:
+            #copy-on-write mapping, so the cached file is never modified
+            feats = np.load(path, mmap_mode="c")
+            os.utime(path)
+        except (IOError, OSError, ValueError):
+            self.__forget(key)
+            return None
+        if key not in self.entries:
+            #written by another process
+            self.entries[key] = os.path.getsize(path)
+            self.total_bytes += self.entries[key]
+        self.entries.move_to_end(key)
+        return SubMatrix(feats)
+
+
+    def put(self, key, feats):
+        """
+        This method is used to add features to the cache, then evicts the
+        least recently used entries if the cache became bigger than MAX_BYTES.
+        """
+        path = self.__path(key)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as fout:
+            np.save(fout, np.ascontiguousarray(feats, dtype=np.float32))
+        #atomic, so concurrent readers never see a partial file
+        os.replace(tmp_path, path)
+        self.__forget(key)
+        self.entries[key] = os.path.getsize(path)
+        self.total_bytes += self.entries[key]
+        self.__evict()
+
+
+    def __forget(self, key):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)
+
+
+    def __evict(self):
+        while self.total_bytes > self.MAX_BYTES and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self.__forget(key)
+            try:
+                os.remove(self.__path(key))
+            except OSError:
+                pass
+
+
+
+class FeaturePipeline():
+
+    def __init__(self, model_name, model_dir, mfcc_conf=MFCC_CONF,
+                 delta_opts=None, left_context=4, right_context=4, cache=None):
+        """
+        This method is used to build the feature pipeline of a model once,
+        so it can be applied in-memory to any number of waveforms.
+        Parameters:
+            - model_name (string): the name of the model (mono, tri1, ...).
+            - model_dir (string): full path of the model directory where
+              final.mat can be found (for LDA+MLLT models only).
+            - mfcc_conf (string): path of the mfcc configuration file.
+            - delta_opts (DeltaFeaturesOptions): options of the deltas stage,
+              same as add-deltas defaults if not provided.
+            - left_context, right_context (int): number of frames used by the
+              splicing stage, same as splice-feats defaults.
+            - cache (FeatureCache): cache of the normalized mfcc features which
+              is shared by all the models, None to disable caching.
+        This method sets these member variables:
+            - MODEL_NAME: same as model_name
+            - MFCC_OPTS: the options of the mfcc stage
+            - DELTA_OPTS: the options of the deltas stage
+            - LEFT_CONTEXT, RIGHT_CONTEXT: the options of the splicing stage
+            - TRANSFORM: the LDA+MLLT matrix (None for delta models)
+            - CONFIG_HASH: the hash of the mfcc configuration
+            - CACHE: same as cache
+        """
+        assert model_name in DELTA_MODELS + LDA_MODELS, \
+            "Unknown model name: {}".format(model_name)
+        self.MODEL_NAME = model_name
+        self.MFCC_OPTS = read_mfcc_options(mfcc_conf)
+        self.DELTA_OPTS = delta_opts if delta_opts else DeltaFeaturesOptions()
+        self.LEFT_CONTEXT = left_context
+        self.RIGHT_CONTEXT = right_context
+        self.TRANSFORM = None
+        if self.MODEL_NAME in LDA_MODELS:
+            self.TRANSFORM = read_transform(os.path.join(model_dir, "final.mat"))
+        with open(mfcc_conf, "rb") as fin:
+            self.CONFIG_HASH = hashlib.sha1(fin.read()).hexdigest()
+        self.CACHE = cache
+        self.mfcc = Mfcc(self.MFCC_OPTS)
+
+
+    def compute_mfcc(self, waveform, samp_freq):
+        """
+        This method does the same functionality as archive/steps/make_mfcc.sh
+        Parameters:
+            - waveform (Vector or numpy array): the audio samples of one channel
+              in the range of 16-bit integers (NOT normalized to [-1, 1]).
+            - samp_freq (float): the sampling frequency of the waveform.
+        Returns:
+            - a Matrix of mfcc features (frames x num_ceps)
+        """
+        if not isinstance(waveform, Vector):
+            waveform = Vector(np.asarray(waveform, dtype=np.float32))
+        return self.mfcc.compute_features(waveform, samp_freq, 1.0)
+
+
+    def apply_cmvn(self, feats):
+        """
+        This method does the same functionality as
+        apply-cmvn-sliding --cmn-window=1000000000 --center=true
+        which is mean normalization over the whole audio file.
+        NOTE: feats is normalized in-place.
+        """
+        cmvn = Cmvn(feats.num_cols)
+        cmvn.accumulate(feats)
+        cmvn.apply(feats, norm_vars=False)
+        return feats
+
+
+    def add_context(self, feats):
+        """
+        This method is used to add the context of the neighbouring frames
+        to the normalized features. It does the same functionality as
+        add-deltas for delta models and splice-feats for LDA+MLLT models.
+        """
+        if self.MODEL_NAME in DELTA_MODELS:
+            return compute_deltas(self.DELTA_OPTS, feats)
+        return splice_frames(feats, self.LEFT_CONTEXT, self.RIGHT_CONTEXT)
+
+
+    def context_size(self):
+        """
+        This method returns the number of future frames that add_context()
+        needs to see before the output of a frame becomes final.
+        """
+        if self.MODEL_NAME in DELTA_MODELS:
+            return self.DELTA_OPTS.order * self.DELTA_OPTS.window
+        return max(self.LEFT_CONTEXT, self.RIGHT_CONTEXT)
+
+
+    def apply_transform(self, feats):
+        """
+        This method does the same functionality as transform-feats using
+        final.mat of the model. It handles both linear and affine transforms.
+        Delta models are returned as they are.
+        """
+        if self.TRANSFORM is None:
+            return feats
+        dim = feats.num_cols
+        linear = self.TRANSFORM[:, :dim]
+        out = np.dot(feats.numpy(), linear.T)
+        if self.TRANSFORM.shape[1] == dim + 1:
+            out += self.TRANSFORM[:, dim]
+        return Matrix(out.astype(np.float32, copy=False))
+
+
+    def compute_base(self, waveform, samp_freq):
+        """
+        This method is used to compute the model-independent part of the
+        pipeline (mfcc + cmvn) which is shared by all the models.
+        The cache is used (if any) to compute only the missing features.
+        """
+        if self.CACHE is None:
+            return self.apply_cmvn(self.compute_mfcc(waveform, samp_freq))
+        key = self.CACHE.make_key(waveform, samp_freq, self.CONFIG_HASH)
+        feats = self.CACHE.get(key)
+        if feats is None:
+            feats = self.apply_cmvn(self.compute_mfcc(waveform, samp_freq))
+            self.CACHE.put(key, feats.numpy())
+        return feats
+
+
+    def compute(self, waveform, samp_freq):
+        """
+        This method is used to run the whole pipeline over a waveform.
+        Returns:
+            - a Matrix of the features that are ready for the decoder.
+        """
+        feats = self.compute_base(waveform, samp_freq)
+        return self.apply_transform(self.add_context(feats))
+
+
+
+class FeatureStream():
+
+    def __init__(self, pipeline, samp_freq):
+        """
+        This method is used to run a FeaturePipeline incrementally over
+        chunks of live audio. Frames are computed as soon as the audio
+        covering them arrives and the whole-file mean normalization is
+        replaced by a running mean over the frames seen so far.
+        Parameters:
+            - pipeline (FeaturePipeline): the pipeline of the model.
+            - samp_freq (float): the sampling frequency of the incoming audio.
+        NOTE: the frames are cut the same way as compute-mfcc-feats
+        with --snip-edges=true (Kaldi's default).
+        """
+        frame_opts = pipeline.MFCC_OPTS.frame_opts
+        assert frame_opts.snip_edges, "streaming requires --snip-edges=true"
+        self.pipeline = pipeline
+        self.resampler = None
+        if samp_freq != frame_opts.samp_freq:
+            assert samp_freq > frame_opts.samp_freq and frame_opts.allow_downsample, \
+                "The audio sampling frequency must be >= {}".format(frame_opts.samp_freq)
+            #same filter used by compute-mfcc-feats --allow-downsample
+            cutoff = 0.99 * 0.5 * frame_opts.samp_freq
+            self.resampler = LinearResample(int(samp_freq), int(frame_opts.samp_freq),
+                                            cutoff, 6)
+        self.samp_freq = frame_opts.samp_freq
+        self.window_size = int(frame_opts.samp_freq * 0.001 * frame_opts.frame_length_ms)
+        self.window_shift = int(frame_opts.samp_freq * 0.001 * frame_opts.frame_shift_ms)
+        #samples that haven't been turned into frames yet
+        self.samples = np.zeros(0, dtype=np.float32)
+        #running statistics of the mean normalization
+        self.cmvn_sum = None
+        self.cmvn_count = 0
+        #normalized frames that are waiting for their context
+        self.normalized = None
+        self.num_emitted = 0
+
+
+    def __compute_frames(self):
+        """
+        This private method is used to turn the buffered samples into
+        normalized mfcc frames.
+        """
+        if self.samples.shape[0] < self.window_size:
+            return
+        num_frames = 1 + (self.samples.shape[0] - self.window_size) // self.window_shift
+        num_samples = (num_frames - 1) * self.window_shift + self.window_size
+        feats = self.pipeline.compute_mfcc(self.samples[:num_samples], self.samp_freq).numpy()
+        self.samples = self.samples[num_frames * self.window_shift:]
+        #running mean normalization
+        if self.cmvn_sum is None:
+            self.cmvn_sum = np.zeros(feats.shape[1], dtype=np.float64)
+            self.normalized = np.zeros((0, feats.shape[1]), dtype=np.float32)
+        sums = self.cmvn_sum + np.cumsum(feats, axis=0)
+        counts = self.cmvn_count + np.arange(1, num_frames + 1)
+        feats = feats - sums / counts[:, None]
+        self.cmvn_sum = sums[-1]
+        self.cmvn_count = counts[-1]
+        self.normalized = np.vstack([self.normalized, feats.astype(np.float32)])
+
+
+    def __emit(self, flush):
+        """
+        This private method is used to add the context & transform to the
+        frames whose future context is complete (all frames when flushing).
+        Returns:
+            - a Matrix of the new decoder-ready frames (can be empty).
+        """
+        if self.normalized is None:
+            return Matrix()
+        ctx = self.pipeline.context_size()
+        num_frames = self.normalized.shape[0]
+        ready = num_frames if flush else max(num_frames - ctx, self.num_emitted)
+        if ready == self.num_emitted:
+            return Matrix()
+        #the context of the emitted frames only depends on this window
+        start = max(0, self.num_emitted - ctx)
+        end = min(num_frames, ready + ctx)
+        window = self.pipeline.add_context(Matrix(self.normalized[start:end]))
+        feats = window.numpy()[self.num_emitted - start: ready - start]
+        self.num_emitted = ready
+        #drop frames that won't be needed as a context anymore
+        drop = max(0, self.num_emitted - ctx)
+        self.normalized = self.normalized[drop:]
+        self.num_emitted -= drop
+        return self.pipeline.apply_transform(Matrix(feats))
+
+
+    def accept_waveform(self, chunk):
+        """
+        This method is used to feed a new chunk of audio to the stream.
+        Parameters:
+            - chunk (numpy array): the audio samples in the range of 16-bit integers.
+        Returns:
+            - a Matrix of the new decoder-ready frames (can be empty).
+        """
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if self.resampler is not None:
+            chunk = self.resampler.resample(Vector(chunk), False).numpy()
+        self.samples = np.concatenate([self.samples, chunk])
+        self.__compute_frames()
+        return self.__emit(flush=False)
+
+
+    def finalize(self):
+        """
+        This method is used to mark the end of the audio.
+        Returns:
+            - a Matrix of the remaining decoder-ready frames (can be empty).
+        """
+        if self.resampler is not None:
+            tail = self.resampler.resample(Vector(), True).numpy()
+            self.samples = np.concatenate([self.samples, tail])
+        self.__compute_frames()
+        return self.__emit(flush=True)
@@ -0,0 +1,99 @@
+import os
+import hashlib
+import tempfile
+import subprocess
+import unicodedata
+
+from utils import PhoneTokenizer, safe_makedir
+
+
+#the tatweel (kashida) is just used for stretching the Arabic letters
+TATWEEL = "ـ"
+
+
+def normalize_word(word):
+    """
+    This function returns the key of a word in the lexicon cache which is
+    the NFC form of the word without the surrounding spaces and tatweels.
+    """
+    return unicodedata.normalize("NFC", word.strip()).replace(TATWEEL, "")
+
+
+
+class LexiconCache():
+
+    def __init__(self, cache_dir, phonemizer, batch_size=10000, tokenizer=None):
+        """
+        This method is used to define a persistent cache of the pronunciations
+        returned by the phonemizer. The pronunciations depend on the phonemizer,
+        so every phonemizer (identified by the size & modification time of its
+        jar file) has its own cache file inside cache_dir. The cache file
+        is shared by all the datasets that use the same cache_dir.
+        Parameters:
+            - cache_dir (string): the directory of the cache files.
+            - phonemizer (string): path of the phonemizer jar file.
+            - batch_size (int): maximum number of words sent to one run
+              of the phonemizer (one JVM launch).
+            - tokenizer (PhoneTokenizer): splits the phonemizer output into the
+              phones of the inventory (NON_SILENCE_PHONES by default).
+        This method sets these member variables:
+            - CACHE_DIR, PHONEMIZER, BATCH_SIZE: same as the parameters
+            - TOKENIZER: same as tokenizer
+            - CACHE_PATH: path of the cache file of this phonemizer
+            - lexicon: a dictionary mapping every cached word to its phones
+        """
+        self.CACHE_DIR = cache_dir
+        self.PHONEMIZER = phonemizer
+        self.BATCH_SIZE = batch_size
+        self.TOKENIZER = tokenizer if tokenizer else PhoneTokenizer()
+        safe_makedir(self.CACHE_DIR)
+        stat = os.stat(self.PHONEMIZER)
+        version = "{}:{}:{}".format(os.path.basename(self.PHONEMIZER),
+                                    stat.st_size, stat.st_mtime_ns)
+        self.CACHE_PATH = os.path.join(self.CACHE_DIR, "lexicon_{}.txt".format(
+            hashlib.sha1(version.encode("utf-8")).hexdigest()[:16]))
+        self.lexicon = {}
+        if os.path.exists(self.CACHE_PATH):
+            with open(self.CACHE_PATH, encoding="utf-8") as fin:
+                for line in fin:
+                    word, phones = line.rstrip("\n").split("\t")
+                    self.lexicon[word] = phones.split()
+
+
+    def __phonemize(self, words):
+        """
+        This private method is used to run the phonemizer once over a batch of
+        words. The phonemizer takes a text file as input and creates another
+        text file (with .ph extension) containing the phonemes of every line.
+        Returns:
+            - a list of the phones of every word.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            words_path = os.path.join(tmp_dir, "words.txt")
+            with open(words_path, "w", encoding="utf-8") as fout:
+                for word in words:
+                    fout.write("{}\n".format(word))
+            subprocess.check_output(["java", "-jar", self.PHONEMIZER, words_path])
+            phones = list(self.TOKENIZER.tokenize_file(words_path + ".ph"))
+        assert len(phones) == len(words), "There is an error in the phenomizer!!"
+        return phones
+
+
+    def lookup(self, words):
+        """
+        This method returns the phones of the given words. Only the words that
+        aren't cached yet are sent to the phonemizer (in batches of BATCH_SIZE)
+        and their phones are appended to the cache file.
+        Returns:
+            - a list of the phones of every word following the order of words.
+        """
+        keys = [normalize_word(word) for word in words]
+        missing = sorted(set(key for key in keys if key not in self.lexicon))
+        for start in range(0, len(missing), self.BATCH_SIZE):
+            batch = missing[start:start+self.BATCH_SIZE]
+            phones = self.__phonemize(batch)
+            with open(self.CACHE_PATH, "a", encoding="utf-8") as fout:
+                for word, word_phones in zip(batch, phones):
+                    fout.write("{}\t{}\n".format(word, " ".join(word_phones)))
+                    self.lexicon[word] = word_phones
+        return [self.lexicon[key] for key in keys]
@@ -0,0 +1,320 @@
+import os
+import re
+import json
+import wave
+import shutil
+import fnmatch
+from glob import glob
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+#one utterance of a Kaldi data directory
+Utterance = namedtuple("Utterance", ["utt_id", "speaker", "gender", "text", "wav_path"])
+
+#the files written by write_data_dir()
+DATA_DIR_FILES = ["wav.scp", "text", "utt2spk", "spk2utt", "spk2gender",
+                  "utt2dur", "utt2num_samples"]
+
+#the files of a data directory that are split by utterance & by speaker
+#(same as utils/split_data.sh)
+UTT_SPLIT_FILES = ["wav.scp", "text", "utt2dur", "utt2num_samples", "feats.scp"]
+SPK_SPLIT_FILES = ["spk2gender", "cmvn.scp"]
+
+
+def read_wav_header(wav_path):
+    """
+    This function reads just the header of a wav file.
+    Returns:
+        - the number of samples (per channel) and the sampling frequency.
+    """
+    with wave.open(wav_path, "rb") as fin:
+        return fin.getnframes(), fin.getframerate()
+
+
+def write_data_dir(data_dir, utterances, num_workers=8, buffer_size=1024**2, headers=None):
+    """
+    This function is used to write all the files of a Kaldi data directory
+    (wav.scp, text, utt2spk, spk2utt, spk2gender, utt2dur, utt2num_samples)
+    in one sorted pass over the utterances, so the output passes
+    utils/validate_data_dir.sh without running utils/fix_data_dir.sh.
+    Parameters:
+        - data_dir (string): the data directory like data/train.
+        - utterances (list): the Utterance of every audio file. The speaker id
+          must be a prefix of the utterance id (Kaldi's convention).
+        - num_workers (int): number of threads reading the wav headers.
+        - buffer_size (int): the write buffer of every file.
+        - headers (dict): the already known (num_samples, samp_freq) of some
+          utterance ids, their wav files aren't read again.
+    Returns:
+        - a dictionary mapping every utterance id to its (num_samples, samp_freq).
+    """
+    #Kaldi sorts using LC_ALL=C which is the same as sorting the unicode code points
+    utterances = sorted(utterances, key=lambda utt: utt.utt_id)
+    for prev, utt in zip(utterances, utterances[1:]):
+        assert prev.utt_id != utt.utt_id, "Duplicate utterance id: {}".format(utt.utt_id)
+    headers = dict(headers) if headers else {}
+    missing = [utt for utt in utterances if utt.utt_id not in headers]
+    with ThreadPoolExecutor(num_workers) as executor:
+        for utt, header in zip(missing, executor.map(read_wav_header,
+                                                     [utt.wav_path for utt in missing])):
+            headers[utt.utt_id] = header
+    spk2utt = {}
+    spk2gender = {}
+    files = {name: open(os.path.join(data_dir, name), "w", buffering=buffer_size)
+             for name in DATA_DIR_FILES}
+    try:
+        for utt in utterances:
+            assert utt.utt_id.startswith(utt.speaker), \
+                "The speaker id must be a prefix of the utterance id: {}".format(utt.utt_id)
+            num_samples, samp_freq = headers[utt.utt_id]
+            files["wav.scp"].write("{} {}\n".format(utt.utt_id, utt.wav_path))
+            files["text"].write("{} {}\n".format(utt.utt_id, utt.text))
+            files["utt2spk"].write("{} {}\n".format(utt.utt_id, utt.speaker))
+            files["utt2dur"].write("{} {:.3f}\n".format(utt.utt_id, num_samples / float(samp_freq)))
+            files["utt2num_samples"].write("{} {}\n".format(utt.utt_id, num_samples))
+            spk2utt.setdefault(utt.speaker, []).append(utt.utt_id)
+            spk2gender[utt.speaker] = utt.gender
+        for speaker in sorted(spk2utt):
+            files["spk2utt"].write("{} {}\n".format(speaker, " ".join(spk2utt[speaker])))
+            files["spk2gender"].write("{} {}\n".format(speaker, spk2gender[speaker]))
+    finally:
+        for fout in files.values():
+            fout.close()
+    return {utt.utt_id: tuple(headers[utt.utt_id]) for utt in utterances}
+
+
+
+def read_table(path):
+    """
+    This function reads a Kaldi text table like utt2spk as a list of
+    (key, value) pairs following the order of the file.
+    """
+    with open(path) as fin:
+        return [tuple(line.rstrip("\n").split(" ", 1)) for line in fin if line.strip()]
+
+
+def partition_speakers(speakers, durations, num_jobs):
+    """
+    This function is used to split the sorted speakers into num_jobs contiguous
+    shards of about the same total duration. The shards are contiguous (like
+    utils/split_scp.pl) so concatenating the outputs of the jobs keeps the
+    utterances sorted.
+    Parameters:
+        - speakers (list): the sorted speaker ids.
+        - durations (dict): the total duration of every speaker.
+        - num_jobs (int): the number of shards.
+    Returns:
+        - a list of num_jobs lists of speakers, none of them is empty.
+    """
+    assert 0 < num_jobs <= len(speakers), \
+        "Can't split {} speakers into {} jobs".format(len(speakers), num_jobs)
+    total = float(sum(durations[spk] for spk in speakers))
+    shards = [[]]
+    elapsed = 0.
+    for i, spk in enumerate(speakers):
+        remaining_speakers = len(speakers) - i
+        remaining_shards = num_jobs - len(shards)
+        #start a new shard when the middle of this speaker goes beyond the
+        #end of the current shard, or when each remaining shard needs a speaker
+        if shards[-1] and remaining_shards > 0 and \
+          (elapsed + durations[spk] / 2. > total * len(shards) / num_jobs or
+           remaining_speakers == remaining_shards):
+            shards.append([])
+        shards[-1].append(spk)
+        elapsed += durations[spk]
+    return shards
+
+
+def split_data_dir(data_dir, num_jobs):
+    """
+    This function is used to write the split<num_jobs> directories of a
+    data directory that the steps/*.sh scripts expect (split<N>/1 ... split<N>/N).
+    Unlike utils/split_data.sh, which balances the number of utterances, the
+    speakers are split by their total duration (read from utt2dur) so that
+    the parallel jobs have an even load. Other split<M> directories are
+    removed as they are out-dated by the new data directory.
+    Parameters:
+        - data_dir (string): the data directory like data/train.
+        - num_jobs (int): the number of shards.
+    Returns:
+        - the split directory.
+    """
+    utt2spk = read_table(os.path.join(data_dir, "utt2spk"))
+    durations = {}
+    for utt_id, dur in read_table(os.path.join(data_dir, "utt2dur")):
+        durations[utt_id] = float(dur)
+    spk_durations = {}
+    for utt_id, spk in utt2spk:
+        spk_durations[spk] = spk_durations.get(spk, 0.) + durations[utt_id]
+    shards = partition_speakers(sorted(spk_durations), spk_durations, num_jobs)
+    spk2job = {spk: job for job, shard in enumerate(shards, 1) for spk in shard}
+    utt2job = {utt_id: spk2job[spk] for utt_id, spk in utt2spk}
+
+    for name in os.listdir(data_dir):
+        if re.match(r"^split\d+(utt)?$", name) and name != "split{}".format(num_jobs):
+            shutil.rmtree(os.path.join(data_dir, name))
+    split_dir = os.path.join(data_dir, "split{}".format(num_jobs))
+    for job in range(1, num_jobs+1):
+        job_dir = os.path.join(split_dir, str(job))
+        if not os.path.isdir(job_dir):
+            os.makedirs(job_dir)
+
+    def write_split(filename, rows, job_of):
+        files = [open(os.path.join(split_dir, str(job), filename), "w")
+                 for job in range(1, num_jobs+1)]
+        try:
+            for key, value in rows:
+                files[job_of[key]-1].write("{} {}\n".format(key, value))
+        finally:
+            for fout in files:
+                fout.close()
+
+    write_split("utt2spk", utt2spk, utt2job)
+    write_split("spk2utt", read_table(os.path.join(data_dir, "spk2utt")), spk2job)
+    for filename in UTT_SPLIT_FILES:
+        if os.path.exists(os.path.join(data_dir, filename)):
+            write_split(filename, read_table(os.path.join(data_dir, filename)), utt2job)
+    for filename in SPK_SPLIT_FILES:
+        if os.path.exists(os.path.join(data_dir, filename)):
+            write_split(filename, read_table(os.path.join(data_dir, filename)), spk2job)
+    return split_dir
+
+
+
+#the artefacts of the features of a group relative to the recipe directory
+#(written by make_mfcc.sh & compute_cmvn_stats.sh or by mfcc.py)
+FEATURE_ARTEFACTS = ["data/{}/feats.scp", "data/{}/cmvn.scp", "exp/make_mfcc/{}", "mfcc/*_{}.*"]
+
+
+def find_stale_artefacts(outdir, changed_groups):
+    """
+    This function is used to find the artefacts produced by prepare.sh &
+    run_*.sh that are out-dated after changing the utterances of some groups.
+        - a changed "train" group invalidates its features and all the trained
+          models, alignments & decodings in "exp".
+        - a changed "test" group invalidates its features and all the decodings.
+    Parameters:
+        - outdir (string): the recipe directory inside kaldi/egs.
+        - changed_groups (list): the changed groups ("train" and/or "test").
+    Returns:
+        - a sorted list of the existing stale paths relative to outdir.
+    """
+    patterns = []
+    for group in changed_groups:
+        patterns += [pattern.format(group) for pattern in FEATURE_ARTEFACTS]
+    exp_dir = os.path.join(outdir, "exp")
+    if "train" in changed_groups and os.path.isdir(exp_dir):
+        patterns += ["exp/" + name for name in os.listdir(exp_dir) if name != "make_mfcc"]
+    if "test" in changed_groups:
+        patterns.append("exp/*/decode*")
+    stale = set()
+    for pattern in patterns:
+        for path in glob(os.path.join(outdir, pattern)):
+            stale.add(os.path.relpath(path, outdir))
+    return sorted(stale)
+
+
+
+def remove_stale_features(outdir, group, report_name="stale_artefacts.txt"):
+    """
+    This function is used when the features of a group are re-created outside
+    prepare.sh (by mfcc.py). It removes the stale features of the group listed
+    in the stale report and drops them from the report, so prepare.sh
+    --incremental true doesn't remove the new features.
+    Parameters:
+        - outdir (string): the recipe directory inside kaldi/egs.
+        - group (string): the group of the features ("train" or "test").
+        - report_name (string): the stale report written by data_preparation.py.
+    Returns:
+        - the removed paths relative to outdir.
+    """
+    report_path = os.path.join(outdir, report_name)
+    if not os.path.exists(report_path):
+        return []
+    patterns = [pattern.format(group) for pattern in FEATURE_ARTEFACTS]
+    with open(report_path) as fin:
+        stale = [line.strip() for line in fin if line.strip()]
+    removed = [path for path in stale
+               if any(fnmatch.fnmatch(path, pattern) for pattern in patterns)]
+    for path in removed:
+        path = os.path.join(outdir, path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+    with open(report_path, "w") as fout:
+        for path in stale:
+            if path not in removed:
+                fout.write("{}\n".format(path))
+    return removed
+
+
+
+class PrepManifest():
+
+    def __init__(self, manifest_path, config_hash):
+        """
+        This method is used to load what the previous data preparation produced.
+        Every utterance of every group is recorded by its source wav file (path,
+        size & mtime) and its wav header. The whole manifest is dropped when
+        it was produced by a different configuration (config_hash).
+        Parameters:
+            - manifest_path (string): path of the manifest json file.
+            - config_hash (string): hash of the settings that affect the data directories.
+        This method sets these member variables:
+            - MANIFEST_PATH: same as manifest_path
+            - CONFIG_HASH: same as config_hash
+            - groups: maps every group ("train", "test") to a dictionary of
+              {utt_id: [path, size, mtime, num_samples, samp_freq]}
+        """
+        self.MANIFEST_PATH = manifest_path
+        self.CONFIG_HASH = config_hash
+        self.groups = {}
+        if os.path.exists(self.MANIFEST_PATH):
+            with open(self.MANIFEST_PATH) as fin:
+                manifest = json.load(fin)
+            if manifest["config_hash"] == self.CONFIG_HASH:
+                self.groups = manifest["groups"]
+
+
+    def diff(self, group, sources):
+        """
+        This method is used to compare the current source files of a group
+        with the recorded ones.
+        Parameters:
+            - group (string): the name of the group like "train".
+            - sources (dict): maps every utt_id to its (path, size, mtime).
+        Returns:
+            - three sorted lists of utterance ids: added, removed & changed.
+        """
+        recorded = self.groups.get(group, {})
+        added = sorted(set(sources) - set(recorded))
+        removed = sorted(set(recorded) - set(sources))
+        changed = sorted(utt_id for utt_id in set(sources) & set(recorded)
+                         if list(sources[utt_id]) != recorded[utt_id][:3])
+        return added, removed, changed
+
+
+    def headers(self, group):
+        """
+        This method returns the recorded {utt_id: (num_samples, samp_freq)} of a group.
+        """
+        return {utt_id: tuple(record[3:])
+                for utt_id, record in self.groups.get(group, {}).items()}
+
+
+    def update(self, group, sources, headers):
+        """
+        This method is used to record the current state of a group where
+        sources & headers are keyed by the utterance ids.
+        """
+        self.groups[group] = {utt_id: list(sources[utt_id]) + list(headers[utt_id])
+                              for utt_id in sources}
+
+
+    def save(self):
+        tmp_path = self.MANIFEST_PATH + ".tmp"
+        with open(tmp_path, "w") as fout:
+            json.dump({"config_hash": self.CONFIG_HASH, "groups": self.groups}, fout)
+        os.replace(tmp_path, self.MANIFEST_PATH)
@@ -0,0 +1,371 @@
+import os
+import sys
+import argparse
+import numpy as np
+from multiprocessing import Pool
+
+from audio import read_wav_file, resample
+from manifest import remove_stale_features
+
+#the binary archives are read & written by the libs package of the recipe
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                "archive", "steps"))
+from libs.common import write_mat_ark_binary
+
+
+#default mfcc configuration used to train the models
+MFCC_CONF = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         "archive", "conf", "mfcc.conf")
+
+#the options of compute-mfcc-feats (with their defaults) supported by NumpyMfcc
+MFCC_DEFAULTS = {
+    "sample-frequency": 16000.,
+    "frame-shift": 10.,
+    "frame-length": 25.,
+    "dither": 1.,
+    "preemphasis-coefficient": 0.97,
+    "remove-dc-offset": True,
+    "window-type": "povey",
+    "round-to-power-of-two": True,
+    "blackman-coeff": 0.42,
+    "snip-edges": True,
+    "allow-downsample": False,
+    "num-mel-bins": 23,
+    "low-freq": 20.,
+    "high-freq": 0.,
+    "num-ceps": 13,
+    "use-energy": True,
+    "energy-floor": 0.,
+    "raw-energy": True,
+    "cepstral-lifter": 22.,
+    "htk-compat": False,
+}
+
+#Kaldi computes the features in float32, so this is its smallest log floor
+FLOAT_EPSILON = np.finfo(np.float32).eps
+
+
+def read_mfcc_config(conf_path=MFCC_CONF):
+    """
+    This function is used to parse a Kaldi config file (like mfcc.conf)
+    into a dictionary of the MFCC_DEFAULTS options. Every line should follow
+    this pattern: --<option-name>=<value>   # optional comment
+    """
+    config = dict(MFCC_DEFAULTS)
+    with open(conf_path) as fin:
+        for line in fin:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            name, value = line.lstrip("-").split("=", 1)
+            if name not in config:
+                raise ValueError("Unsupported mfcc option: --{}".format(name))
+            default = MFCC_DEFAULTS[name]
+            if isinstance(default, bool):
+                config[name] = value.lower() == "true"
+            else:
+                config[name] = type(default)(value)
+    return config
+
+
+def mel_scale(freq):
+    return 1127. * np.log(1. + freq / 700.)
+
+
+def feature_window(window_type, size, blackman_coeff=0.42):
+    """
+    This function returns the window function of Kaldi's feature-window.cc
+    """
+    a = 2. * np.pi / (size - 1)
+    i = np.arange(size)
+    if window_type == "hanning":
+        return 0.5 - 0.5 * np.cos(a * i)
+    if window_type == "sine":
+        return np.sin(0.5 * a * i)
+    if window_type == "hamming":
+        return 0.54 - 0.46 * np.cos(a * i)
+    if window_type == "povey":
+        return (0.5 - 0.5 * np.cos(a * i)) ** 0.85
+    if window_type == "rectangular":
+        return np.ones(size)
+    if window_type == "blackman":
+        return blackman_coeff - 0.5 * np.cos(a * i) + \
+               (0.5 - blackman_coeff) * np.cos(2 * a * i)
+    raise ValueError("Unknown window type: {}".format(window_type))
+
+
+
+class NumpyMfcc():
+
+    def __init__(self, conf_path=MFCC_CONF, seed=None):
+        """
+        This class is used to compute the same mfcc features as
+        compute-mfcc-feats using numpy. All the frames of an utterance are
+        processed at once (framing, windowing, FFT, mel filterbank & DCT
+        are matrix operations over the frames).
+        Parameters:
+            - conf_path (string): path of the mfcc configuration file.
+            - seed (int): seed of the dithering noise.
+        This method sets these member variables:
+            - CONFIG: the options of the configuration file.
+            - WINDOW: the window function.
+            - MEL_BANKS: the mel filterbank (num_bins x num_fft_bins).
+            - DCT: the DCT matrix (num_ceps x num_bins).
+            - LIFTER: the cepstral lifter coefficients (None if disabled).
+        """
+        self.CONFIG = read_mfcc_config(conf_path)
+        opts = self.CONFIG
+        self.samp_freq = opts["sample-frequency"]
+        self.frame_shift = int(self.samp_freq * 0.001 * opts["frame-shift"])
+        self.frame_length = int(self.samp_freq * 0.001 * opts["frame-length"])
+        self.padded_length = self.frame_length
+        if opts["round-to-power-of-two"]:
+            self.padded_length = 1 << int(np.ceil(np.log2(self.frame_length)))
+        self.WINDOW = feature_window(opts["window-type"], self.frame_length,
+                                     opts["blackman-coeff"])
+        self.MEL_BANKS = self.__mel_banks()
+        self.DCT = self.__dct_matrix()
+        self.LIFTER = None
+        if opts["cepstral-lifter"] != 0:
+            Q = opts["cepstral-lifter"]
+            self.LIFTER = 1. + 0.5 * Q * np.sin(np.pi * np.arange(opts["num-ceps"]) / Q)
+        self.rng = np.random.RandomState(seed)
+
+
+    def __mel_banks(self):
+        """
+        This private method returns the triangular mel filters of Kaldi's
+        mel-computations.cc over the first padded_length/2 bins of the FFT.
+        """
+        opts = self.CONFIG
+        num_bins = opts["num-mel-bins"]
+        num_fft_bins = self.padded_length // 2
+        nyquist = 0.5 * self.samp_freq
+        high_freq = opts["high-freq"] if opts["high-freq"] > 0 else nyquist + opts["high-freq"]
+        mel_low, mel_high = mel_scale(opts["low-freq"]), mel_scale(high_freq)
+        mel_delta = (mel_high - mel_low) / (num_bins + 1)
+        mel = mel_scale(self.samp_freq / self.padded_length * np.arange(num_fft_bins))
+        banks = np.zeros((num_bins, num_fft_bins))
+        for b in range(num_bins):
+            left = mel_low + b * mel_delta
+            center = left + mel_delta
+            right = center + mel_delta
+            up = (mel > left) & (mel <= center)
+            down = (mel > center) & (mel < right)
+            banks[b, up] = (mel[up] - left) / (center - left)
+            banks[b, down] = (right - mel[down]) / (right - center)
+        return banks
+
+
+    def __dct_matrix(self):
+        """
+        This private method returns the first num_ceps rows of the
+        normalized DCT-II matrix of Kaldi's ComputeDctMatrix().
+        """
+        num_bins = self.CONFIG["num-mel-bins"]
+        k = np.arange(self.CONFIG["num-ceps"])[:, None]
+        n = np.arange(num_bins)[None, :]
+        dct = np.sqrt(2. / num_bins) * np.cos(np.pi / num_bins * (n + 0.5) * k)
+        dct[0, :] = np.sqrt(1. / num_bins)
+        return dct
+
+
+    def __frames(self, waveform):
+        """
+        This private method cuts the waveform into (num_frames x frame_length)
+        frames the same way as Kaldi's ExtractWindow().
+        """
+        num_samples = len(waveform)
+        if self.CONFIG["snip-edges"]:
+            if num_samples < self.frame_length:
+                return np.zeros((0, self.frame_length))
+            num_frames = 1 + (num_samples - self.frame_length) // self.frame_shift
+            starts = np.arange(num_frames) * self.frame_shift
+        else:
+            num_frames = (num_samples + self.frame_shift // 2) // self.frame_shift
+            starts = np.arange(num_frames) * self.frame_shift + \
+                     self.frame_shift // 2 - self.frame_length // 2
+        index = starts[:, None] + np.arange(self.frame_length)[None, :]
+        #reflect the samples that are out of the waveform (snip-edges=false)
+        index = np.where(index < 0, -index - 1, index)
+        index = np.where(index >= num_samples, 2 * num_samples - 1 - index, index)
+        return waveform[index]
+
+
+    def compute(self, waveform, samp_freq=None):
+        """
+        This method is used to compute the mfcc features of a waveform.
+        Parameters:
+            - waveform (numpy array): the audio samples of one channel in the
+              range of 16-bit integers (NOT normalized to [-1, 1]).
+            - samp_freq (float): the sampling frequency of the waveform. Higher
+              frequencies are resampled like compute-mfcc-feats if
+              allow-downsample is true, otherwise the audio must already be
+              resampled (see SAMP_FREQ in data_preparation.py).
+        Returns:
+            - a float32 numpy array of mfcc features (frames x num_ceps)
+        """
+        opts = self.CONFIG
+        waveform = np.asarray(waveform, dtype=np.float64)
+        if samp_freq and samp_freq != self.samp_freq:
+            if samp_freq < self.samp_freq or not opts["allow-downsample"]:
+                raise ValueError("The audio sampling frequency is {} instead of {}: use the "
+                                 "wav.scp resampled by data_preparation.py (SAMP_FREQ) or "
+                                 "set --allow-downsample=true in the mfcc "
+                                 "configuration".format(samp_freq, self.samp_freq))
+            waveform = resample(waveform, samp_freq, self.samp_freq).astype(np.float64)
+        frames = self.__frames(waveform)
+        if opts["dither"] != 0:
+            frames = frames + opts["dither"] * self.rng.standard_normal(frames.shape)
+        if opts["remove-dc-offset"]:
+            frames = frames - frames.mean(axis=1, keepdims=True)
+        log_energy = None
+        if opts["use-energy"] and opts["raw-energy"]:
+            log_energy = np.log(np.maximum((frames ** 2).sum(axis=1), FLOAT_EPSILON))
+        if opts["preemphasis-coefficient"] != 0:
+            coeff = opts["preemphasis-coefficient"]
+            frames = np.concatenate([frames[:, :1] * (1. - coeff),
+                                     frames[:, 1:] - coeff * frames[:, :-1]], axis=1)
+        frames = frames * self.WINDOW
+        if opts["use-energy"] and not opts["raw-energy"]:
+            log_energy = np.log(np.maximum((frames ** 2).sum(axis=1), FLOAT_EPSILON))
+        spectrum = np.fft.rfft(frames, n=self.padded_length, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        mel_energies = power[:, :self.padded_length // 2].dot(self.MEL_BANKS.T)
+        feats = np.log(np.maximum(mel_energies, FLOAT_EPSILON)).dot(self.DCT.T)
+        if self.LIFTER is not None:
+            feats *= self.LIFTER
+        if opts["use-energy"]:
+            if opts["energy-floor"] > 0:
+                log_energy = np.maximum(log_energy, np.log(opts["energy-floor"]))
+            feats[:, 0] = log_energy
+        if opts["htk-compat"]:
+            energy = feats[:, 0] if opts["use-energy"] else feats[:, 0] * np.sqrt(2.)
+            feats = np.concatenate([feats[:, 1:], energy[:, None]], axis=1)
+        return feats.astype(np.float32)
+
+
+
+def read_wav_scp(wav_scp):
+    """
+    This function reads a wav.scp file as a list of (utt_id, wav path).
+    Only wav files are supported (not the extended filenames like "sox ... |").
+    """
+    items = []
+    with open(wav_scp) as fin:
+        for line in fin:
+            utt_id, wav_path = line.strip().split(" ", 1)
+            assert not wav_path.endswith("|"), \
+                "Pipes aren't supported in wav.scp: {}".format(wav_path)
+            items.append((utt_id, wav_path))
+    return items
+
+
+def cmvn_stats(feats):
+    """
+    This function returns the cmvn statistics of compute-cmvn-stats
+    accumulated over the given features: a (2 x dim+1) float64 matrix whose
+    first row holds the sum of every dimension followed by the frame count,
+    and whose second row holds the sum of squares followed by zero.
+    """
+    feats = np.asarray(feats, dtype=np.float64)
+    stats = np.zeros((2, feats.shape[1] + 1))
+    stats[0, :-1] = feats.sum(axis=0)
+    stats[0, -1] = feats.shape[0]
+    stats[1, :-1] = (feats ** 2).sum(axis=0)
+    return stats
+
+
+#the extractor of each worker process
+_WORKER_MFCC = None
+
+
+def _init_worker(conf_path):
+    global _WORKER_MFCC
+    _WORKER_MFCC = NumpyMfcc(conf_path)
+
+
+def _extract_shard(args):
+    """
+    This function is used to compute the features of a shard of wav.scp
+    inside a worker process and write them into <mfcc_dir>/raw_mfcc_<name>.<n>.ark
+    Returns:
+        - the cmvn statistics of every utterance (utt_id, stats).
+    """
+    items, ark_path, scp_path = args
+    stats = []
+    def features():
+        for utt_id, wav_path in items:
+            samples, samp_freq = read_wav_file(wav_path)
+            feats = _WORKER_MFCC.compute(samples, samp_freq)
+            stats.append((utt_id, cmvn_stats(feats)))
+            yield utt_id, feats
+    write_mat_ark_binary(ark_path, features(), scp_path)
+    return stats
+
+
+def make_mfcc(data_dir, mfcc_dir, num_jobs=None, conf_path=MFCC_CONF):
+    """
+    This function does the same functionality as archive/steps/make_mfcc.sh
+    followed by archive/steps/compute_cmvn_stats.sh using a process pool:
+        - <mfcc_dir>/raw_mfcc_<name>.<n>.{ark,scp} & <data_dir>/feats.scp
+        - <mfcc_dir>/cmvn_<name>.{ark,scp} & <data_dir>/cmvn.scp
+    where name is the name of data_dir (like "train"). wav.scp is split into
+    num_jobs contiguous shards, so feats.scp stays sorted. The stale features
+    of the group reported by data_preparation.py (stale_artefacts.txt of the
+    recipe) are removed first, so prepare.sh --incremental true keeps these ones.
+    Parameters:
+        - data_dir (string): the data directory containing wav.scp & spk2utt.
+        - mfcc_dir (string): the directory of the archives.
+        - num_jobs (int): the number of processes (the number of cores by default).
+        - conf_path (string): path of the mfcc configuration file.
+    """
+    name = os.path.basename(os.path.normpath(data_dir))
+    #data_dir is <recipe>/data/<name>
+    remove_stale_features(os.path.dirname(os.path.dirname(os.path.abspath(data_dir))), name)
+    mfcc_dir = os.path.abspath(mfcc_dir)
+    if not os.path.isdir(mfcc_dir):
+        os.makedirs(mfcc_dir)
+    items = read_wav_scp(os.path.join(data_dir, "wav.scp"))
+    num_jobs = min(num_jobs if num_jobs else os.cpu_count(), len(items))
+    bounds = np.linspace(0, len(items), num_jobs + 1).astype(int)
+    shards = []
+    for n in range(num_jobs):
+        prefix = os.path.join(mfcc_dir, "raw_mfcc_{}.{}".format(name, n+1))
+        shards.append((items[bounds[n]:bounds[n+1]], prefix + ".ark", prefix + ".scp"))
+    utt_stats = {}
+    with Pool(num_jobs, initializer=_init_worker, initargs=(conf_path,)) as pool:
+        for stats in pool.imap(_extract_shard, shards):
+            utt_stats.update(stats)
+    #concatenate the .scp files together
+    with open(os.path.join(data_dir, "feats.scp"), "w") as fout:
+        for _, _, scp_path in shards:
+            with open(scp_path) as fin:
+                fout.write(fin.read())
+    #accumulate the cmvn statistics of every speaker
+    cmvn_scp = os.path.join(mfcc_dir, "cmvn_{}.scp".format(name))
+    def speaker_stats(fin):
+        for line in fin:
+            speaker, utt_ids = line.split(" ", 1)
+            utt_ids = [utt_id for utt_id in utt_ids.split() if utt_id in utt_stats]
+            if utt_ids:
+                yield speaker, sum(utt_stats[utt_id] for utt_id in utt_ids)
+    with open(os.path.join(data_dir, "spk2utt")) as fin:
+        write_mat_ark_binary(os.path.join(mfcc_dir, "cmvn_{}.ark".format(name)),
+                             speaker_stats(fin), cmvn_scp)
+    with open(cmvn_scp) as fin, open(os.path.join(data_dir, "cmvn.scp"), "w") as fout:
+        fout.write(fin.read())
+    print("Succeeded creating MFCC features for {} ({} utterances)".format(name, len(utt_stats)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the mfcc features & cmvn "
+                                     "statistics of a data directory like make_mfcc.sh "
+                                     "& compute_cmvn_stats.sh")
+    parser.add_argument("data_dir", help="data directory containing wav.scp & spk2utt")
+    parser.add_argument("mfcc_dir", nargs="?", default="mfcc",
+                        help="directory of the feature archives")
+    parser.add_argument("--nj", type=int, default=None, help="number of processes")
+    parser.add_argument("--mfcc-config", default=MFCC_CONF)
+    args = parser.parse_args()
+    make_mfcc(args.data_dir, args.mfcc_dir, args.nj, args.mfcc_config)
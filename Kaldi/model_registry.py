@@ -0,0 +1,253 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from kaldi.decoder import TrainingGraphCompiler, TrainingGraphCompilerOptions
+from kaldi.fstext import SymbolTable, read_fst_kaldi
+from kaldi.gmm.am import AmDiagGmm
+from kaldi.hmm import TransitionModel, add_transition_probs
+from kaldi.tree import ContextDependency
+from kaldi.util.io import xopen
+
+
+
+def resident_bytes():
+    """
+    This function returns the current resident memory of the process in
+    bytes, or None when /proc isn't available (e.g. on macOS).
+    """
+    try:
+        with open("/proc/self/statm") as fin:
+            return int(fin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class LoadedModel():
+
+    def __init__(self, model_dir):
+        """
+        This method is used to load the immutable parts of a trained model
+        which can be shared by any number of decoders.
+        Parameters:
+            - model_dir (string): full path of the model directory containing
+              final.mdl and graph/{HCLG.fst, words.txt}
+        This method sets these member variables:
+            - MODEL_DIR: same as model_dir
+            - transition_model, acoustic_model: the content of final.mdl
+            - graph: the decoding graph HCLG.fst
+            - symbols: the word symbols table words.txt
+            - load_time: the time taken to load the model (in seconds)
+            - size: the resident memory taken by the model in bytes, measured as
+              the growth of the process memory during the load (the on-disk size
+              of the loaded files when it can't be measured)
+            - disk_size: the on-disk size of the loaded files in bytes
+            - local: the objects built over the model by every thread (like the
+              decoders of the recognizers), which are freed with the model
+            - word_graphs: the alignment graphs of the isolated-word scoring
+              built by compile_word_graphs()
+        NOTE: the models are loaded under the lock of the registry, but other
+        threads allocating memory during the load are counted in size as well.
+        """
+        self.MODEL_DIR = model_dir
+        model_path = os.path.join(model_dir, "final.mdl")
+        graph_path = os.path.join(model_dir, "graph", "HCLG.fst")
+        words_path = os.path.join(model_dir, "graph", "words.txt")
+        rss = resident_bytes()
+        start = time.time()
+        with xopen(model_path) as ki:
+            self.transition_model = TransitionModel().read(ki.stream(), ki.binary)
+            self.acoustic_model = AmDiagGmm().read(ki.stream(), ki.binary)
+        self.graph = read_fst_kaldi(graph_path)
+        self.symbols = SymbolTable.read_text(words_path)
+        self.load_time = time.time() - start
+        self.disk_size = sum(os.path.getsize(path)
+                             for path in [model_path, graph_path, words_path])
+        self.size = self.disk_size
+        if rss is not None:
+            self.size = max(0, resident_bytes() - rss)
+        self.local = threading.local()
+        self.word_graphs = {}
+        self.lock = threading.Lock()
+        #the gaussians of all the pdfs stacked for pdf_log_likelihoods()
+        self.gaussians = None
+
+
+    def compile_word_graphs(self, lang_dir, words):
+        """
+        This method returns the alignment graph of every word of the vocabulary
+        (same as compile-train-graphs in archive/steps/align_si.sh). The graphs
+        are compiled on the first call only and shared by all the threads, and
+        the memory they take is added to size.
+        Parameters:
+            - lang_dir (string): full path of data/lang.
+            - words (list): the vocabulary.
+        Returns:
+            - a list of graphs following the same order of words.
+        """
+        key = (os.path.abspath(lang_dir), tuple(words))
+        with self.lock:
+            if key in self.word_graphs:
+                return self.word_graphs[key]
+            rss = resident_bytes()
+            with xopen(os.path.join(self.MODEL_DIR, "tree")) as ki:
+                tree = ContextDependency()
+                tree.read(ki.stream(), ki.binary)
+            with open(os.path.join(lang_dir, "phones", "disambig.int")) as fin:
+                disambig = [int(line) for line in fin if line.strip()]
+            symbols = SymbolTable.read_text(os.path.join(lang_dir, "words.txt"))
+            compiler = TrainingGraphCompiler(self.transition_model, tree,
+                                             read_fst_kaldi(os.path.join(lang_dir, "L.fst")),
+                                             disambig, TrainingGraphCompilerOptions())
+            graphs = []
+            for word in words:
+                word_id = symbols.find_index(word)
+                assert word_id != -1, "{} isn't in words.txt".format(word)
+                graph = compiler.compile_graph_from_text([word_id])
+                #same scales as gmm-align-compiled in align_si.sh
+                add_transition_probs(self.transition_model, disambig, 1.0, 0.1, graph)
+                graphs.append(graph)
+            self.word_graphs[key] = graphs
+            if rss is not None:
+                self.size += max(0, resident_bytes() - rss)
+            return graphs
+
+
+    def __stack_gaussians(self):
+        """
+        This private method stacks the parameters of the gaussians of every
+        pdf of the acoustic model into numpy arrays.
+        Returns:
+            - gconsts (num_gauss), means_invvars & inv_vars (num_gauss x dim)
+              and the index of the first gaussian of every pdf (num_pdfs).
+        """
+        gconsts, means_invvars, inv_vars, starts = [], [], [], []
+        num_gauss = 0
+        for pdf in range(self.acoustic_model.num_pdfs()):
+            gmm = self.acoustic_model.get_pdf(pdf)
+            starts.append(num_gauss)
+            num_gauss += gmm.num_gauss()
+            gconsts.append(gmm.gconsts().numpy())
+            means_invvars.append(gmm.means_invvars().numpy())
+            inv_vars.append(gmm.inv_vars().numpy())
+        return (np.concatenate(gconsts).astype(np.float64),
+                np.vstack(means_invvars).astype(np.float64),
+                np.vstack(inv_vars).astype(np.float64),
+                np.array(starts))
+
+
+    def pdf_log_likelihoods(self, feats):
+        """
+        This method computes the log-likelihoods of every pdf of the acoustic
+        model for all the given frames at once (same as DiagGmm::LogLikelihoods
+        followed by the log-sum over the gaussians of every pdf).
+        Parameters:
+            - feats (numpy array): the features (frames x dim).
+        Returns:
+            - a (frames x num_pdfs) numpy array.
+        """
+        if self.gaussians is None:
+            self.gaussians = self.__stack_gaussians()
+        gconsts, means_invvars, inv_vars, starts = self.gaussians
+        feats = np.asarray(feats, dtype=np.float64)
+        loglikes = gconsts + feats.dot(means_invvars.T) - 0.5 * (feats ** 2).dot(inv_vars.T)
+        maxes = np.maximum.reduceat(loglikes, starts, axis=1)
+        counts = np.diff(np.append(starts, loglikes.shape[1]))
+        sums = np.add.reduceat(np.exp(loglikes - np.repeat(maxes, counts, axis=1)),
+                               starts, axis=1)
+        return maxes + np.log(sums)
+
+
+
+class ModelRegistry():
+
+    def __init__(self, max_bytes=None):
+        """
+        This method is used to define a registry of models that loads every
+        model on its first use and shares it with all the recognizers of the
+        process.
+        Parameters:
+            - max_bytes (int): the budget of the resident memory of the loaded
+              models (see LoadedModel.size). When it's exceeded, the least recently
+              used models are evicted. None means no limit.
+        NOTE: an evicted model is freed once its running decodings & streams are done.
+        """
+        self.MAX_BYTES = max_bytes
+        #maps model_dir to its LoadedModel ordered by the last access time
+        self.models = OrderedDict()
+        self.hits = {}
+        self.lock = threading.Lock()
+
+
+    def get(self, model_dir):
+        """
+        This method returns the LoadedModel of the given directory,
+        loading it if it's not loaded yet.
+        """
+        model_dir = os.path.abspath(model_dir)
+        with self.lock:
+            if model_dir in self.models:
+                self.models.move_to_end(model_dir)
+                self.hits[model_dir] += 1
+                #the model may have grown since (see compile_word_graphs())
+                self.__evict()
+                return self.models[model_dir]
+            model = LoadedModel(model_dir)
+            self.models[model_dir] = model
+            self.hits[model_dir] = 0
+            self.__evict()
+            return model
+
+
+    def total_bytes(self):
+        """
+        This method returns the total size of the loaded models.
+        """
+        return sum(model.size for model in self.models.values())
+
+
+    def __evict(self):
+        #the most recently used model is never evicted
+        while self.MAX_BYTES is not None and len(self.models) > 1 \
+          and self.total_bytes() > self.MAX_BYTES:
+            model_dir, _ = self.models.popitem(last=False)
+            del self.hits[model_dir]
+
+
+    def set_memory_budget(self, max_bytes):
+        """
+        This method is used to change the memory budget of the registry.
+        """
+        with self.lock:
+            self.MAX_BYTES = max_bytes
+            self.__evict()
+
+
+    def clear(self):
+        """
+        This method is used to evict all the loaded models.
+        """
+        with self.lock:
+            self.models.clear()
+            self.hits.clear()
+
+
+    def stats(self):
+        """
+        This method returns a list of dictionaries describing the loaded
+        models from the least to the most recently used one.
+        """
+        with self.lock:
+            return [{"model_dir": model_dir,
+                     "load_time": model.load_time,
+                     "size": model.size,
+                     "disk_size": model.disk_size,
+                     "hits": self.hits[model_dir]}
+                    for model_dir, model in self.models.items()]
+
+
+
+#the registry shared by all the recognizers of the process
+MODEL_REGISTRY = ModelRegistry()
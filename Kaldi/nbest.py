@@ -0,0 +1,44 @@
+import numpy as np
+
+
+
+def rank_likelihoods(words, likelihoods):
+    """
+    This function is used to rank the words of the vocabulary by their
+    likelihoods.
+    Parameters:
+        - words (list): the vocabulary.
+        - likelihoods (list): the likelihood of every word, -inf for the words
+          that don't match the audio (no path reached a final state).
+    Returns:
+        - a list of dictionaries containing the "word", its "likelihood" and
+          its "posterior" sorted from the most to the least likely word.
+          The posteriors are the softmax of the (acoustically scaled)
+          likelihoods over the whole vocabulary. The words that don't match
+          get a None likelihood & a zero posterior, so the list can be written
+          as standard JSON.
+    """
+    likelihoods = np.asarray(likelihoods, dtype=np.float64)
+    posteriors = np.zeros(len(likelihoods))
+    finite = np.isfinite(likelihoods)
+    if finite.any():
+        exp = np.exp(likelihoods[finite] - likelihoods[finite].max())
+        posteriors[finite] = exp / exp.sum()
+    order = sorted(range(len(words)), key=lambda i: (not finite[i], -likelihoods[i]))
+    return [{"word": words[i],
+             "likelihood": float(likelihoods[i]) if finite[i] else None,
+             "posterior": float(posteriors[i])}
+            for i in order]
+
+
+def nbest_output(nbest):
+    """
+    This function returns the decoding output of a ranked list of words.
+    Returns:
+        - a dictionary containing the "text" & the "likelihood" of the best word
+          and the "nbest" list. When no word matches the audio, the text is
+          empty and the likelihood is None.
+    """
+    if not nbest or nbest[0]["likelihood"] is None:
+        return {"text": "", "likelihood": None, "nbest": nbest}
+    return {"text": nbest[0]["word"], "likelihood": nbest[0]["likelihood"], "nbest": nbest}
@@ -1,19 +1,181 @@
 import os
+import threading
+import multiprocessing
+import numpy as np
+from collections import OrderedDict, namedtuple
 from glob import glob
 from tqdm import tqdm
 
 from kaldi.asr import GmmLatticeFasterRecognizer
-from kaldi.decoder import LatticeFasterDecoderOptions
-from kaldi.feat.mfcc import Mfcc, MfccOptions
-from kaldi.feat.functions import compute_deltas, DeltaFeaturesOptions
-from kaldi.feat.window import FrameExtractionOptions
-from kaldi.transform.cmvn import Cmvn
-from kaldi.util.table import SequentialMatrixReader, SequentialWaveReader
+from kaldi.decoder import DecodableMatrixMappedOffset
+from kaldi.decoder import FasterDecoder, FasterDecoderOptions
+from kaldi.decoder import LatticeFasterDecoder, LatticeFasterDecoderOptions
+from kaldi.fstext.utils import get_linear_symbol_sequence
+from kaldi.gmm.am import DecodableAmDiagGmmScaled
+from kaldi.matrix import Matrix
+
+from audio import read_wav_bytes, read_wav_file
+from features import DELTA_MODELS, LDA_MODELS
+from features import FeatureCache, FeaturePipeline, FeatureStream
+from model_registry import MODEL_REGISTRY
+from nbest import nbest_output, rank_likelihoods
+
+
+AVAILABLE_MODEL_NAMES = DELTA_MODELS + LDA_MODELS
+
+#words of the data
+WORDS = ["صفر", "واحد", "إثنان", "ثلاثة", "أربعة", "خمسة",
+         "ستة", "سبعة", "ثمانية", "تسعة", "التنشيط", "التحويل",
+         "الرصيد", "التسديد", "نعم", "لا", "التمويل", "البيانات",
+         "الحساب", "إنهاء"]
+
+
+def list_wav_files(data_path):
+    """
+    This function is used to list the wav files that need to be decoded.
+    Parameters:
+        - data_path (string): full path of the data directory containing
+          wav files to be decoded, or just a wav-file.
+    Returns:
+        - a sorted list of (key, wav path) tuples where the key is the
+          filename without extension.
+    NOTE:
+    Any non-wav file existing in data_path will be neglected!!
+    """
+    assert os.path.exists(data_path), "provided a valid path"
+    #check wether data_path is a directory or just one file
+    if os.path.isdir(data_path):
+       wav_files = sorted(glob(os.path.join(data_path, "*.wav")))
+       if len(wav_files) == 0:
+           wav_files = sorted(glob(os.path.join(data_path, "*", "*.wav"), recursive=True))
+    else:
+        wav_files = [data_path]
+    items = []
+    for wav_path in wav_files:
+        _, wav_filename = os.path.split(wav_path)
+        wav_filename = wav_filename[:-4] #remove extension
+        items.append((wav_filename, wav_path))
+    return items
+
+
+def get_true_word(key):
+    """
+    This function returns the true word of an utterance using its key
+    which ends with the word id like "S01.01.05".
+    Returns None if the key doesn't follow this pattern.
+    """
+    try:
+        return WORDS[int(key.split(".")[-1])-1]
+    except (ValueError, IndexError):
+        return None
+
+
+def load_audio(audio):
+    """
+    This function is used to load the audio of an in-memory item which can be:
+        - a path of a wav file.
+        - the content (bytes) of a wav file.
+        - a (samples, sampling frequency) tuple.
+    Returns:
+        - the samples and the sampling frequency.
+    """
+    if isinstance(audio, str):
+        return read_wav_file(audio)
+    if isinstance(audio, bytes):
+        return read_wav_bytes(audio)
+    samples, samp_freq = audio
+    return samples, samp_freq
+
+
+#the result of decoding one utterance
+UtteranceResult = namedtuple("UtteranceResult", ["key", "true_word", "text", "likelihood"])
+
+
+
+def write_csv_atomically(csv_path, header, rows):
+    """
+    This function is used to write a csv file under a temporary name then
+    rename it, so concurrent evaluations never interleave their rows and an
+    interrupted evaluation never leaves a truncated file behind.
+    Parameters:
+        - csv_path (string): path of the csv file.
+        - header (list): the names of the columns.
+        - rows (iterable): the rows, each is a list of values.
+    """
+    tmp_path = "{}.{}.{}.tmp".format(csv_path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, "w") as fout:
+            fout.write(",".join(header) + "\n")
+            for row in rows:
+                fout.write(",".join(str(value) for value in row) + "\n")
+        os.replace(tmp_path, csv_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class EvaluationResult():
+
+    def __init__(self, model_name, utterances):
+        """
+        This method is used to define the result of decoding a list of utterances.
+        Parameters:
+            - model_name (string): the name of the model.
+            - utterances (list): the UtteranceResult of every utterance.
+        """
+        self.model_name = model_name
+        self.utterances = utterances
+
+
+    @property
+    def accuracy(self):
+        """
+        The accuracy over the utterances whose true word is known.
+        """
+        known = [utt for utt in self.utterances if utt.true_word is not None]
+        if len(known) == 0:
+            return 0.
+        return sum(1. for utt in known if utt.true_word == utt.text) / len(known)
+
+
+    def write_csv(self, csv_path, header_only=False):
+        """
+        This method is used to write the results into a csv file atomically.
+        Parameters:
+            - csv_path (string): path of the csv file.
+            - header_only (bool): write the header without any row.
+        """
+        rows = [[utt.key, utt.true_word, utt.text, utt.likelihood]
+                for utt in ([] if header_only else self.utterances)]
+        write_csv_atomically(csv_path, ["Filename", "TrueWord", "Predicted", "Likelihood"], rows)
+
+
+#the recognizer used by each worker process of the decoding pool
+_WORKER_RECOGNIZER = None
+
+
+def _init_worker(base_dir, model_name, kaldi_dir, options):
+    """
+    This function is used as the initializer of the decoding pool. It loads
+    the model only once per worker process, so it can be re-used for all the
+    shards that the worker decodes.
+    """
+    global _WORKER_RECOGNIZER
+    _WORKER_RECOGNIZER = Recognizer(base_dir, model_name, kaldi_dir, **options)
+
+
+def _decode_shard(items):
+    """
+    This function is used to decode one shard of the (key, audio) items
+    inside a worker process of the decoding pool.
+    """
+    return _WORKER_RECOGNIZER.decode_items(items).utterances
 
 
 class Recognizer():
 
-    def __init__(self, base_dir, model_name, kaldi_dir):
+    def __init__(self, base_dir, model_name, kaldi_dir, cache_dir=None,
+                 beam=13.0, lattice_beam=6.0, max_active=None, isolated_word=False):
         """
         This method is used define the class member variables.
         Parameters:
@@ -28,166 +190,516 @@ class Recognizer():
                 * tri3c: tri2b + MPE
                 * tri3d: tri2b + SAT
                 * tri4a: tri3d + MMI (NOT YET)
+            - cache_dir (string): directory of the on-disk feature cache which can be
+              shared by all the models, None to disable caching.
+            - beam, lattice_beam, max_active: the decoding options (same as
+              archive/conf/decode.config), max_active=None means no limit.
+            - isolated_word (bool): decode by scoring the utterance against every
+              word of the vocabulary instead of searching HCLG.fst (see IsolatedWordScorer).
+              The decoding output then contains the ranked "nbest" list of all the words.
         This method sets these member variables:
             - MODEL_DIR: same as model_dir
             - MODEL_NAME: same as model_name
-            - ASR: The actual speech recognition object
+            - ASR: The actual speech recognition object. It's created on the first
+              use and its model & graph are shared through MODEL_REGISTRY by all
+              the recognizers of the same model. Every thread gets its own decoder,
+              so the same recognizer can be used by several threads at once.
+              The decoders are kept by the model instead of the recognizer, so
+              an evicted model is freed once its running decodings are done.
+            - SCORER: the IsolatedWordScorer of the model (created on the first use).
+              Like ASR, its graphs are shared through MODEL_REGISTRY and every
+              thread gets its own decoders.
+            - CACHE_DIR: same as cache_dir
+            - BEAM, LATTICE_BEAM, MAX_ACTIVE: same as beam, lattice_beam, max_active
+            - ISOLATED_WORD: same as isolated_word
+            - FEATS: The feature pipeline of the model
         """
-        AVAILABLE_MODEL_NAMES = ["mono", "tri1", "tri2a", "tri2b",
-                                "tri3a", "tri3b", "tri3c", "tri3d"]
         self.BASE_DIR = base_dir
         self.MODEL_NAME = model_name.lower()
         assert self.MODEL_NAME in AVAILABLE_MODEL_NAMES, \
-            "The provided model name must be one of these:\n"+ AVAILABLE_MODEL_NAMES
+            "The provided model name must be one of these:\n"+ ", ".join(AVAILABLE_MODEL_NAMES)
         self.MODEL_DIR = os.path.join(self.BASE_DIR, "exp", self.MODEL_NAME)
         self.KALDI_DIR = kaldi_dir
-        self.ASR = self.__initialize_decoder()
+        self.CACHE_DIR = cache_dir
+        self.BEAM = beam
+        self.LATTICE_BEAM = lattice_beam
+        self.MAX_ACTIVE = max_active
+        self.ISOLATED_WORD = isolated_word
+        self.FEATS = self.__make_feat_pipeline()
+
+
+    @property
+    def ASR(self):
+        #the model is fetched on every use, so it's re-loaded if it was evicted
+        model = MODEL_REGISTRY.get(self.MODEL_DIR)
+        asrs = model.local.__dict__.setdefault("asrs", {})
+        key = (self.BEAM, self.LATTICE_BEAM, self.MAX_ACTIVE)
+        if key not in asrs:
+            asrs[key] = self.__initialize_decoder(model)
+        return asrs[key]
+
+
+    @property
+    def SCORER(self):
+        model = MODEL_REGISTRY.get(self.MODEL_DIR)
+        scorers = model.local.__dict__.setdefault("scorers", {})
+        if self.BASE_DIR not in scorers:
+            scorers[self.BASE_DIR] = IsolatedWordScorer(model, self.BASE_DIR)
+        return scorers[self.BASE_DIR]
+
+
+    def __options(self):
+        """
+        This private method returns the keyword arguments needed to create
+        the same recognizer inside another process.
+        """
+        return {"cache_dir": self.CACHE_DIR, "beam": self.BEAM,
+                "lattice_beam": self.LATTICE_BEAM, "max_active": self.MAX_ACTIVE,
+                "isolated_word": self.ISOLATED_WORD}
 
         
-    def __initialize_decoder(self):
+    def __decoder_options(self):
         #set decoding options (same as archive/config/decode.conf)
         decoder_opts = LatticeFasterDecoderOptions()
-        decoder_opts.beam = 13.0
-        decoder_opts.lattice_beam = 6.0
-        # decoder_opts.max_active = 7000
-        
+        decoder_opts.beam = self.BEAM
+        decoder_opts.lattice_beam = self.LATTICE_BEAM
+        if self.MAX_ACTIVE is not None:
+            decoder_opts.max_active = self.MAX_ACTIVE
+        return decoder_opts
+
+
+    def __initialize_decoder(self, model):
         # Construct recognizer
-        asr = GmmLatticeFasterRecognizer.from_files(
-                os.path.join(self.MODEL_DIR, "final.mdl"),
-                os.path.join(self.MODEL_DIR, "graph", "HCLG.fst"),
-                os.path.join(self.MODEL_DIR, "graph", "words.txt"),
-                decoder_opts=decoder_opts)
+        #final.mdl, HCLG.fst & words.txt are loaded once per process and shared,
+        #only the decoder (which holds the search state) belongs to this thread
+        decoder = LatticeFasterDecoder(model.graph, self.__decoder_options())
+        asr = GmmLatticeFasterRecognizer(model.transition_model,
+                                         model.acoustic_model,
+                                         decoder, model.symbols)
         return asr
 
     
-    def __create_transcription(self, data_path):
-        """
-        This private method is used to create a text transcription file
-        that contain the files name that need to be decoded
-        Parameters:
-            - data_path (string): full path of the data directory containing
-              wav files to be decoded, or just a wav-file.
-        Usage:
-        >>> create_transcription("/home/desktop/recoreded_data)
-        or
-        >>> create_transcription("home/desktop/recorded_data/01.wav")
-        NOTE:
-        Any non-wav file existing in data_path will be neglected!!
-        """
-        assert os.path.exists(data_path), "provided a valid path"
-        #check wether data_path is a directory or just one file
-        if os.path.isdir(data_path):
-           wav_files = sorted(glob(os.path.join(data_path, "*.wav")))
-           if len(wav_files) == 0:
-               wav_files = sorted(glob(os.path.join(data_path, "*", "*.wav"), recursive=True))
-        else:
-            wav_files = [data_path]
-        with open("wav.scp", "w") as fout:
-            for wav_path in wav_files:
-                _, wav_filename = os.path.split(wav_path)
-                wav_filename = wav_filename[:-4] #remove extension
-                fout.write("{} {}\n".format(wav_filename, wav_path))
-                
-
     # Define feature pipeline in code
     def __make_feat_pipeline(self):
         """
         This private method is used to create a feature pipeline based on the model.
-        The pipeline is divided into two parts:
+        The pipeline is built once and runs in-memory, so no processes are forked
+        while decoding. The pipeline is divided into two parts:
         -> pre-processing:
-            - Computing MFCC features using compute-mfcc-feats binary file
-              over mfcc.conf file and wav transcription file
-            - Normalize the extracted features using apply-cmvn-sliding binary file
+            - Computing MFCC features using archive/conf/mfcc.conf options
+              (same as archive/steps/make_mfcc.sh)
+            - Normalize the extracted features over the whole audio file
+              (same as apply-cmvn-sliding --cmn-window=1000000000 --center=true)
+          When CACHE_DIR is set, the result of this part is cached on disk and re-used
+          by all the models, so only the missing features are computed.
         -> processing:
             this part differs between a model to the other
+            - mono, tri1, tri2a: add deltas (same as archive/steps/train_deltas.sh)
+            - tri2b, tri3a, tri3b, tri3c, tri3d: splice frames then apply final.mat
+              (same as archive/steps/train_lda_mllt.sh and archive/steps/train_sat.sh)
         Returns:
-            - a string that represents unix-like pipeline of the feature extraction process
+            - a FeaturePipeline object
         
         RESOURCES:
         http://kaldi-asr.org/doc/io.html#io_sec_specifiers_both
         https://github.com/pykaldi/pykaldi/issues/108 (my issue)
         """
-        # define the rspecifier for reading the features
-        if self.MODEL_NAME in ["mono", "tri1", "tri2a"]:
-            feats_rspecifier = (
-                "ark,s,cs:"
-                #does the same functionality as archive/steps/make_mfcc.sh
-                "{0}/src/featbin/compute-mfcc-feats --allow-downsample --config=archive/conf/mfcc.conf scp:wav.scp ark:-"
-                #does the same functionality as archive/steps/compute_cmvn_stats.sh
-                #NOTE: we have set the cmn-window so big to normalize over the whole audio file
-                " | {0}/src/featbin/apply-cmvn-sliding --cmn-window=1000000000 --center=true ark:- ark:-"
-                #does the same functionality found at archive/steps/train_mono.sh and archive/steps/train_deltas.sh
-                " | {0}/src/featbin/add-deltas ark:- ark:-"
-                " |".format(self.KALDI_DIR)
-            )
-        elif self.MODEL_NAME in ["tri2b", "tri3a", "tri3b", "tri3c", "tri3d"]:
-            feats_rspecifier = (
-                 "ark,s,cs:"
-                 #does the same functionality as archive/steps/make_mfcc.sh
-                "{0}/src/featbin/compute-mfcc-feats --allow-downsample --config=archive/conf/mfcc.conf scp:wav.scp ark:-"
-                #does the same functionality as archive/steps/compute_cmvn_stats.sh
-                #NOTE: we have set the cmn-window so big to normalize over the whole audio file
-                " | {0}/src/featbin/apply-cmvn-sliding --cmn-window=1000000000 --center=true ark:- ark:-"
-                #the next two commands do the same functionality found at archive/steps/train_lda_mllt.sh 
-                #and archive/steps/train_sat.sh
-                " | {0}/src/featbin/splice-feats ark:- ark:-"
-                " | {0}/src/featbin/transform-feats {1}/final.mat ark:- ark:-"
-                " |".format(self.KALDI_DIR, self.MODEL_DIR)
-            )
-        # print(feats_rspecifier)
-        return feats_rspecifier
-
-
-    def evaluate(self, data_path, remove_scp=True):
+        cache = FeatureCache(self.CACHE_DIR) if self.CACHE_DIR else None
+        return FeaturePipeline(self.MODEL_NAME, self.MODEL_DIR, cache=cache)
+
+
+    def decode_waveform(self, waveform, samp_freq):
+        """
+        This method is used to decode raw audio samples that are already
+        loaded in memory (e.g. a numpy array).
+        Parameters:
+            - waveform (numpy array): the audio samples in the range of 16-bit
+              integers.
+            - samp_freq (float): the sampling frequency of the waveform.
+        Returns:
+            - a dictionary containing the "text" and the "likelihood"
+              (and the "nbest" list in the isolated-word mode, where no word
+              matching the audio gives an empty text and a None likelihood).
+        """
+        feats = self.FEATS.compute(waveform, samp_freq)
+        if self.ISOLATED_WORD:
+            return nbest_output(self.SCORER.score(feats))
+        return self.ASR.decode(feats)
+
+
+    def rank_words(self, waveform, samp_freq):
+        """
+        This method is used to rank all the words of the vocabulary for the
+        given audio, which is useful for confirmation prompts.
+        Returns:
+            - a list of dictionaries containing the "word", its "likelihood" and
+              its "posterior" sorted from the most to the least likely word.
+        """
+        return self.SCORER.score(self.FEATS.compute(waveform, samp_freq))
+
+
+    def open_stream(self, samp_freq=16000):
+        """
+        This method is used to start decoding live audio incrementally.
+        Parameters:
+            - samp_freq (float): the sampling frequency of the incoming audio.
+        Returns:
+            - a DecodingStream object.
+        Usage:
+        >>> stream = rec.open_stream()
+        >>> for chunk in audio_chunks:
+        ...     stream.accept_waveform(chunk)
+        ...     print(stream.partial_result()["text"])
+        >>> out = stream.finalize()
+        NOTE:
+        Every stream has its own decoder over the shared model, so any number
+        of streams can be active at the same time.
+        """
+        model = MODEL_REGISTRY.get(self.MODEL_DIR)
+        decoder = LatticeFasterDecoder(model.graph, self.__decoder_options())
+        return DecodingStream(model, decoder, self.FEATS, samp_freq)
+
+
+    def __decode_parallel(self, items, num_workers, sink=None):
+        """
+        This private method is used to split the items into num_workers
+        contiguous shards and decode them using a pool of processes where
+        each process loads the model just once.
+        Parameters:
+            - items (list): the (key, audio) items.
+            - num_workers (int): number of worker processes.
+            - sink (callable): called with every UtteranceResult once its shard is done.
+        Returns:
+            - a list of UtteranceResult following the same order of items.
+        """
+        num_workers = min(num_workers, len(items))
+        shard_size = (len(items) + num_workers - 1) // num_workers
+        shards = [items[i*shard_size: (i+1)*shard_size] for i in range(num_workers)]
+        results = []
+        with multiprocessing.Pool(num_workers, initializer=_init_worker,
+                initargs=(self.BASE_DIR, self.MODEL_NAME, self.KALDI_DIR,
+                          self.__options())) as pool:
+            #imap keeps the order of the shards, so the merged results are deterministic
+            for shard_results in pool.imap(_decode_shard, shards):
+                for utt in shard_results:
+                    if sink is not None:
+                        sink(utt)
+                    results.append(utt)
+        return results
+
+
+    def decode_items(self, items, num_workers=1, sink=None):
+        """
+        This method is used to decode in-memory items without writing any file,
+        so several evaluations can run at the same time.
+        Parameters:
+            - items (list): (key, audio) tuples where audio is a wav path, the
+              content of a wav file or a (samples, sampling frequency) tuple.
+              The true word is taken from the key if it ends with the word id.
+            - num_workers (int): number of processes used for decoding. When it's
+              bigger than one, the items are split into num_workers shards that are
+              decoded in parallel.
+            - sink (callable): called with every UtteranceResult as soon as it's ready.
+        Returns:
+            - an EvaluationResult object.
+        """
+        items = list(items)
+        if num_workers > 1 and len(items) > 1:
+            return EvaluationResult(self.MODEL_NAME,
+                                    self.__decode_parallel(items, num_workers, sink))
+        results = []
+        for key, audio in items:
+            samples, samp_freq = load_audio(audio)
+            out = self.decode_waveform(samples, samp_freq)
+            utt = UtteranceResult(key, get_true_word(key), out["text"], out["likelihood"])
+            if sink is not None:
+                sink(utt)
+            results.append(utt)
+        return EvaluationResult(self.MODEL_NAME, results)
+
+
+    def evaluate(self, data_path, remove_scp=True, num_workers=1, csv_path="default"):
         """
         This method is used to decode a wav file/directory.
         Parameters:
             - data_path (string): full path of the data directory containing
               wav files to be decoded, or just a wav-file.
-            - remove_scp (bool): remove transcription file wav.scp that is created
-              for decoding.
+            - remove_scp (bool): kept for backward compatibility, no transcription
+              file is written anymore.
+            - num_workers (int): number of processes used for decoding. When it's
+              bigger than one, the wav files are split into num_workers shards that
+              are decoded in parallel.
+            - csv_path (string): path of the csv file, "<model_name>_decoding.csv" by
+              default and None to skip writing it. It just has the header when
+              data_path contains one file.
         Returns:
             - accuracy (int): The accuracy of the the model over these wav files.
-            (In case of wav.scp contains just one file)
+            (In case of data_path contains just one file)
             - Returns the true word & predicted word
-            (In case of wav.scp contains more than one file)
+            (In case of data_path contains more than one file)
             - model_decoded (csv file): It also returns a csv file where a more detailed
               results about the decoding process can be found!!
         """
-        #create transcription file
-        self.__create_transcription(data_path)
-        #create pipeline
-        pipeline = self.__make_feat_pipeline()
-        #words of the data
-        WORDS = ["صفر", "واحد", "إثنان", "ثلاثة", "أربعة", "خمسة",
-                 "ستة", "سبعة", "ثمانية", "تسعة", "التنشيط", "التحويل",
-                 "الرصيد", "التسديد", "نعم", "لا", "التمويل", "البيانات",
-                 "الحساب", "إنهاء"]
-        #start decoding
-        with open("wav.scp", "r") as fin:
-            num_wavs = len(fin.readlines())
-        
-        with open("{}_decoding.csv".format(self.MODEL_NAME), 'w') as fout:
-            #write csv header
-            fout.write("{},{},{},{}\n".format("Filename", "TrueWord", "Predicted", "Likelihood"))
-            correct = 0.
-            #iterate over wav features
-            for key, feats in SequentialMatrixReader(pipeline):
-                true_word_id = int(key.split(".")[-1])-1
-                true_word = WORDS[true_word_id]
-                out = self.ASR.decode(feats)
-                if num_wavs > 1:
-                    fout.write("{},{},{},{}\n".format(key, true_word, out["text"], out["likelihood"]))
-                #was it correct??
+        result = self.decode_items(list_wav_files(data_path), num_workers)
+        single = len(result.utterances) == 1
+        if single:
+            utt = result.utterances[0]
+            print("TrueWord:", utt.true_word)
+            print("PredictedWord:", utt.text)
+            print("Likelihood:", utt.likelihood)
+        if csv_path is not None:
+            if csv_path == "default":
+                csv_path = "{}_decoding.csv".format(self.MODEL_NAME)
+            #a single file is just printed, so its csv has the header only
+            result.write_csv(csv_path, header_only=single)
+        return result.accuracy
+
+
+
+class IsolatedWordScorer():
+
+    def __init__(self, model, base_dir, words=WORDS, beam=10.0,
+                 acoustic_scale=0.1, prune_interval=10):
+        """
+        This method is used to score utterances of the isolated-word corpus
+        against every word of the vocabulary. Each word has its own small
+        alignment graph which is constrained to that word instead of the whole
+        HCLG.fst. The graphs are compiled once per model and shared by all the
+        scorers (see LoadedModel.compile_word_graphs()), only the decoders
+        belong to this scorer.
+        Parameters:
+            - model (LoadedModel): the model shared through MODEL_REGISTRY.
+            - base_dir (string): full path where data/lang & the models are located
+            - words (list): the vocabulary (the words of the data by default).
+            - beam (float): the decoding beam. It's applied inside every graph and
+              across the words as if they were the branches of one graph: a word
+              whose best path falls out of the beam of the best word is dropped
+              early and gets None as a likelihood.
+            - acoustic_scale (float): the scale of the acoustic likelihoods.
+            - prune_interval (int): the number of frames between two pruning
+              steps across the words.
+        This method sets these member variables:
+            - WORDS: same as words
+            - BEAM, ACOUSTIC_SCALE, PRUNE_INTERVAL: same as beam, acoustic_scale,
+              prune_interval
+            - model: same as model
+            - DECODERS: a decoder over the compiled graph of every word.
+        """
+        self.WORDS = words
+        self.BEAM = beam
+        self.ACOUSTIC_SCALE = acoustic_scale
+        self.PRUNE_INTERVAL = prune_interval
+        self.model = model
+        decoder_opts = FasterDecoderOptions()
+        decoder_opts.beam = beam
+        graphs = model.compile_word_graphs(os.path.join(base_dir, "data", "lang"), words)
+        self.DECODERS = [FasterDecoder(graph, decoder_opts) for graph in graphs]
+
+
+    def __best_cost(self, decoder, use_final_probs):
+        """
+        This private method returns the cost of the best path of the decoder
+        so far (inf if there is no path).
+        """
+        try:
+            best_path = decoder.get_best_path(use_final_probs)
+        except RuntimeError:
+            return float("inf")
+        _, _, weight = get_linear_symbol_sequence(best_path)
+        return weight.value1 + weight.value2
+
+
+    def score(self, feats):
+        """
+        This method is used to score the features against every word. All the
+        words are decoded frame by frame together over the same decodable, and
+        every PRUNE_INTERVAL frames, the words out of the beam are dropped.
+        Returns:
+            - the ranked list of rank_likelihoods().
+        """
+        decodable = DecodableAmDiagGmmScaled(self.model.acoustic_model,
+                                             self.model.transition_model,
+                                             feats, self.ACOUSTIC_SCALE)
+        num_frames = decodable.num_frames_ready()
+        active = list(range(len(self.WORDS)))
+        for decoder in self.DECODERS:
+            decoder.init_decoding()
+        costs = np.full(len(self.WORDS), np.inf)
+        frame = 0
+        while frame < num_frames:
+            step = min(self.PRUNE_INTERVAL, num_frames - frame)
+            for i in active:
+                self.DECODERS[i].advance_decoding(decodable, step)
+            frame += step
+            if frame < num_frames:
+                for i in active:
+                    costs[i] = self.__best_cost(self.DECODERS[i], use_final_probs=False)
+                best = costs[active].min()
+                active = [i for i in active if costs[i] <= best + self.BEAM]
+        costs[:] = np.inf
+        for i in active:
+            #same as the aligner, a path must end in a final state
+            if self.DECODERS[i].reached_final():
+                costs[i] = self.__best_cost(self.DECODERS[i], use_final_probs=True)
+        return rank_likelihoods(self.WORDS, -costs)
+
+
+
+class MultiRecognizer():
+
+    def __init__(self, base_dir, model_names, kaldi_dir, cache_dir=None):
+        """
+        This method is used to load several models that decode the same
+        audio while computing the shared part of their features just once.
+        Parameters:
+            - base_dir (string): full path where the trained models are located
+            - model_names (list): the names of the models (see Recognizer).
+            - kaldi_dir (string): full path of the kaldi directory.
+            - cache_dir (string): directory of the on-disk feature cache.
+        This method sets these member variables:
+            - MODEL_NAMES: same as model_names
+            - RECOGNIZERS: an ordered dictionary mapping each model name to its Recognizer
+        """
+        assert len(model_names) > 0, "You have to provide at least one model name"
+        self.MODEL_NAMES = [name.lower() for name in model_names]
+        self.RECOGNIZERS = OrderedDict()
+        for name in self.MODEL_NAMES:
+            self.RECOGNIZERS[name] = Recognizer(base_dir, name, kaldi_dir, cache_dir)
+
+
+    def __decode_all(self, waveform, samp_freq):
+        """
+        This private method is used to decode one waveform with all the models.
+        MFCC + CMVN are computed once, deltas are computed once for all the
+        delta models, splicing is computed once for all the LDA+MLLT models and
+        only final.mat is applied per model.
+        Returns:
+            - an ordered dictionary mapping each model name to its decoding output.
+        """
+        first = self.RECOGNIZERS[self.MODEL_NAMES[0]]
+        base = first.FEATS.compute_base(waveform, samp_freq)
+        contexts = {}
+        outputs = OrderedDict()
+        for name, rec in self.RECOGNIZERS.items():
+            is_delta = name in DELTA_MODELS
+            if is_delta not in contexts:
+                contexts[is_delta] = rec.FEATS.add_context(base)
+            feats = rec.FEATS.apply_transform(contexts[is_delta])
+            outputs[name] = rec.ASR.decode(feats)
+        return outputs
+
+
+    def evaluate(self, data_path, csv_path="multi_decoding.csv"):
+        """
+        This method is used to decode a wav file/directory with all the models
+        reading and featurizing every wav file just once.
+        Parameters:
+            - data_path (string): full path of the data directory containing
+              wav files to be decoded, or just a wav-file.
+            - csv_path (string): path of the csv file where the prediction and
+              the likelihood of every model are written for every wav file.
+        Returns:
+            - an ordered dictionary mapping each model name to its accuracy.
+        """
+        correct = OrderedDict((name, 0.) for name in self.MODEL_NAMES)
+        rows = []
+        for key, wav_path in list_wav_files(data_path):
+            true_word = get_true_word(key)
+            row = [key, true_word]
+            outputs = self.__decode_all(*read_wav_file(wav_path))
+            for name, out in outputs.items():
+                row.extend([out["text"], out["likelihood"]])
                 if true_word == out["text"]:
-                    correct+=1.
-            if num_wavs == 1:
-                print("TrueWord:", true_word)
-                print("PredictedWord:", out["text"])
-                print("Likelihood:", out["likelihood"])
-        #remove wav.scp
-        os.remove("wav.scp")
-        return correct/num_wavs
+                    correct[name] += 1.
+            rows.append(row)
+        num_wavs = len(rows)
+        assert num_wavs > 0, "No wav files were found in: {}".format(data_path)
+        header = ["Filename", "TrueWord"]
+        for name in self.MODEL_NAMES:
+            header.extend([name+"_Predicted", name+"_Likelihood"])
+        write_csv_atomically(csv_path, header, rows)
+        return OrderedDict((name, c/num_wavs) for name, c in correct.items())
+
+
+
+class DecodingStream():
+
+    def __init__(self, model, decoder, pipeline, samp_freq, acoustic_scale=0.1):
+        """
+        This method is used to define the class member variables.
+        Parameters:
+            - model (LoadedModel): the model shared through MODEL_REGISTRY.
+            - decoder (LatticeFasterDecoder): the decoder of this stream only.
+            - pipeline (FeaturePipeline): the feature pipeline of the model.
+            - samp_freq (float): the sampling frequency of the incoming audio.
+            - acoustic_scale (float): the scale of the acoustic likelihoods.
+        NOTE: Use Recognizer.open_stream() instead of creating it directly.
+        """
+        self.model = model
+        self.decoder = decoder
+        self.acoustic_scale = acoustic_scale
+        self.features = FeatureStream(pipeline, samp_freq)
+        #holds the log-likelihoods of the frames that aren't decoded yet only,
+        #the decoded ones are discarded as new frames are appended
+        self.decodable = DecodableMatrixMappedOffset(model.transition_model)
+        self.decoder.init_decoding()
+
+
+    def __advance(self, new_feats):
+        """
+        This private method is used to advance the decoder over the new
+        frames only. Their scaled pdf log-likelihoods are appended to the
+        decodable, which keeps the absolute frame index of its first row.
+        """
+        if new_feats.num_rows == 0:
+            return
+        loglikes = self.acoustic_scale * self.model.pdf_log_likelihoods(new_feats.numpy())
+        decoded = self.decoder.num_frames_decoded() - self.decodable.first_available_frame()
+        self.decodable.accept_loglikes(Matrix(loglikes.astype(np.float32)), decoded)
+        self.decoder.advance_decoding(self.decodable)
+
+
+    def __best_path_result(self, use_final_probs):
+        """
+        This private method returns the text & likelihood of the best path
+        found by the decoder so far.
+        """
+        if self.decoder.num_frames_decoded() == 0:
+            return {"text": "", "likelihood": 0.0}
+        best_path = self.decoder.get_best_path(use_final_probs)
+        _, words, weight = get_linear_symbol_sequence(best_path)
+        text = " ".join(self.model.symbols.find_symbol(word) for word in words)
+        return {"text": text, "likelihood": - (weight.value1 + weight.value2)}
+
+
+    def accept_waveform(self, chunk):
+        """
+        This method is used to feed a new chunk of audio to the decoder.
+        Parameters:
+            - chunk (numpy array): the audio samples in the range of 16-bit integers.
+        """
+        self.__advance(self.features.accept_waveform(chunk))
+
+
+    def partial_result(self):
+        """
+        This method returns the best hypothesis of the audio received so far.
+        Returns:
+            - a dictionary containing the "text" and the "likelihood".
+        """
+        return self.__best_path_result(use_final_probs=False)
+
+
+    def finalize(self):
+        """
+        This method is used to mark the end of the audio and get the final result.
+        Returns:
+            - a dictionary containing the "text" and the "likelihood".
+        """
+        self.__advance(self.features.finalize())
+        self.decodable.input_is_finished()
+        self.decoder.finalize_decoding()
+        return self.__best_path_result(self.decoder.reached_final())
 
 
 
@@ -202,6 +714,10 @@ if __name__ == "__main__":
     #decode
     # path = "/media/anwar/D/Data/ASR/hyprid/Moaz"
     path = "/media/anwar/D/Data/ASR/IST-Dataset_mono"
-    score = rec.evaluate(path, remove_scp=True)
+    score = rec.evaluate(path, remove_scp=True, num_workers=os.cpu_count())
     print("Accuracy: {}%".format(score*100))
-    
\ No newline at end of file
+
+    #compare all the models using just one feature pass
+    # multi_rec = MultiRecognizer(base_dir, AVAILABLE_MODEL_NAMES, kaldi_dir)
+    # for name, score in multi_rec.evaluate(path).items():
+    #     print("{:<6} Accuracy: {}%".format(name, score*100))
@@ -0,0 +1,412 @@
+import json
+import time
+import socket
+import asyncio
+import argparse
+import http.client
+import numpy as np
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from audio import read_wav_bytes
+
+
+#the warm recognizer of each worker process
+_WORKER_RECOGNIZER = None
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                413: "Payload Too Large", 500: "Internal Server Error",
+                503: "Service Unavailable"}
+
+
+def _init_worker(recognizer_factory):
+    """
+    This function is used as the initializer of the worker processes. It
+    creates the recognizer once and loads its model, so the model is ready
+    before the first request arrives.
+    """
+    global _WORKER_RECOGNIZER
+    _WORKER_RECOGNIZER = recognizer_factory()
+    _WORKER_RECOGNIZER.ASR
+
+
+def _decode_batch(wav_batch):
+    """
+    This function is used to decode a batch of wav files inside a worker process.
+    Parameters:
+        - wav_batch (list): the content (bytes) of every wav file.
+    Returns:
+        - a list of dictionaries containing "text" and "likelihood" (or "error"
+          and the HTTP "status" of the error: 400 for malformed wav files and
+          500 for decoding failures) following the same order of wav_batch.
+    """
+    results = []
+    for data in wav_batch:
+        try:
+            samples, samp_freq = read_wav_bytes(data)
+        except Exception as e:
+            results.append({"error": "Malformed wav file: {}".format(str(e) or type(e).__name__),
+                            "status": 400})
+            continue
+        try:
+            out = _WORKER_RECOGNIZER.decode_waveform(samples, samp_freq)
+            result = {"text": out["text"], "likelihood": out["likelihood"]}
+            if "nbest" in out:
+                result["nbest"] = out["nbest"]
+            results.append(result)
+        except Exception as e:
+            results.append({"error": str(e), "status": 500})
+    return results
+
+
+
+class DecodingServer():
+
+    def __init__(self, recognizer_factory, num_workers=2, max_batch_size=8,
+                 max_wait_ms=10, max_queue_size=64, max_concurrency=None,
+                 max_body_size=10*1024**2):
+        """
+        This method is used to define a local decoding server. The requests are
+        queued and grouped into micro-batches that are sent to a pool of worker
+        processes, each of them holding a warm Recognizer.
+        Parameters:
+            - recognizer_factory (callable): a picklable function that creates the
+              recognizer of a worker, like partial(Recognizer, base_dir, model_name, kaldi_dir)
+            - num_workers (int): number of worker processes.
+            - max_batch_size (int): maximum number of requests in a batch.
+            - max_wait_ms (float): maximum time to wait for a batch to be filled.
+            - max_queue_size (int): maximum number of waiting requests. When the queue
+              is full, new requests are rejected with 503 (backpressure).
+            - max_concurrency (int): maximum number of batches being decoded at
+              the same time (num_workers by default).
+            - max_body_size (int): maximum size of a wav file in bytes.
+        """
+        self.RECOGNIZER_FACTORY = recognizer_factory
+        self.NUM_WORKERS = num_workers
+        self.MAX_BATCH_SIZE = max_batch_size
+        self.MAX_WAIT = max_wait_ms / 1000.
+        self.MAX_QUEUE_SIZE = max_queue_size
+        self.MAX_CONCURRENCY = max_concurrency if max_concurrency else num_workers
+        self.MAX_BODY_SIZE = max_body_size
+        #metrics
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_rejected = 0
+        self.num_cancelled = 0
+        #created by start()
+        self.executor = None
+        self.queue = None
+        self.semaphore = None
+        self.server = None
+        self.batcher = None
+
+
+    async def start(self, host="127.0.0.1", port=8000, unix_socket=None):
+        """
+        This method is used to start the worker processes and listen to
+        the requests over TCP (host:port) or over a Unix socket.
+        """
+        self.executor = self.__create_executor()
+        self.queue = asyncio.Queue(maxsize=self.MAX_QUEUE_SIZE)
+        self.semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        self.batcher = asyncio.ensure_future(self.__batch_loop())
+        if unix_socket:
+            self.server = await asyncio.start_unix_server(self.__handle, path=unix_socket)
+        else:
+            self.server = await asyncio.start_server(self.__handle, host, port)
+
+
+    def __create_executor(self):
+        return ProcessPoolExecutor(self.NUM_WORKERS, initializer=_init_worker,
+                                   initargs=(self.RECOGNIZER_FACTORY,))
+
+
+    async def stop(self):
+        """
+        This method is used to stop listening and shut the workers down.
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.executor.shutdown(wait=True)
+
+
+    async def decode(self, wav_bytes):
+        """
+        This method is used to decode a wav file through the batching queue.
+        When this coroutine is cancelled, the request is cancelled as well and
+        it's skipped by the batches if it hasn't been sent yet.
+        Returns:
+            - a dictionary containing "text", "likelihood" and "latency_ms"
+              (or "error" and its HTTP "status"), or None if the queue is full.
+        """
+        start = time.time()
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((wav_bytes, future))
+        except asyncio.QueueFull:
+            self.num_rejected += 1
+            return None
+        try:
+            result = await future
+        except asyncio.CancelledError:
+            future.cancel()
+            self.num_cancelled += 1
+            raise
+        latency = time.time() - start
+        self.num_requests += 1
+        if "error" in result:
+            self.num_errors += 1
+        else:
+            self.latencies.append(latency)
+        result["latency_ms"] = latency * 1000.
+        return result
+
+
+    async def __batch_loop(self):
+        """
+        This private method is used to group the queued requests into batches.
+        A batch is sent once it's full or once the first request of the batch
+        has been waiting for MAX_WAIT seconds.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.MAX_WAIT
+            while len(batch) < self.MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            #waits here when all the workers are busy, so the queue fills up
+            await self.semaphore.acquire()
+            #the requests of the clients that went away aren't decoded
+            batch = [(wav_bytes, future) for wav_bytes, future in batch
+                     if not future.cancelled()]
+            if not batch:
+                self.semaphore.release()
+                continue
+            asyncio.ensure_future(self.__run_batch(batch))
+
+
+    async def __run_batch(self, batch):
+        """
+        This private method is used to decode a batch in the process pool
+        and set the result of every request.
+        """
+        loop = asyncio.get_event_loop()
+        self.batch_sizes.append(len(batch))
+        executor = self.executor
+        try:
+            results = await loop.run_in_executor(executor, _decode_batch,
+                                                 [wav_bytes for wav_bytes, _ in batch])
+        except BrokenProcessPool as e:
+            #a worker died (e.g. killed by the OOM killer), so the pool is replaced
+            #once by the first batch that notices it
+            if self.executor is executor:
+                self.executor = self.__create_executor()
+                executor.shutdown(wait=False)
+            results = [{"error": "A worker process died: {}".format(e), "status": 500}] \
+                * len(batch)
+        except Exception as e:
+            results = [{"error": str(e), "status": 500}] * len(batch)
+        finally:
+            self.semaphore.release()
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(dict(result))
+
+
+    def metrics(self):
+        """
+        This method returns a summary of the server metrics where the
+        latencies are in milliseconds.
+        """
+        latencies = np.array(self.latencies) * 1000.
+        summary = {
+            "requests": self.num_requests,
+            "errors": self.num_errors,
+            "rejected": self.num_rejected,
+            "cancelled": self.num_cancelled,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.,
+        }
+        for p in [50, 95, 99]:
+            summary["p{}_ms".format(p)] = \
+                float(np.percentile(latencies, p)) if len(latencies) else 0.
+        return summary
+
+
+    async def __handle(self, reader, writer):
+        """
+        This private method is used to handle one HTTP connection:
+            - POST /decode: the body is the wav file, returns the decoding result.
+            - GET /metrics: returns the server metrics.
+        """
+        try:
+            response = await self.__route(reader, writer)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            response = 400, {"error": str(e)}
+        except Exception as e:
+            response = 500, {"error": str(e)}
+        try:
+            #the client has closed the connection
+            if response is None:
+                return
+            status, body = response
+            payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            writer.write("HTTP/1.1 {} {}\r\n".format(status, HTTP_REASONS[status]).encode())
+            writer.write(b"Content-Type: application/json; charset=utf-8\r\n")
+            writer.write("Content-Length: {}\r\n".format(len(payload)).encode())
+            writer.write(b"Connection: close\r\n\r\n")
+            writer.write(payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def __route(self, reader, writer):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise ValueError("Malformed request line")
+        method, path, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics()
+        if method != "POST" or path != "/decode":
+            return 404, {"error": "Unknown endpoint: {} {}".format(method, path)}
+        length = int(headers.get("content-length", 0))
+        if length > self.MAX_BODY_SIZE:
+            return 413, {"error": "The wav file is too big"}
+        wav_bytes = await reader.readexactly(length)
+        #the request is cancelled if the connection is lost before the result is
+        #ready. The transport tells it (a client that just shuts its writing side
+        #down after sending the body is still waiting for the result)
+        decoding = asyncio.ensure_future(self.decode(wav_bytes))
+        closed = asyncio.ensure_future(writer.wait_closed())
+        await asyncio.wait([decoding, closed], return_when=asyncio.FIRST_COMPLETED)
+        if not decoding.done():
+            decoding.cancel()
+            return None
+        closed.cancel()
+        result = decoding.result()
+        if result is None:
+            return 503, {"error": "The server is busy, try again later"}
+        return result.pop("status", 200), result
+
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, unix_socket, timeout=60):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.unix_socket = unix_socket
+
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+
+
+class DecodingClient():
+
+    def __init__(self, host="127.0.0.1", port=8000, unix_socket=None, timeout=60):
+        """
+        This method is used to define a simple client of DecodingServer that
+        can be used for testing the server locally.
+        """
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+
+
+    def __request(self, method, path, body=None):
+        if self.unix_socket:
+            conn = UnixHTTPConnection(self.unix_socket, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request(method, path, body=body,
+                         headers={"Content-Type": "audio/wav"} if body else {})
+            response = conn.getresponse()
+            return response.status, json.loads(response.read().decode("utf-8"))
+        finally:
+            conn.close()
+
+
+    def decode(self, wav_path):
+        """
+        This method sends a wav file to the server.
+        Returns:
+            - the HTTP status and the decoding result.
+        """
+        with open(wav_path, "rb") as fin:
+            return self.__request("POST", "/decode", fin.read())
+
+
+    def metrics(self):
+        """
+        This method returns the metrics of the server.
+        """
+        return self.__request("GET", "/metrics")[1]
+
+
+
+async def serve(server, host, port, unix_socket):
+    await server.start(host, port, unix_socket)
+    print("Listening on {}".format(unix_socket if unix_socket else "{}:{}".format(host, port)))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local decoding server that takes "
+                                     "wav files over HTTP and returns their text as JSON.")
+    parser.add_argument("base_dir", help="full path where the trained models are located")
+    parser.add_argument("model_name", help="the name of the model like tri3d")
+    parser.add_argument("kaldi_dir", help="full path of the kaldi directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None,
+                        help="listen to this Unix socket instead of host:port")
+    parser.add_argument("--num-workers", type=int, default=2)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--max-queue-size", type=int, default=64)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    args = parser.parse_args()
+
+    #only the workers create recognizers (through the factory)
+    from recognizer import Recognizer
+    factory = partial(Recognizer, args.base_dir, args.model_name, args.kaldi_dir)
+    server = DecodingServer(factory, num_workers=args.num_workers,
+                            max_batch_size=args.max_batch_size,
+                            max_wait_ms=args.max_wait_ms,
+                            max_queue_size=args.max_queue_size,
+                            max_concurrency=args.max_concurrency)
+    try:
+        asyncio.get_event_loop().run_until_complete(
+            serve(server, args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,8 @@
+import os
+import sys
+
+
+#the tests import the modules of Kaldi/ and the libs package of archive/steps
+KALDI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(KALDI_DIR, "archive", "steps"))
+sys.path.insert(0, KALDI_DIR)
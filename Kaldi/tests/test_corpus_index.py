@@ -0,0 +1,39 @@
+import os
+
+from corpus_index import CorpusIndex
+
+
+def make_corpus(root, names):
+    for name in names:
+        speaker_dir = root / name.split(".")[0]
+        speaker_dir.mkdir(parents=True, exist_ok=True)
+        (speaker_dir / name).write_bytes(b"RIFF" + b"\0" * 40)
+
+
+def test_reuses_the_saved_index(tmp_path):
+    make_corpus(tmp_path / "corpus", ["S01.01.01.wav", "S01.01.02.wav", "S02.01.01.wav"])
+    index_path = str(tmp_path / "index.json")
+    index = CorpusIndex(str(tmp_path / "corpus"), index_path)
+    assert index.speakers() == ["S01", "S02"]
+    assert [entry.word for entry in index.select(["S01"], [2])] == [2]
+    assert CorpusIndex(str(tmp_path / "corpus"), index_path).entries == index.entries
+
+
+def test_detects_files_overwritten_in_place(tmp_path):
+    make_corpus(tmp_path / "corpus", ["S01.01.01.wav", "S01.01.02.wav"])
+    index_path = str(tmp_path / "index.json")
+    CorpusIndex(str(tmp_path / "corpus"), index_path)
+    speaker_dir = tmp_path / "corpus" / "S01"
+    dir_stat = os.stat(str(speaker_dir))
+    edited = speaker_dir / "S01.01.02.wav"
+    edited.write_bytes(b"RIFF" + b"\0" * 100)
+    #make sure that only the file looks modified
+    os.utime(str(edited), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns + 10**9))
+    os.utime(str(speaker_dir), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+    stat = os.stat(str(edited))
+    index = CorpusIndex(str(tmp_path / "corpus"), index_path)
+    entry = index.select(["S01"], [2])[0]
+    assert (entry.size, entry.mtime) == (stat.st_size, stat.st_mtime)
+    #the refreshed entries are saved as well
+    entry = CorpusIndex(str(tmp_path / "corpus"), index_path).select(["S01"], [2])[0]
+    assert entry.size == stat.st_size
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from libs.common import read_binary_object, read_mat_ark_binary, write_mat_ark_binary, \
+    ScpReader
+
+
+def random_features(num_rows=100, num_cols=13, seed=0):
+    rng = np.random.RandomState(seed)
+    return (rng.standard_normal((num_rows, num_cols)) * 5 + 10).astype(np.float32)
+
+
+def test_uncompressed_round_trip(tmp_path):
+    items = [("utt1", random_features()),
+             ("utt2", random_features(7, 3, seed=1).astype(np.float64)),
+             ("spk1", np.arange(5, dtype=np.float32)),
+             ("spk2", np.arange(4, dtype=np.float64))]
+    ark, scp = str(tmp_path / "feats.ark"), str(tmp_path / "feats.scp")
+    write_mat_ark_binary(ark, items, scp)
+    for (key, obj), (read_key, read_obj) in zip(items, read_mat_ark_binary(ark)):
+        assert key == read_key
+        assert read_obj.dtype == obj.dtype
+        np.testing.assert_array_equal(read_obj, obj)
+    feats = ScpReader(scp)
+    np.testing.assert_array_equal(feats["utt2"], items[1][1])
+
+
+@pytest.mark.parametrize("compression, token, step", [
+    #kOneByteWithColHeaders: one byte between the percentiles of each column
+    ("CM", b"CM ", 1. / 63.),
+    #kTwoByte & kOneByte: two bytes or one byte in the global range
+    ("CM2", b"CM2 ", 1. / 65535.),
+    ("CM3", b"CM3 ", 1. / 255.),
+])
+@pytest.mark.parametrize("num_rows", [100, 3])
+def test_compressed_round_trip(tmp_path, compression, token, step, num_rows):
+    mats = [random_features(num_rows), random_features(num_rows, 40, seed=1)]
+    ark = str(tmp_path / "feats.ark")
+    write_mat_ark_binary(ark, [("utt1", mats[0]), ("utt2", mats[1])],
+                         compression=compression)
+    with open(ark, "rb") as fin:
+        assert fin.read().startswith(b"utt1 \0B" + token)
+    read = list(read_mat_ark_binary(ark))
+    assert [key for key, _ in read] == ["utt1", "utt2"]
+    for mat, (_, read_mat) in zip(mats, read):
+        assert read_mat.shape == mat.shape and read_mat.dtype == np.float32
+        #the quantization error is at most half a step of the coded range
+        #(the whole range of the matrix at most)
+        value_range = mat.max() - mat.min()
+        assert np.abs(read_mat - mat).max() <= value_range * step + 1e-4
+
+
+def test_compressed_empty_and_constant_matrices(tmp_path):
+    ark = str(tmp_path / "feats.ark")
+    items = [("empty", np.zeros((0, 13), dtype=np.float32)),
+             ("constant", np.full((10, 4), 3.5, dtype=np.float32))]
+    for compression in ("CM", "CM2", "CM3"):
+        write_mat_ark_binary(ark, items, compression=compression)
+        read = dict(read_mat_ark_binary(ark))
+        assert read["empty"].size == 0
+        np.testing.assert_allclose(read["constant"], items[1][1], atol=1e-3)
+
+
+def test_unsupported_token():
+    with pytest.raises(ValueError):
+        read_binary_object(b"\0BXY \x04\x00\x00\x00\x00")
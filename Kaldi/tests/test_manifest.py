@@ -0,0 +1,18 @@
+from manifest import remove_stale_features
+
+
+def test_remove_stale_features(tmp_path):
+    for path in ["data/train/feats.scp", "mfcc/raw_mfcc_train.8.ark",
+                 "mfcc/raw_mfcc_test.1.ark", "exp/mono/final.mdl"]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    (tmp_path / "stale_artefacts.txt").write_text(
+        "data/train/feats.scp\nexp/mono\nmfcc/raw_mfcc_test.1.ark\nmfcc/raw_mfcc_train.8.ark\n")
+    removed = remove_stale_features(str(tmp_path), "train")
+    assert sorted(removed) == ["data/train/feats.scp", "mfcc/raw_mfcc_train.8.ark"]
+    assert not (tmp_path / "mfcc/raw_mfcc_train.8.ark").exists()
+    #the other artefacts are still reported for prepare.sh
+    assert (tmp_path / "mfcc/raw_mfcc_test.1.ark").exists()
+    assert (tmp_path / "stale_artefacts.txt").read_text() == \
+        "exp/mono\nmfcc/raw_mfcc_test.1.ark\n"
+    assert remove_stale_features(str(tmp_path / "missing"), "train") == []
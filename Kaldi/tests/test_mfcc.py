@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pytest
+
+from audio import read_wav_file
+from libs.common import read_mat_ark_binary
+from mfcc import NumpyMfcc
+
+
+#the reference features of the wav files of tests/data were computed with
+#--use-energy=false --dither=0 by kaldi-native-fbank (a port of Kaldi's
+#feature extraction) after resampling utt_44k.wav to 16kHz with the windowed
+#sinc of Kaldi's LinearResample (lowpass-filter-width=6, cutoff=0.99*8000)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+REFERENCE = dict(read_mat_ark_binary(os.path.join(DATA_DIR, "ref_mfcc.ark")))
+
+
+@pytest.fixture
+def mfcc():
+    mfcc = NumpyMfcc()
+    mfcc.CONFIG["dither"] = 0.
+    mfcc.CONFIG["allow-downsample"] = True
+    return mfcc
+
+
+@pytest.mark.parametrize("utt_id", ["utt_16k", "utt_44k"])
+def test_agrees_with_kaldi(mfcc, utt_id):
+    samples, samp_freq = read_wav_file(os.path.join(DATA_DIR, utt_id + ".wav"))
+    feats = mfcc.compute(samples, samp_freq)
+    assert feats.shape == REFERENCE[utt_id].shape
+    #Kaldi computes the features in float32
+    np.testing.assert_allclose(feats, REFERENCE[utt_id], rtol=1e-3, atol=1e-3)
+
+
+def test_requires_resampled_audio():
+    samples, samp_freq = read_wav_file(os.path.join(DATA_DIR, "utt_44k.wav"))
+    mfcc = NumpyMfcc()
+    assert not mfcc.CONFIG["allow-downsample"]
+    with pytest.raises(ValueError):
+        mfcc.compute(samples, samp_freq)
+    with pytest.raises(ValueError):
+        mfcc.compute(samples[::4], samp_freq // 4)
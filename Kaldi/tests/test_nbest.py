@@ -0,0 +1,25 @@
+import json
+
+import numpy as np
+
+from nbest import nbest_output, rank_likelihoods
+
+
+WORDS = ["صفر", "واحد", "إثنان"]
+
+
+def test_ranks_the_words():
+    nbest = rank_likelihoods(WORDS, [-12., -10., -np.inf])
+    assert [item["word"] for item in nbest] == ["واحد", "صفر", "إثنان"]
+    assert nbest[2]["likelihood"] is None and nbest[2]["posterior"] == 0.
+    np.testing.assert_allclose(sum(item["posterior"] for item in nbest), 1.)
+    out = nbest_output(nbest)
+    assert (out["text"], out["likelihood"]) == ("واحد", -10.)
+
+
+def test_no_match():
+    out = nbest_output(rank_likelihoods(WORDS, [-np.inf] * len(WORDS)))
+    assert out["text"] == "" and out["likelihood"] is None
+    assert all(item["posterior"] == 0. for item in out["nbest"])
+    #no -Infinity in the JSON sent by the server
+    json.dumps(out, allow_nan=False)
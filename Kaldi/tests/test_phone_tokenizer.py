@@ -0,0 +1,22 @@
+import pytest
+
+from utils import PhoneTokenizer
+
+
+def test_tokenize_file_in_chunks(tmp_path):
+    streams = ["_wa2xd_", "", "_SfR_ _i2lm_", "_$@A_"] * 50
+    path = tmp_path / "words.txt.ph"
+    #the last line has no new line
+    path.write_text("\n".join(streams), encoding="utf-8")
+    tokenizer = PhoneTokenizer()
+    expected = list(tokenizer.tokenize_lines(streams))
+    assert expected[0] == ["w", "a2", "x", "d"]
+    assert list(tokenizer.tokenize_file(str(path))) == expected
+    assert list(tokenizer.tokenize_file(str(path), chunk_size=16)) == expected
+
+
+def test_tokenize_file_reports_the_line(tmp_path):
+    path = tmp_path / "words.txt.ph"
+    path.write_text("_wa2xd_\n" * 10 + "_wa2q_\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="line 11: Unknown phone 'q'"):
+        list(PhoneTokenizer().tokenize_file(str(path), chunk_size=16))
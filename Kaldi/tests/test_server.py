@@ -0,0 +1,122 @@
+import io
+import os
+import time
+import wave
+import socket
+import struct
+import asyncio
+
+import numpy as np
+import pytest
+
+from server import DecodingClient, DecodingServer
+
+
+#the sampling frequencies that make the stand-in recognizer fail or crash its worker
+FAILING_FREQ = 8000
+CRASHING_FREQ = 11025
+
+
+class StandInRecognizer():
+    """
+    A recognizer that takes 0.2 seconds to decode anything, so the server
+    can be tested without any trained model.
+    """
+
+    @property
+    def ASR(self):
+        return None
+
+
+    def decode_waveform(self, waveform, samp_freq):
+        if samp_freq == FAILING_FREQ:
+            raise RuntimeError("decoding failed")
+        if samp_freq == CRASHING_FREQ:
+            os._exit(1)
+        time.sleep(0.2)
+        return {"text": "نعم", "likelihood": -100.}
+
+
+def wav_bytes(samp_freq=16000):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as fout:
+        fout.setnchannels(1)
+        fout.setsampwidth(2)
+        fout.setframerate(samp_freq)
+        fout.writeframes(np.zeros(1600, dtype=np.int16).tobytes())
+    return buf.getvalue()
+
+
+def request(port, body, half_close=False, reset=False):
+    """
+    This function sends a raw POST /decode request. It returns the status
+    line, or None when the connection is reset right after sending.
+    """
+    sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+    sock.sendall("POST /decode HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(
+        len(body)).encode() + body)
+    if reset:
+        #close with RST instead of FIN
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        sock.close()
+        return None
+    if half_close:
+        sock.shutdown(socket.SHUT_WR)
+    response = sock.makefile("rb").readline().decode()
+    sock.close()
+    return response.strip()
+
+
+@pytest.fixture
+def server():
+    loop = asyncio.new_event_loop()
+    server = DecodingServer(StandInRecognizer, num_workers=1, max_batch_size=1,
+                            max_wait_ms=1)
+    loop.run_until_complete(server.start("127.0.0.1", 0))
+    port = server.server.sockets[0].getsockname()[1]
+    yield loop, server, port
+    loop.run_until_complete(server.stop())
+    loop.close()
+
+
+def run(loop, func, *args):
+    return loop.run_until_complete(loop.run_in_executor(None, func, *args))
+
+
+def test_status_codes(server):
+    loop, server, port = server
+    assert run(loop, request, port, wav_bytes()) == "HTTP/1.1 200 OK"
+    assert run(loop, request, port, b"not a wav file") == "HTTP/1.1 400 Bad Request"
+    assert run(loop, request, port, wav_bytes(FAILING_FREQ)) == \
+        "HTTP/1.1 500 Internal Server Error"
+    assert run(loop, DecodingClient(port=port).metrics)["errors"] == 2
+
+
+def test_half_closed_clients_get_their_result(server):
+    loop, server, port = server
+    assert run(loop, request, port, wav_bytes(), True) == "HTTP/1.1 200 OK"
+    assert server.metrics()["cancelled"] == 0
+
+
+def test_disconnected_clients_are_not_decoded(server):
+    loop, server, port = server
+    async def scenario():
+        #the first request keeps the only worker busy while the others wait
+        busy = loop.run_in_executor(None, request, port, wav_bytes())
+        await asyncio.sleep(0.05)
+        for _ in range(3):
+            await loop.run_in_executor(None, request, port, wav_bytes(), False, True)
+        assert await busy == "HTTP/1.1 200 OK"
+        await asyncio.sleep(0.5)
+    loop.run_until_complete(scenario())
+    metrics = server.metrics()
+    assert metrics["cancelled"] == 3
+    #only the first request reached a worker
+    assert list(server.batch_sizes) == [1]
+
+
+def test_recovers_from_a_dead_worker(server):
+    loop, server, port = server
+    assert run(loop, request, port, wav_bytes(CRASHING_FREQ)) == \
+        "HTTP/1.1 500 Internal Server Error"
+    assert run(loop, request, port, wav_bytes()) == "HTTP/1.1 200 OK"
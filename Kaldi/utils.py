@@ -1,4 +1,5 @@
 import os
+import re
 import shutil
 import subprocess
 from glob import glob
@@ -12,27 +13,170 @@ def safe_makedir(dirname):
         os.makedirs(dirname)
 
 
-def splitPhone(ph):
+#the phones used by the phonemizer (the non-silence phones of the lexicon)
+NON_SILENCE_PHONES = ['$', '@', 'A', 'P', 'R', 'S', 'T', 'a', 'a2',
+                      'b', 'd', 'f', 'h', 'i', 'i2', 'l', 'm', 'n',
+                      'r', 's', 't', 'w', 'x', 'y', '¥', '€']
+
+
+class PhoneTokenizer():
+
+    def __init__(self, phones=NON_SILENCE_PHONES, separators="_"):
+        """
+        This class is used to split streams of phonemes like "_SfR_" into the
+        phones of the given inventory. It isn't limited to one letter followed
+        by a digit as it's driven by the inventory: the phones are compiled
+        into one regex whose alternatives are sorted from the longest to the
+        shortest, so the longest phone always matches first.
+        Parameters:
+            - phones (list): the phone inventory.
+            - separators (string): characters that can separate the phones
+              and are ignored like the word boundaries "_" (white spaces
+              are always ignored).
+        """
+        self.PHONES = set(phones)
+        multi_chars = sorted([ph for ph in self.PHONES if len(ph) > 1],
+                             key=lambda ph: (-len(ph), ph))
+        single_chars = sorted(ph for ph in self.PHONES if len(ph) == 1)
+        alternatives = [re.escape(ph) for ph in multi_chars]
+        if single_chars:
+            #a character class is much faster than an alternative for every phone
+            alternatives.append("[{}]".format("".join(re.escape(ph) for ph in single_chars)))
+        self.PATTERN = re.compile("|".join(alternatives))
+        self.INVALID = re.compile(r"[^\s{}]".format(re.escape(separators)))
+        #the same regex matching the new lines & any invalid character too, to
+        #tokenize and check many lines at once
+        self.LINES_PATTERN = re.compile("|".join(alternatives + [r"\n", self.INVALID.pattern]))
+
+
+    def __check(self, text):
+        invalid = self.INVALID.search(self.PATTERN.sub("", text))
+        if invalid:
+            raise ValueError("Unknown phone '{}' in: {}".format(invalid.group(), text.strip()))
+
+
+    def tokenize(self, ph):
+        """
+        This method returns the list of phones of a stream of phonemes.
+        It raises ValueError if the stream contains anything that isn't
+        in the inventory.
+        >>> PhoneTokenizer().tokenize("_wa2xd_")
+        ['w', 'a2', 'x', 'd']
+        """
+        ph = ph.strip()
+        self.__check(ph)
+        return self.PATTERN.findall(ph)
+
+
+    def tokenize_lines(self, lines, first_line=1):
+        """
+        This method is a generator that yields the phones of every line,
+        so a whole file can be tokenized without loading it into memory.
+        The errors report the line numbers counted from first_line.
+        """
+        for line_number, line in enumerate(lines, first_line):
+            try:
+                yield self.tokenize(line)
+            except ValueError as e:
+                raise ValueError("line {}: {}".format(line_number, e))
+
+
+    def tokenize_file(self, path, chunk_size=4*1024**2):
+        """
+        This method is a generator that yields the phones of every line of
+        a file (one stream of phonemes per line). The file is read in chunks
+        of about chunk_size characters and every chunk is tokenized with one
+        pass of the regex, so it's faster than tokenizing line by line
+        and the file is never fully loaded into memory.
+        """
+        num_lines = 0
+        with open(path, encoding="utf-8") as fin:
+            while True:
+                lines = fin.readlines(chunk_size)
+                if not lines:
+                    break
+                if not lines[-1].endswith("\n"):
+                    lines[-1] += "\n"
+                tokens = self.LINES_PATTERN.findall("".join(lines))
+                if not set(tokens) <= self.PHONES | {"\n"}:
+                    #find the line of the error
+                    for _ in self.tokenize_lines(lines, num_lines+1):
+                        pass
+                    raise ValueError("Unknown phones in: {}".format(path))
+                #the phones of every line separated by spaces, one line per "\n"
+                tokens = " ".join(tokens).split("\n")
+                for line in tokens[:-1]:
+                    yield line.split()
+                num_lines += len(lines)
+
+
+#ioctl request that clones a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def is_up_to_date(src, dst):
+    """
+    This function checks whether dst has the same size and modification
+    time of src, which means that it doesn't need to be staged again.
+    """
+    if not os.path.exists(dst):
+        return False
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    return src_stat.st_size == dst_stat.st_size and \
+           src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+def reflink(src, dst):
+    """
+    This function creates a copy-on-write clone of src at dst. It fails with
+    OSError when the filesystem doesn't support it or when src & dst are
+    on different filesystems.
+    """
+    import fcntl
+    try:
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+    shutil.copystat(src, dst)
+
+
+def stage_file(src, dst, mode="auto"):
     """
-    This function is used to extract single phonemes out of a stream of
-    phonemes. It takes the phoneme stream as input and returns a list of
-    single phonemes.
-    >>> splitPhone("")
+    This function is used to make src available at dst without copying
+    its content when possible. The modes are:
+        - "auto": a hardlink, else a reflink, else a copy.
+        - "hardlink", "reflink", "symlink": only use this method.
+        - "copy": a normal copy that keeps the modification time.
+    Files that are already up-to-date are skipped.
+    Returns:
+        - the method used ("skipped", "hardlink", "reflink", "symlink" or "copy")
     """
-    ph = ph.strip()
-    ph = ph.strip("_")
-    length = len(ph)
-    output = []
-    for i in range(length-1):
-        if ph[i].isdigit():
-            continue
-        elif not ph[i].isdigit() and ph[i+1].isdigit():
-            output.append(ph[i] + ph[i+1])
-        else:
-            output.append(ph[i])
-    if not ph[length-1].isdigit():
-        output.append(ph[length-1])
-    return output
+    if is_up_to_date(src, dst):
+        return "skipped"
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode in ["auto", "hardlink"]:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            if mode == "hardlink":
+                raise
+    if mode in ["auto", "reflink"]:
+        try:
+            reflink(src, dst)
+            return "reflink"
+        except OSError:
+            if mode == "reflink":
+                raise
+    if mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+        return "symlink"
+    shutil.copy2(src, dst)
+    return "copy"
 
 
 def safe_create_symlink(src, dst):
@@ -58,10 +202,11 @@ def copy_regex(src, dst):
 
 
 
-def create_path_sh(data_dir):
+def create_path_sh(data_dir, num_jobs=1):
     """
     This function is used to create path.sh shell file based on the
-    data_dir input
+    data_dir input. It also exports the number of parallel jobs (num_jobs)
+    used by prepare.sh & run_*.sh
     """
     content =\
 """
@@ -75,6 +220,8 @@ export DATA_ROOT="{}"
 . $KALDI_ROOT/tools/env.sh
 # Variable needed for proper data sorting
 export LC_ALL=C
-""".format(data_dir)
+# Number of parallel jobs (data/{{train,test}}/split$NUM_JOBS are created by data_preparation.py)
+export NUM_JOBS={}
+""".format(data_dir, num_jobs)
     with open(os.path.join(data_dir, "path.sh"), "w") as fout:
         fout.write(content.strip())
\ No newline at end of file